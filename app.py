@@ -1,9 +1,32 @@
 import os
+import re
+import json
+import atexit
+import hashlib
+import mimetypes
 import uuid
-from flask import Flask, request, render_template_string, redirect, url_for, session, send_from_directory, jsonify
+import queue
+import signal
+import threading
+import time
+from collections import OrderedDict
+from flask import Flask, Request, Response, current_app, request, render_template, redirect, url_for, session, send_from_directory, jsonify, g
+from flask import before_render_template, template_rendered
+from jinja2 import DictLoader
+from markupsafe import Markup
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
+from assets import COMPRESSIBLE_TYPES, ENCODINGS, AssetManifest, accepted_encoding, compress
+from metrics import Registry
+from profiling import RequestProfiler
+from search import KINDS as SEARCH_KINDS, SearchIndex
+from snapshot import Snapshotter, load_snapshot
+from storage import FEED_SORTS, TOP_WINDOWS, MemoryStorage, VoteBuffer, open_storage
+from thumbnails import ThumbnailWorker, thumbnail_name
 
-app = Flask(__name__)
+# Static files are served by static_asset() below, under fingerprinted names.
+app = Flask(__name__, static_folder=None)
 # Use environment variable in production.
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "supersecretkey")
 
@@ -12,23 +35,349 @@ UPLOAD_FOLDER = os.path.join(os.getcwd(), 'uploads')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# Uploaded files never change once written (their names are content hashes,
+# or unique for older uploads), so they can be cached by browsers forever.
+UPLOAD_MAX_AGE = 365 * 24 * 3600
+# Let a front proxy send upload bytes itself: X-Sendfile (Apache, lighttpd)
+# or X-Accel-Redirect to an internal location mapped to UPLOAD_FOLDER (nginx).
+app.config['USE_X_SENDFILE'] = os.environ.get("USE_X_SENDFILE", "") == "1"
+app.config['UPLOADS_ACCEL_REDIRECT'] = os.environ.get("UPLOADS_ACCEL_REDIRECT")
+
+# Stylesheets and scripts, read and precompressed once at startup.
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+assets = AssetManifest(STATIC_FOLDER)
+# HTML and JSON responses at least this many bytes are compressed on the fly.
+app.config['COMPRESS_MIN_SIZE'] = 1024
+
+# Page templates, registered by name next to the routes that use them and
+# compiled once at startup instead of on every request.
+template_sources = {}
+app.jinja_loader = DictLoader(template_sources)
+
 # Allowed file extensions.
 ALLOWED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.mp4', '.webm', '.ogg', '.mp3', '.wav', '.pdf', '.zip'}
 
-# In-memory storage.
-# Each post: { id, title, text, filename, filetype, comments (list), upvotes, downvotes }
-posts = []
-# Global counter for comment IDs.
-comment_id_counter = 1
-# Chat messages.
-chat_messages = []  # Each: { username, message }
-
-# Dummy user data for login.
-# In production, use a persistent database with proper password hashing.
-users = {
-    "admin": "adminpass",
-    "user": "userpass"
+# Largest accepted upload for each file type, in bytes.
+UPLOAD_SIZE_LIMITS = {
+    'image': 10 * 1024 * 1024,
+    'video': 500 * 1024 * 1024,
+    'audio': 50 * 1024 * 1024,
+    'pdf': 50 * 1024 * 1024,
+    'zip': 200 * 1024 * 1024,
+    'other': 20 * 1024 * 1024
 }
+# Reject whole requests beyond the largest file plus room for the form fields,
+# before any of the body is read when the client sends Content-Length.
+app.config['MAX_CONTENT_LENGTH'] = max(UPLOAD_SIZE_LIMITS.values()) + 1024 * 1024
+
+
+class EventHub:
+    """
+    Publish/subscribe fan-out for Server-Sent Events.
+    Every subscriber gets a bounded queue; a subscriber that falls
+    ``max_pending`` events behind is evicted and its stream is closed, so one
+    slow client can never hold up publishers or grow memory without bound.
+    At most ``max_subscribers`` streams are open at once (0 turns streaming
+    off); clients turned away keep polling instead.
+    """
+
+    # Queued to a subscriber's stream once it has been evicted.
+    EVICTED = object()
+
+    def __init__(self, max_pending: int = 100, max_subscribers: int = 32):
+        self.max_pending = max_pending
+        self.max_subscribers = max_subscribers
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self) -> queue.Queue:
+        """A new subscriber's queue, or None if ``max_subscribers`` are already open."""
+        subscriber = queue.Queue(maxsize=self.max_pending)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue) -> None:
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event: str, data: dict) -> None:
+        # Encode once and share the payload across all subscribers.
+        payload = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(payload)
+            except queue.Full:
+                self._evict(subscriber)
+
+    def _evict(self, subscriber: queue.Queue) -> None:
+        self.unsubscribe(subscriber)
+        # Drop the backlog so the stream ends right away and frees its memory.
+        while True:
+            try:
+                subscriber.get_nowait()
+            except queue.Empty:
+                break
+        subscriber.put_nowait(self.EVICTED)
+
+
+class FragmentCache:
+    """
+    LRU cache of rendered HTML fragments, capped at ``max_bytes`` of UTF-8
+    encoded markup.
+    Each entry remembers the version it was rendered at, so bumping a post's
+    version is enough to invalidate every fragment rendered from it.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: tuple, version: int) -> str:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: tuple, version: int, html: str) -> str:
+        # Characters would undercount non-ASCII posts up to fourfold.
+        size = len(html.encode())
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[2]
+            if size <= self.max_bytes:
+                self._entries[key] = (version, html, size)
+                self.size += size
+            while self.size > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+        return html
+
+
+class UploadStream:
+    """
+    Destination for one uploaded file while the multipart body is parsed.
+    Chunks are written straight to a hidden ``.part`` file in the upload
+    folder and hashed as they arrive, and the upload is aborted with 413 as
+    soon as it passes ``limit``. ``commit`` stores the file under its content
+    hash; an upload that is never committed is deleted when the request closes.
+    """
+
+    def __init__(self, folder: str, limit: int):
+        self.folder = folder
+        self.limit = limit
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self.path = os.path.join(folder, f".{uuid.uuid4().hex}.part")
+        self._file = open(self.path, 'wb')
+        self.committed = False
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.size > self.limit:
+            self.close()
+            raise RequestEntityTooLarge(f"Uploaded file is larger than {self.limit} bytes.")
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        # The form parser rewinds the stream once the part is complete; the
+        # data is only ever consumed through commit(), so just flush it.
+        self._file.flush()
+        return 0
+
+    def commit(self, ext: str) -> str:
+        """
+        Store the upload as ``<sha256><ext>`` and return that file name.
+        Identical bytes always get the same name, so a repost reuses the file
+        that is already stored and its URL never changes.
+        """
+        self._file.close()
+        filename = self.sha256 + ext
+        path = os.path.join(self.folder, filename)
+        if os.path.exists(path):
+            os.remove(self.path)
+        else:
+            os.replace(self.path, path)
+        self.committed = True
+        return filename
+
+    def close(self) -> None:
+        self._file.close()
+        if not self.committed and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ForumRequest(Request):
+    """Request that streams file uploads into the upload folder instead of temp files."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if not filename:
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        limit = UPLOAD_SIZE_LIMITS[filetype_for(filename)]
+        if total_content_length is not None and total_content_length > limit + 1024 * 1024:
+            raise RequestEntityTooLarge(f"Uploaded file is larger than {limit} bytes.")
+        return UploadStream(current_app.config['UPLOAD_FOLDER'], limit)
+
+
+app.request_class = ForumRequest
+
+
+# Forum state lives in the configured storage backend: "memory" for tests
+# or "sqlite:///path/to/forum.db" (the default) to persist across restarts.
+storage = open_storage(os.environ.get("FORUM_STORAGE", "sqlite:///" + os.path.join(os.getcwd(), 'forum.db')),
+                       chat_capacity=int(os.environ.get("CHAT_CAPACITY", 500)),
+                       chat_archive_path=os.environ.get("CHAT_ARCHIVE_PATH"))
+
+# Previews for image and video posts are made in the background after upload.
+thumbnail_worker = ThumbnailWorker(UPLOAD_FOLDER, on_done=storage.touch_post,
+                                   max_workers=int(os.environ.get("THUMBNAIL_WORKERS", 2)))
+
+# Votes are buffered and written to storage in batches.
+vote_buffer = VoteBuffer(storage,
+                         flush_interval=float(os.environ.get("VOTE_FLUSH_INTERVAL", 1.0)),
+                         max_pending=int(os.environ.get("VOTE_FLUSH_SIZE", 500)))
+vote_buffer.start()
+atexit.register(vote_buffer.close)
+
+# The in-memory store can be snapshotted to SNAPSHOT_PATH, every
+# SNAPSHOT_INTERVAL seconds, on SIGUSR1 and at exit, and is restored from
+# it at startup, so restarts don't lose the forum.
+snapshot_path = os.environ.get("SNAPSHOT_PATH")
+snapshotter = None
+if snapshot_path and isinstance(storage, MemoryStorage):
+    if os.path.exists(snapshot_path):
+        load_started = time.perf_counter()
+        load_snapshot(storage, snapshot_path)
+        app.logger.info("Restored %s in %.2fs", snapshot_path, time.perf_counter() - load_started)
+    snapshotter = Snapshotter(storage, snapshot_path, interval=float(os.environ.get("SNAPSHOT_INTERVAL", 300)),
+                              before=vote_buffer.flush)
+    snapshotter.start()
+    atexit.register(snapshotter.close)
+    if hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR1, lambda signum, frame: snapshotter.request())
+
+# Live updates pushed to /events subscribers. Every open stream ties up a
+# worker thread for as long as the tab stays open, so EVENT_MAX_SUBSCRIBERS
+# must stay well below the threads a worker has; with sync workers, set it
+# to 0 and clients poll instead.
+event_hub = EventHub(max_pending=int(os.environ.get("EVENT_QUEUE_SIZE", 100)),
+                     max_subscribers=int(os.environ.get("EVENT_MAX_SUBSCRIBERS", 32)))
+
+# Full-text index behind /search, filled from storage on first use.
+search_index = SearchIndex(storage)
+
+
+# ------------------ Metrics ------------------
+# Exposed on /metrics in the Prometheus text format. Set METRICS_ENABLED=0 to
+# skip the per-request timing and hide the endpoint. Each update costs about
+# a microsecond: benchmarks/metrics_overhead.py has measured 0.5-1.3 us per
+# Histogram.observe and 0.5-0.7 us per Counter.inc. A request makes a few of
+# them, a small share of the request's own time.
+app.config['METRICS_ENABLED'] = os.environ.get("METRICS_ENABLED", "1") == "1"
+metrics = Registry()
+request_latency = metrics.histogram("forum_request_duration_seconds",
+                                    "Time to produce a response, by endpoint.", ("endpoint", "method"))
+requests_total = metrics.counter("forum_requests_total",
+                                 "Responses sent, by endpoint and status code.", ("endpoint", "method", "status"))
+template_latency = metrics.histogram("forum_template_render_seconds",
+                                     "Time to render a page template.", ("template",))
+uploads_total = metrics.counter("forum_uploads_total", "Files uploaded, by file type.", ("filetype",))
+upload_bytes = metrics.counter("forum_upload_bytes_total", "Bytes uploaded, by file type.", ("filetype",))
+metrics.gauge("forum_stored_items", "Posts, comments and chat messages in storage.",
+              lambda: {(kind,): count for kind, count in storage.stats().items()}, ("kind",))
+metrics.gauge("forum_fragment_cache_entries", "Rendered fragments held in the cache.", lambda: len(fragment_cache))
+metrics.gauge("forum_fragment_cache_bytes", "Size of the rendered fragments held in the cache.",
+              lambda: fragment_cache.size)
+metrics.callback_counter("forum_fragment_cache_lookups_total", "Fragment cache lookups, by result.",
+                         lambda: {("hit",): fragment_cache.hits, ("miss",): fragment_cache.misses}, ("result",))
+metrics.gauge("forum_pending_votes", "Votes buffered and not yet written to storage.", lambda: len(vote_buffer))
+metrics.gauge("forum_event_subscribers", "Open /events streams.", lambda: len(event_hub))
+metrics.gauge("forum_search_documents", "Documents in the search index.", lambda: len(search_index))
+
+
+@app.before_request
+def start_request_timer():
+    if app.config['METRICS_ENABLED']:
+        g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response: Response) -> Response:
+    started = g.get('request_started')
+    if started is not None:
+        endpoint = request.endpoint or "unmatched"
+        request_latency.observe(time.perf_counter() - started, endpoint, request.method)
+        requests_total.inc(endpoint, request.method, str(response.status_code))
+    return response
+
+
+def start_template_timer(sender, template, context, **extra):
+    if app.config['METRICS_ENABLED']:
+        g.setdefault('template_started', []).append(time.perf_counter())
+
+
+def record_template_metrics(sender, template, context, **extra):
+    started = g.get('template_started')
+    if started:
+        template_latency.observe(time.perf_counter() - started.pop(), template.name)
+
+
+before_render_template.connect(start_template_timer, app)
+template_rendered.connect(record_template_metrics, app)
+
+
+# ------------------ Profiling ------------------
+# cProfile a sample of requests (PROFILE_SAMPLE_RATE, 0 to 1), every request
+# to the endpoints in PROFILE_ENDPOINTS (comma-separated, e.g.
+# "forum,post_overlay"), or requests sent with "X-Profile: <PROFILE_TOKEN>".
+# Aggregated profiles are written to PROFILE_DIR. With none of these set no
+# hooks are installed, so requests pay nothing.
+request_profiler = RequestProfiler(os.environ.get("PROFILE_DIR", os.path.join(os.getcwd(), 'profiles')),
+                                   sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", 0)),
+                                   endpoints=[e for e in os.environ.get("PROFILE_ENDPOINTS", "").split(",") if e],
+                                   token=os.environ.get("PROFILE_TOKEN") or None,
+                                   flush_every=int(os.environ.get("PROFILE_FLUSH_EVERY", 20)))
+
+
+def start_profiling():
+    if request_profiler.wanted(request.endpoint, request.headers):
+        g.profile = request_profiler.start()
+
+
+def stop_profiling(exc):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        request_profiler.stop(profile, request.endpoint or "unmatched")
+
+
+if request_profiler.enabled:
+    app.before_request(start_profiling)
+    app.teardown_request(stop_profiling)
+    atexit.register(request_profiler.flush)
 
 
 def allowed_file(filename: str) -> bool:
@@ -36,45 +385,140 @@ def allowed_file(filename: str) -> bool:
     return ext in ALLOWED_EXTENSIONS
 
 
-def get_next_post_id() -> int:
-    return posts[-1]['id'] + 1 if posts else 1
+def filetype_for(filename: str) -> str:
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in ['.png', '.jpg', '.jpeg', '.gif']:
+        return 'image'
+    elif ext in ['.mp4', '.webm', '.ogg']:
+        return 'video'
+    elif ext in ['.mp3', '.wav', '.ogg']:
+        return 'audio'
+    elif ext == '.pdf':
+        return 'pdf'
+    elif ext == '.zip':
+        return 'zip'
+    return 'other'
+
+
+def current_voter(create: bool = True) -> str:
+    """
+    Identify who is voting or saving posts: the logged-in user, or else a
+    per-session ID. With ``create`` false, an anonymous visitor who has no
+    ID yet gets None instead, so read-only requests leave the session alone.
+    """
+    if 'user' in session:
+        return 'user:' + session['user']
+    if 'voter' not in session:
+        if not create:
+            return None
+        session['voter'] = uuid.uuid4().hex
+    return 'session:' + session['voter']
+
+
+def log_in(username: str) -> None:
+    """
+    Start a logged-in session, handing what the visitor saved or voted on
+    while anonymous over to the account.
+    """
+    if 'voter' in session:
+        # Buffered votes are written first so that they move too.
+        vote_buffer.flush()
+        storage.transfer_owner('session:' + session.pop('voter'), 'user:' + username)
+    session['user'] = username
+
+
+def current_vote_owner() -> str:
+    """
+    Identify who is voting. Like current_voter, but a visitor without a
+    session is keyed by client address rather than given a new session, so
+    a client that drops its cookie cannot cast a fresh vote per request.
+    """
+    return current_voter(create=False) or 'addr:' + (request.remote_addr or 'unknown')
+
+
+@app.template_global()
+def saved_among(posts: list) -> set:
+    """IDs of the posts in ``posts`` that the current visitor has saved."""
+    owner = current_voter(create=False)
+    if owner is None or not posts:
+        return set()
+    return storage.saved_among(owner, [post['id'] for post in posts])
+
+
+@app.before_request
+def move_saved_out_of_session():
+    """Move the saved post IDs that older versions kept in the session cookie into storage."""
+    if 'saved' in session:
+        storage.add_saved(current_voter(), session.pop('saved'))
 
 
-def get_next_comment_id() -> int:
-    global comment_id_counter
-    cid = comment_id_counter
-    comment_id_counter += 1
-    return cid
+@app.template_global()
+def thumbnail_url(post: dict, width: int) -> str:
+    """URL of the post's ``width`` pixel preview, or None until it has been generated."""
+    if not post['filename'] or not thumbnail_worker.has_preview(post['filename'], width):
+        return None
+    return url_for('uploaded_file', filename=thumbnail_name(post['filename'], width))
 
 
-def find_comment(comments: list, comment_id: int) -> dict:
-    """Recursively search for a comment with the given ID."""
-    for comment in comments:
-        if comment['id'] == comment_id:
-            return comment
-        found = find_comment(comment.get('replies', []), comment_id)
-        if found:
-            return found
+# Rendered post fragments, invalidated through the per-post version.
+fragment_cache = FragmentCache(max_bytes=int(os.environ.get("FRAGMENT_CACHE_BYTES", 32 * 1024 * 1024)))
+
+
+@app.template_global()
+def cached_fragment(macro_name: str, post: dict, *args) -> Markup:
+    """
+    Render a post macro from macros.html, reusing the cached markup while the
+    post's version is unchanged. Only pass post data here: anything that
+    depends on the current user must be rendered outside the fragment.
+    """
+    key = (macro_name, post['id']) + args
+    version = post['version']
+    html = fragment_cache.get(key, version)
+    if html is None:
+        macro = getattr(app.jinja_env.get_template('macros.html').module, macro_name)
+        html = fragment_cache.put(key, version, str(macro(post, *args)))
+    return Markup(html)
+
+
+# ------------------ Conditional GET ------------------
+# Pages that are polled or reopened often are tagged with the storage
+# versions they were built from; a client sending the tag back is answered
+# with a 304 before anything is queried beyond the version or rendered.
+def version_etag(*parts) -> str:
+    """
+    ETag of a response determined by ``parts`` (storage versions and whatever
+    else the response depends on), the store's epoch and this release.
+    """
+    key = "\0".join(map(str, (RELEASE_TAG, storage.epoch) + parts))
+    return hashlib.blake2b(key.encode(), digest_size=12).hexdigest()
+
+
+def not_modified(etag: str) -> Response:
+    """A 304 response if the client already has ``etag``, otherwise None."""
+    # Weak comparison, as compress_response() sends compressed bodies' tags weak.
+    if request.if_none_match.contains_weak(etag):
+        return revalidated(Response(status=304), etag)
     return None
 
 
+def revalidated(response, etag: str, private: bool = False) -> Response:
+    """Tag ``response`` with ``etag`` and have browsers revalidate it before every reuse."""
+    response = app.make_response(response)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    if private:
+        response.cache_control.private = True
+    return response
+
+
 # ------------------ Login & Sign Up Routes ------------------
-@app.route("/login", methods=["GET", "POST"])
-def login():
-    login_template = '''
+template_sources['login.html'] = '''
     <!DOCTYPE html>
     <html>
     <head>
       <title>Login</title>
       <meta name="viewport" content="width=device-width, initial-scale=1">
-      <style>
-        body { background-color: #FFFDD0; font-family: Arial, sans-serif; }
-        .login-container { max-width: 400px; margin: 50px auto; background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }
-        input[type="text"], input[type="password"] { width: 100%; padding: 10px; margin: 10px 0; border: 1px solid #ccc; border-radius: 5px; }
-        .button { background-color: #4CAF50; color: white; border: none; padding: 10px; border-radius: 5px; cursor: pointer; width: 100%; }
-        .button:hover { background-color: #45a049; }
-        .link { text-align: center; margin-top: 10px; }
-      </style>
+      <link rel="stylesheet" href="{{ asset_url('auth.css') }}">
     </head>
     <body>
       <div class="login-container">
@@ -91,35 +535,30 @@ def login():
       </div>
     </body>
     </html>
-    '''
+'''
+
+
+@app.route("/login", methods=["GET", "POST"])
+def login():
     error = None
     if request.method == "POST":
         username = request.form.get("username")
         password = request.form.get("password")
-        if username in users and users[username] == password:
-            session['user'] = username
+        if storage.check_user(username, password):
+            log_in(username)
             return redirect(url_for('forum'))
         else:
             error = "Invalid credentials"
-    return render_template_string(login_template, error=error)
+    return render_template('login.html', error=error)
 
 
-@app.route("/signup", methods=["GET", "POST"])
-def signup():
-    signup_template = '''
+template_sources['signup.html'] = '''
     <!DOCTYPE html>
     <html>
     <head>
       <title>Sign Up</title>
       <meta name="viewport" content="width=device-width, initial-scale=1">
-      <style>
-        body { background-color: #FFFDD0; font-family: Arial, sans-serif; }
-        .signup-container { max-width: 400px; margin: 50px auto; background: white; padding: 20px; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }
-        input[type="text"], input[type="password"] { width: 100%; padding: 10px; margin: 10px 0; border: 1px solid #ccc; border-radius: 5px; }
-        .button { background-color: #4CAF50; color: white; border: none; padding: 10px; border-radius: 5px; cursor: pointer; width: 100%; }
-        .button:hover { background-color: #45a049; }
-        .link { text-align: center; margin-top: 10px; }
-      </style>
+      <link rel="stylesheet" href="{{ asset_url('auth.css') }}">
     </head>
     <body>
       <div class="signup-container">
@@ -137,21 +576,24 @@ def signup():
       </div>
     </body>
     </html>
-    '''
+'''
+
+
+@app.route("/signup", methods=["GET", "POST"])
+def signup():
     error = None
     if request.method == "POST":
         username = request.form.get("username").strip()
         password = request.form.get("password")
         confirm_password = request.form.get("confirm_password")
-        if username in users:
-            error = "Username already exists. Please choose another."
-        elif password != confirm_password:
+        if password != confirm_password:
             error = "Passwords do not match."
+        elif not storage.create_user(username, password):
+            error = "Username already exists. Please choose another."
         else:
-            users[username] = password
-            session['user'] = username  # Auto-login after sign up.
+            log_in(username)  # Auto-login after sign up.
             return redirect(url_for('forum'))
-    return render_template_string(signup_template, error=error)
+    return render_template('signup.html', error=error)
 
 
 @app.route("/logout")
@@ -161,21 +603,13 @@ def logout():
 
 
 # ------------------ Homepage ------------------
-@app.route("/")
-def homepage():
-    homepage_template = '''
+template_sources['homepage.html'] = '''
     <!DOCTYPE html>
     <html>
     <head>
         <title>SVU Unofficial - Home</title>
         <meta name="viewport" content="width=device-width, initial-scale=1">
-        <style>
-            body { background-color: #FFFDD0; font-family: Arial, sans-serif; margin: 0; padding: 0; }
-            .header { background-color: #4CAF50; color: white; padding: 40px; text-align: center; }
-            .container { width: 90%; margin: 20px auto; padding: 20px; text-align: center; box-sizing: border-box; }
-            .button { background-color: #4CAF50; color: white; border: none; padding: 15px 20px; border-radius: 5px; cursor: pointer; text-decoration: none; font-size: 1em; }
-            .button:hover { background-color: #45a049; }
-        </style>
+        <link rel="stylesheet" href="{{ asset_url('home.css') }}">
     </head>
     <body>
         <div class="header">
@@ -187,133 +621,164 @@ def homepage():
         </div>
     </body>
     </html>
-    '''
-    return render_template_string(homepage_template)
+'''
+
+
+@app.route("/")
+def homepage():
+    return render_template('homepage.html')
 
 
 # ------------------ Forum Page ------------------
-@app.route("/forum", methods=["GET", "POST"])
-def forum():
-    """
-    Render the forum page.
-    - Handles new post submissions.
-    - Displays posts along with integrated chat.
-    - Includes a navbar with login, logout, and sign-up links.
-    - Clicking on a post opens an overlay with post details.
-    """
-    if 'saved' not in session:
-        session['saved'] = []
+# Number of posts rendered per page of the forum feed.
+app.config['FORUM_PAGE_SIZE'] = 20
+# Comment threads are sent in bounded slices: this many comments per page,
+# each with its best few replies for a couple of levels. The rest is loaded
+# on demand from /post/<id>/comments.
+app.config['COMMENT_PAGE_SIZE'] = 20
+app.config['COMMENT_REPLIES_SHOWN'] = 3
+app.config['COMMENT_REPLY_DEPTH'] = 2
 
-    # Handle new post creation.
-    if request.method == "POST":
-        if 'user' not in session:
-            return redirect(url_for('login'))
-        title = request.form.get("title", "").strip()
-        text = request.form.get("text", "").strip()
-        file = request.files.get("file")
-        filename = None
-        filetype = None
+# Post markup shared by the forum feed, the saved posts page and the post
+# overlay. Macros called through cached_fragment must not depend on the user.
+template_sources['macros.html'] = '''
+    {% macro post_card(post, saved, show_votes=True, download_link=False) %}
+        <div class="post" onclick="showPostOverlay({{ post.id }})">
+            {{ cached_fragment('post_card_body', post, show_votes, download_link) }}
+            <button class="star-button {% if saved %}star-saved{% else %}star-unsaved{% endif %}" onclick="event.stopPropagation(); toggleStar({{ post.id }}, this);">★</button>
+        </div>
+    {% endmacro %}
 
-        if file and file.filename:
-            orig_name = secure_filename(file.filename)
-            filename = f"{uuid.uuid4().hex}_{orig_name}"
-            try:
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-            except Exception as e:
-                app.logger.error("Error saving file: %s", e)
-                return "File upload failed", 500
-            ext = os.path.splitext(filename)[1].lower()
-            if ext in ['.png', '.jpg', '.jpeg', '.gif']:
-                filetype = 'image'
-            elif ext in ['.mp4', '.webm', '.ogg']:
-                filetype = 'video'
-            elif ext in ['.mp3', '.wav', '.ogg']:
-                filetype = 'audio'
-            elif ext == '.pdf':
-                filetype = 'pdf'
-            elif ext == '.zip':
-                filetype = 'zip'
-            else:
-                filetype = 'other'
-
-        new_post = {
-            'id': get_next_post_id(),
-            'title': title,
-            'text': text,
-            'filename': filename,
-            'filetype': filetype,
-            'comments': [],
-            'upvotes': 0,
-            'downvotes': 0
-        }
-        posts.append(new_post)
-        return redirect(url_for('forum'))
+    {% macro post_card_body(post, show_votes=True, download_link=False) %}
+        <h3>{{ post.title }}</h3>
+        <p>{{ post.text }}</p>
+        {# Listings only show previews; the full asset is loaded by the post overlay. #}
+        {% set thumb = thumbnail_url(post, 200) %}
+        {% if post.filename and post.filetype == 'image' %}
+            {% if thumb %}
+                <img src="{{ thumb }}" srcset="{{ thumb }} 1x, {{ thumbnail_url(post, 400) or thumb }} 2x" alt="Post Image" width="200" loading="lazy">
+            {% else %}
+                <img src="{{ url_for('uploaded_file', filename=post.filename) }}" alt="Post Image" width="200" loading="lazy">
+            {% endif %}
+        {% elif post.filename and post.filetype in ['video', 'audio'] %}
+            {% if post.filetype == 'video' %}
+                {% if thumb %}
+                    <img src="{{ thumb }}" srcset="{{ thumb }} 1x, {{ thumbnail_url(post, 400) or thumb }} 2x" alt="Video preview" width="200" loading="lazy">
+                {% else %}
+                    <span class="button">Play Video</span>
+                {% endif %}
+            {% else %}
+                <audio controls preload="none">
+                    <source src="{{ url_for('uploaded_file', filename=post.filename) }}">
+                    Your browser does not support the audio element.
+                </audio>
+            {% endif %}
+        {% elif post.filename and post.filetype in ['pdf', 'zip', 'other'] %}
+            {% if download_link %}
+                <a href="{{ url_for('uploaded_file', filename=post.filename) }}" download class="button">Download File</a>
+            {% else %}
+                <span class="button">Download File</span>
+            {% endif %}
+        {% endif %}
+        {% if show_votes %}
+        <div>
+            Score: <span id="post-score-{{ post.id }}">{{ post.upvotes - post.downvotes }}</span>
+            <button onclick="votePost({{ post.id }}, 'up', event)">Upvote</button>
+            <button onclick="votePost({{ post.id }}, 'down', event)">Downvote</button>
+        </div>
+        {% endif %}
+    {% endmacro %}
+
+    {% macro overlay_detail(post) %}
+      <h2>{{ post.title }}</h2>
+      <p>{{ post.text }}</p>
+      <div>
+        Score: <span id="post-score-{{ post.id }}">{{ post.upvotes - post.downvotes }}</span>
+        <button onclick="votePost({{ post.id }}, 'up', event)">Upvote</button>
+        <button onclick="votePost({{ post.id }}, 'down', event)">Downvote</button>
+      </div>
+      {% if post.filename %}
+        {% if post.filetype == 'image' %}
+          <img src="{{ url_for('uploaded_file', filename=post.filename) }}" alt="Post Image" style="max-width:100%; margin-top:10px;">
+        {% elif post.filetype == 'video' %}
+          <video controls style="width:100%; margin-top:10px;">
+            <source src="{{ url_for('uploaded_file', filename=post.filename) }}">
+            Your browser does not support the video tag.
+          </video>
+        {% elif post.filetype == 'audio' %}
+          <audio controls style="width:100%; margin-top:10px;">
+            <source src="{{ url_for('uploaded_file', filename=post.filename) }}">
+            Your browser does not support the audio element.
+          </audio>
+        {% endif %}
+        <br><br>
+        <a href="{{ url_for('uploaded_file', filename=post.filename) }}" download class="button" style="margin-top:10px;">Download File</a>
+      {% endif %}
+    {% endmacro %}
 
-    forum_template = '''
+    {% macro render_comment(post, comment) -%}
+      <div class="comment" style="border-bottom:1px solid #ccc; padding:5px 0; margin-bottom:5px;">
+        <div>
+          {{ comment.text }} - Score: <span id="comment-score-{{ comment.id }}">{{ comment.upvotes - comment.downvotes }}</span>
+          <button onclick="voteComment({{ post.id }}, {{ comment.id }}, 'up', this)">Upvote</button>
+          <button onclick="voteComment({{ post.id }}, {{ comment.id }}, 'down', this)">Downvote</button>
+          <button onclick="toggleReplyForm({{ comment.id }})">Reply</button>
+        </div>
+        <div id="reply-form-{{ comment.id }}" class="reply-form" style="display:none; margin-top:5px;">
+          <form onsubmit="submitReply(event, {{ post.id }}, {{ comment.id }})">
+            <textarea name="reply" placeholder="Your reply" rows="2"></textarea>
+            <button type="submit" class="button">Submit Reply</button>
+          </form>
+        </div>
+        {%- for reply in comment.replies %}
+          <div class="reply" style="margin-left:20px;">
+            {{ render_comment(post, reply) }}
+          </div>
+        {%- endfor %}
+        {%- if comment.replies|length < comment.reply_count %}
+          <button class="reply" style="margin-left:20px;" data-post="{{ post.id }}" data-parent="{{ comment.id }}"
+                  data-cursor="{{ format_cursor(comment.more_replies) or '' }}" onclick="loadMoreComments(this)">
+            {{ 'Load more replies' if comment.replies else 'Show ' ~ comment.reply_count ~ (' reply' if comment.reply_count == 1 else ' replies') }}
+          </button>
+        {%- endif %}
+      </div>
+    {%- endmacro %}
+
+    {% macro overlay_comments(post, next_cursor) %}
+      <div>
+        {% for comment in post.comments %}
+          {{ render_comment(post, comment) }}
+        {% endfor %}
+        {% if next_cursor is not none %}
+          <button class="button" data-post="{{ post.id }}" data-parent="" data-cursor="{{ format_cursor(next_cursor) }}"
+                  onclick="loadMoreComments(this)">Load more comments</button>
+        {% endif %}
+      </div>
+    {% endmacro %}
+'''
+
+
+# One page of post cards, used by the forum page and the feed page endpoint.
+template_sources['post_cards.html'] = '''
+    {% from 'macros.html' import post_card %}
+    {% set saved_ids = saved_among(posts) %}
+    {% for post in posts %}
+        {{ post_card(post, post.id in saved_ids) }}
+    {% endfor %}
+'''
+
+
+template_sources['forum.html'] = '''
     <!DOCTYPE html>
     <html>
     <head>
         <title>SVU Unofficial Forum</title>
         <meta name="viewport" content="width=device-width, initial-scale=1">
-        <style>
-            /* Basic styling */
-            body { background-color: #FFFDD0; font-family: Arial, sans-serif; margin: 0; padding: 0; }
-            .nav { background-color: #333; color: white; padding: 10px; text-align: right; }
-            .nav a { color: #FFD700; text-decoration: none; margin-left: 15px; }
-            .header { background-color: #4CAF50; color: white; padding: 30px; text-align: center; font-size: 2em; }
-            .container { width: 95%; max-width: 1200px; margin: 20px auto; padding: 20px; box-sizing: border-box; }
-            .chat-box, .post-form, .posts { background: white; padding: 20px; margin-bottom: 20px; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }
-            .chat-box { margin-bottom: 30px; }
-            input[type="text"], textarea { width: 100%; padding: 10px; margin-bottom: 10px; border: 1px solid #ccc; border-radius: 5px; box-sizing: border-box; }
-            input[type="file"] { display: none; }
-            .file-label { background-color: #4CAF50; color: white; padding: 10px 15px; border-radius: 5px; cursor: pointer; display: inline-block; margin-bottom: 10px; }
-            .post { position: relative; background: #fff8e1; border-bottom: 1px solid #ddd; padding: 10px; margin-bottom: 10px; cursor: pointer; }
-            .post:last-child { border-bottom: none; }
-            .post h3 { margin: 0 0 5px; }
-            .post p { margin: 5px 0; }
-            .post img { max-width: 100%; margin-top: 10px; }
-            .star-button { position: absolute; top: 10px; right: 10px; background: none; border: none; font-size: 1.5em; cursor: pointer; }
-            .star-unsaved { color: grey; }
-            .star-saved { color: #FFD700; }
-            .button { background-color: #4CAF50; color: white; border: none; padding: 10px 15px; border-radius: 5px; cursor: pointer; text-decoration: none; display: inline-block; }
-            .button:hover { background-color: #45a049; }
-            .chat-message { padding: 5px; border-bottom: 1px solid #eee; }
-            /* Modal overlay */
-            #post-overlay {
-                display: none;
-                position: fixed;
-                top: 0; left: 0;
-                width: 100%; height: 100%;
-                background: rgba(0, 0, 0, 0.6);
-                z-index: 1000;
-                overflow-y: auto;
-            }
-            #post-overlay .overlay-content {
-                background: #FFFDD0;
-                margin: 5% auto;
-                padding: 20px;
-                max-width: 800px;
-                border-radius: 8px;
-                position: relative;
-            }
-            #post-overlay .close-btn {
-                position: absolute;
-                top: 10px;
-                right: 15px;
-                font-size: 1.5em;
-                cursor: pointer;
-            }
-            @media (max-width: 600px) {
-                .header { font-size: 1.5em; padding: 20px; }
-                .container { padding: 10px; }
-                .button { padding: 8px 12px; }
-            }
-            /* Additional styling for comment/reply forms */
-            .comment-form, .reply-form { margin-top: 10px; }
-        </style>
+        <link rel="stylesheet" href="{{ asset_url('forum.css') }}">
     </head>
     <body>
         <div class="nav">
+            <a href="{{ url_for('search') }}">Search</a> |
             {% if session.get('user') %}
                 Logged in as {{ session.get('user') }} | <a href="{{ url_for('logout') }}">Logout</a>
             {% else %}
@@ -354,36 +819,21 @@ def forum():
             </div>
             <!-- Posts Listing -->
             <div class="posts">
-                <h2>Recent Posts</h2>
-                {% for post in posts %}
-                    <div class="post" onclick="showPostOverlay({{ post.id }})">
-                        <h3>{{ post.title }}</h3>
-                        <p>{{ post.text }}</p>
-                        {% if post.filename and post.filetype == 'image' %}
-                            <img src="{{ url_for('uploaded_file', filename=post.filename) }}" alt="Post Image" width="200">
-                        {% elif post.filename and post.filetype in ['video', 'audio'] %}
-                            {% if post.filetype == 'video' %}
-                                <video width="200" controls>
-                                    <source src="{{ url_for('uploaded_file', filename=post.filename) }}">
-                                    Your browser does not support the video tag.
-                                </video>
-                            {% else %}
-                                <audio controls>
-                                    <source src="{{ url_for('uploaded_file', filename=post.filename) }}">
-                                    Your browser does not support the audio element.
-                                </audio>
-                            {% endif %}
-                        {% elif post.filename and post.filetype in ['pdf', 'zip', 'other'] %}
-                            <span class="button">Download File</span>
-                        {% endif %}
-                        <button class="star-button {% if post.id in session.get('saved', []) %}star-saved{% else %}star-unsaved{% endif %}" onclick="event.stopPropagation(); toggleStar({{ post.id }}, this);">★</button>
-                        <div>
-                            Score: <span id="post-score-{{ post.id }}">{{ post.upvotes - post.downvotes }}</span>
-                            <button onclick="votePost({{ post.id }}, 'up', event)">Upvote</button>
-                            <button onclick="votePost({{ post.id }}, 'down', event)">Downvote</button>
-                        </div>
-                    </div>
-                {% endfor %}
+                <h2>{{ {'new': 'Recent Posts', 'hot': 'Hot Posts', 'top': 'Top Posts'}[sort] }}</h2>
+                <div class="feed-sorts">
+                    <a href="{{ url_for('forum') }}" {% if sort == 'new' %}class="active"{% endif %}>New</a>
+                    <a href="{{ url_for('forum', sort='hot') }}" {% if sort == 'hot' %}class="active"{% endif %}>Hot</a>
+                    Top:
+                    {% for w in top_windows %}
+                    <a href="{{ url_for('forum', sort='top', window=w) }}" {% if sort == 'top' and window == w %}class="active"{% endif %}>{{ w|capitalize }}</a>
+                    {% endfor %}
+                </div>
+                <div id="post-list">
+                    {% include 'post_cards.html' %}
+                </div>
+                {% if next_cursor is not none %}
+                <button id="load-more" class="button" data-cursor="{{ next_cursor }}" onclick="loadMorePosts(this)">Load more posts</button>
+                {% endif %}
             </div>
             <br>
             <a href="{{ url_for('saved_posts') }}" class="button">View Saved Posts</a>
@@ -395,174 +845,149 @@ def forum():
             </div>
         </div>
         <script>
-            // Chat polling.
-            function refreshChat() {
-                fetch('/chat')
-                .then(response => response.json())
-                .then(data => {
-                    let chatDiv = document.getElementById('chat-messages');
-                    chatDiv.innerHTML = '';
-                    data.forEach(function(msg) {
-                        let newMsg = document.createElement('div');
-                        newMsg.className = 'chat-message';
-                        newMsg.innerHTML = '<strong>' + msg.username + ':</strong> ' + msg.message;
-                        chatDiv.appendChild(newMsg);
-                    });
-                })
-                .catch(err => console.error(err));
-            }
-            setInterval(refreshChat, 5000);
-            function sendChatMessage(event) {
-                event.preventDefault();
-                const username = document.getElementById('chat-username').value;
-                const message = document.getElementById('chat-input').value;
-                fetch('/chat', {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({username: username, message: message})
-                })
-                .then(response => response.json())
-                .then(data => {
-                    refreshChat();
-                    document.getElementById('chat-input').value = '';
-                })
-                .catch(err => console.error(err));
-            }
-            // Toggle star (save post)
-            function toggleStar(postId, elem) {
-                fetch('/star/' + postId, { method: 'POST' })
-                .then(response => response.json())
-                .then(data => {
-                    if (data.saved) {
-                        elem.classList.remove('star-unsaved');
-                        elem.classList.add('star-saved');
-                    } else {
-                        elem.classList.remove('star-saved');
-                        elem.classList.add('star-unsaved');
-                    }
-                    alert(data.message);
-                })
-                .catch(err => console.error(err));
-            }
-            // Vote on a post.
-            function votePost(postId, action, event) {
-                event.stopPropagation();
-                fetch('/vote/post/' + postId, {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({action: action})
-                })
-                .then(response => response.json())
-                .then(data => {
-                    document.getElementById('post-score-' + postId).textContent = data.score;
-                })
-                .catch(err => console.error(err));
-            }
-            // Vote on a comment (or reply).
-            function voteComment(postId, commentId, action, btn) {
-                fetch('/vote/comment/' + postId + '/' + commentId, {
-                    method: 'POST',
-                    headers: {'Content-Type': 'application/json'},
-                    body: JSON.stringify({action: action})
-                })
-                .then(response => response.json())
-                .then(data => {
-                    document.getElementById('comment-score-' + commentId).textContent = data.score;
-                })
-                .catch(err => console.error(err));
-            }
-            // Toggle reply form visibility.
-            function toggleReplyForm(commentId) {
-                var form = document.getElementById('reply-form-' + commentId);
-                form.style.display = (form.style.display === 'none' || form.style.display === '') ? 'block' : 'none';
-            }
-            // Show post overlay by fetching its details.
-            function showPostOverlay(postId) {
-                fetch('/post_overlay/' + postId)
-                .then(response => response.text())
-                .then(html => {
-                    document.getElementById('overlay-content').innerHTML = html;
-                    document.getElementById('post-overlay').style.display = 'block';
-                })
-                .catch(err => console.error(err));
-            }
-            // Close the overlay.
-            function closeOverlay() {
-                document.getElementById('post-overlay').style.display = 'none';
-            }
-            // Submit comment via AJAX.
-            function submitComment(event, postId) {
-                event.preventDefault();
-                const form = event.target;
-                const formData = new FormData(form);
-                fetch('/comment/' + postId, {
-                    method: 'POST',
-                    headers: { 'X-Requested-With': 'XMLHttpRequest' },
-                    body: formData
-                })
-                .then(response => response.json())
-                .then(data => { showPostOverlay(postId); })
-                .catch(err => console.error(err));
-            }
-            // Submit reply via AJAX.
-            function submitReply(event, postId, commentId) {
-                event.preventDefault();
-                const form = event.target;
-                const formData = new FormData(form);
-                fetch('/reply/' + postId + '/' + commentId, {
-                    method: 'POST',
-                    headers: { 'X-Requested-With': 'XMLHttpRequest' },
-                    body: formData
-                })
-                .then(response => response.json())
-                .then(data => { showPostOverlay(postId); })
-                .catch(err => console.error(err));
-            }
+            // Ordering of the post list, passed along when loading more posts.
+            const feedSort = {{ sort|tojson }};
+            const feedWindow = {{ window|tojson }};
+            // Chat polling: only fetch messages newer than the last one shown.
+            let lastChatId = {{ last_chat_id }};
         </script>
+        <script src="{{ asset_url('forum.js') }}"></script>
     </body>
     </html>
-    '''
-    return render_template_string(forum_template, posts=posts, chat_messages=chat_messages)
+'''
 
 
-# ------------------ Post Overlay (Modal) ------------------
-@app.route("/post_overlay/<int:post_id>", methods=["GET"])
-def post_overlay(post_id: int):
+@app.route("/forum", methods=["GET", "POST"])
+def forum():
     """
-    Returns the post detail view as an HTML fragment to be displayed in an overlay.
-    Includes the post content, media, AJAX voting, and nested comments with AJAX-enabled reply forms.
+    Render the forum page.
+    - Handles new post submissions.
+    - Displays posts along with integrated chat.
+    - Includes a navbar with login, logout, and sign-up links.
+    - Clicking on a post opens an overlay with post details.
     """
-    post = next((p for p in posts if p['id'] == post_id), None)
-    if not post:
-        return "Post not found", 404
+    # Handle new post creation.
+    if request.method == "POST":
+        if 'user' not in session:
+            return redirect(url_for('login'))
+        title = request.form.get("title", "").strip()
+        text = request.form.get("text", "").strip()
+        file = request.files.get("file")
+        filename = None
+        filetype = None
+
+        if file and file.filename:
+            ext = os.path.splitext(secure_filename(file.filename))[1].lower()
+            try:
+                # The body was already streamed into the upload folder while
+                # it was parsed; this only renames it into place.
+                filename = file.stream.commit(ext)
+            except Exception as e:
+                app.logger.error("Error saving file: %s", e)
+                return "File upload failed", 500
+            filetype = filetype_for(filename)
+            uploads_total.inc(filetype)
+            upload_bytes.inc(filetype, amount=file.stream.size)
+
+        media = {'sha256': file.stream.sha256, 'size': file.stream.size} if filename else {}
+        new_post = storage.create_post(title, text, filename, filetype, **media)
+        search_index.add_post(new_post)
+        thumbnail_worker.submit(new_post['id'], filename, filetype)
+        event_hub.publish('post', {'id': new_post['id'], 'title': title})
+        return redirect(url_for('forum'))
+
+    order = feed_order()
+    if order is None:
+        return "Unknown feed order", 400
+    sort, window = order
+    # A windowed feed also changes as posts age out of it, without any write.
+    etag = None
+    if TOP_WINDOWS[window] is None:
+        etag = version_etag('forum', sort, window, storage.change_version(), current_voter(create=False))
+        response = not_modified(etag)
+        if response is not None:
+            return response
+    page, next_cursor = storage.page_posts(limit=app.config['FORUM_PAGE_SIZE'], sort=sort, window=window)
+    html = render_template('forum.html', posts=page, next_cursor=format_cursor(next_cursor),
+                           sort=sort, window=window, top_windows=TOP_WINDOWS,
+                           chat_messages=storage.recent_chat(), last_chat_id=storage.last_chat_id())
+    return revalidated(html, etag, private=True) if etag else html
+
+
+def feed_order() -> tuple:
+    """The (sort, window) of the feed requested by the query string, or None if it is invalid."""
+    sort = request.args.get("sort", "new")
+    window = request.args.get("window", "all")
+    if sort not in FEED_SORTS or window not in TOP_WINDOWS:
+        return None
+    return sort, window
+
+
+@app.template_global()
+def format_cursor(cursor):
+    """
+    Page cursor as it appears in URLs: the post ID for the "new" feed and
+    "<sort key>_<post ID>" for ranked feeds.
+    """
+    if isinstance(cursor, tuple):
+        return f"{cursor[0]!r}_{cursor[1]}"
+    return cursor
+
 
-    overlay_template = '''
+def parse_cursor(text: str, sort: str):
+    """Inverse of format_cursor(); None if ``text`` is missing or malformed."""
+    if not text:
+        return None
+    try:
+        if sort == "new":
+            return int(text)
+        key, post_id = text.rsplit("_", 1)
+        return (float(key) if sort == "hot" else int(key)), int(post_id)
+    except ValueError:
+        return None
+
+
+# ------------------ Forum Feed Pages ------------------
+@app.route("/forum/page", methods=["GET"])
+def forum_page():
+    """
+    Returns the page of the feed that follows the ``before`` cursor, in the
+    order given by ``sort`` (new, hot or top) and, for top, ``window``.
+    Responds with JSON when ``format=json`` is given, otherwise with an HTML
+    fragment of post cards and the next cursor in the ``X-Next-Cursor`` header.
+    """
+    order = feed_order()
+    if order is None:
+        return jsonify({"error": "Unknown feed order"}), 400
+    sort, window = order
+    before = parse_cursor(request.args.get("before"), sort)
+    limit = request.args.get("limit", app.config['FORUM_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, 100))
+    page, next_cursor = storage.page_posts(before=before, limit=limit, sort=sort, window=window)
+    next_cursor = format_cursor(next_cursor)
+    if request.args.get("format") == "json":
+        return jsonify({
+            "posts": [{
+                "id": p['id'],
+                "title": p['title'],
+                "text": p['text'],
+                "filename": p['filename'],
+                "filetype": p['filetype'],
+                "score": p['upvotes'] - p['downvotes'],
+            } for p in page],
+            "next": next_cursor,
+        })
+    response = app.make_response(render_template('post_cards.html', posts=page))
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response
+
+
+# ------------------ Post Overlay (Modal) ------------------
+template_sources['post_overlay.html'] = '''
     <div>
       <span class="close-btn" onclick="closeOverlay()">×</span>
-      <h2>{{ post.title }}</h2>
-      <p>{{ post.text }}</p>
-      <div>
-        Score: <span id="post-score-{{ post.id }}">{{ post.upvotes - post.downvotes }}</span>
-        <button onclick="votePost({{ post.id }}, 'up', event)">Upvote</button>
-        <button onclick="votePost({{ post.id }}, 'down', event)">Downvote</button>
-      </div>
-      {% if post.filename %}
-        {% if post.filetype == 'image' %}
-          <img src="{{ url_for('uploaded_file', filename=post.filename) }}" alt="Post Image" style="max-width:100%; margin-top:10px;">
-        {% elif post.filetype == 'video' %}
-          <video controls style="width:100%; margin-top:10px;">
-            <source src="{{ url_for('uploaded_file', filename=post.filename) }}">
-            Your browser does not support the video tag.
-          </video>
-        {% elif post.filetype == 'audio' %}
-          <audio controls style="width:100%; margin-top:10px;">
-            <source src="{{ url_for('uploaded_file', filename=post.filename) }}">
-            Your browser does not support the audio element.
-          </audio>
-        {% endif %}
-        <br><br>
-        <a href="{{ url_for('uploaded_file', filename=post.filename) }}" download class="button" style="margin-top:10px;">Download File</a>
-      {% endif %}
+      {{ cached_fragment('overlay_detail', post) }}
       <hr>
       <h3>Add a Comment</h3>
       {% if session.get('user') %}
@@ -575,57 +1000,179 @@ def post_overlay(post_id: int):
       {% endif %}
       <hr>
       <h3>Comments</h3>
-      {% macro render_comment(comment) -%}
-        <div class="comment" style="border-bottom:1px solid #ccc; padding:5px 0; margin-bottom:5px;">
-          <div>
-            {{ comment.text }} - Score: <span id="comment-score-{{ comment.id }}">{{ comment.upvotes - comment.downvotes }}</span>
-            <button onclick="voteComment({{ post.id }}, {{ comment.id }}, 'up', this)">Upvote</button>
-            <button onclick="voteComment({{ post.id }}, {{ comment.id }}, 'down', this)">Downvote</button>
-            <button onclick="toggleReplyForm({{ comment.id }})">Reply</button>
-          </div>
-          <div id="reply-form-{{ comment.id }}" class="reply-form" style="display:none; margin-top:5px;">
-            <form onsubmit="submitReply(event, {{ post.id }}, {{ comment.id }})">
-              <textarea name="reply" placeholder="Your reply" rows="2"></textarea>
-              <button type="submit" class="button">Submit Reply</button>
-            </form>
-          </div>
-          {%- for reply in comment.replies %}
-            <div class="reply" style="margin-left:20px;">
-              {{ render_comment(reply) }}
-            </div>
-          {%- endfor %}
-        </div>
-      {%- endmacro %}
-      <div>
-        {% for comment in post.comments %}
-          {{ render_comment(comment) }}
-        {% endfor %}
-      </div>
+      {{ cached_fragment('overlay_comments', post, next_cursor) }}
     </div>
-    '''
-    return render_template_string(overlay_template, post=post)
+'''
+
+
+@app.route("/post_overlay/<int:post_id>", methods=["GET"])
+def post_overlay(post_id: int):
+    """
+    Returns the post detail view as an HTML fragment to be displayed in an overlay.
+    Includes the post content, media, AJAX voting, and the first page of
+    comments, best first, with their top replies and AJAX-enabled reply forms.
+    """
+    found = storage.get_posts([post_id])
+    if not found:
+        return "Post not found", 404
+    # Everything shown bumps the post's version; only the comment form
+    # depends on who is asking.
+    etag = version_etag('post_overlay', post_id, found[0]['version'], 'user' in session)
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    comments, next_cursor = storage.comment_page(post_id, limit=app.config['COMMENT_PAGE_SIZE'],
+                                                 replies=app.config['COMMENT_REPLIES_SHOWN'],
+                                                 depth=app.config['COMMENT_REPLY_DEPTH'])
+    post = dict(found[0], comments=comments)
+    return revalidated(render_template('post_overlay.html', post=post, next_cursor=next_cursor), etag, private=True)
+
+
+# One page of a comment thread, used by the "load more" buttons of the overlay.
+template_sources['comment_thread.html'] = '''
+    {% from 'macros.html' import render_comment %}
+    {% for comment in comments %}
+      {% if parent_id %}<div class="reply" style="margin-left:20px;">{% endif %}
+      {{ render_comment(post, comment) }}
+      {% if parent_id %}</div>{% endif %}
+    {% endfor %}
+'''
+
+
+@app.route("/post/<int:post_id>/comments", methods=["GET"])
+def comment_thread(post_id: int):
+    """
+    Returns the comments ranked after the ``before`` cursor as an HTML
+    fragment: top-level comments, or the replies to ``parent`` when given,
+    each with its first few replies. The cursor for the following page is
+    sent in the ``X-Next-Cursor`` header.
+    """
+    parent_id = request.args.get("parent", type=int)
+    before = parse_cursor(request.args.get("before"), "top")
+    limit = request.args.get("limit", app.config['COMMENT_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, 100))
+    thread = storage.comment_page(post_id, parent_id=parent_id, before=before, limit=limit,
+                                  replies=app.config['COMMENT_REPLIES_SHOWN'],
+                                  depth=app.config['COMMENT_REPLY_DEPTH'])
+    if thread is None:
+        return "Post not found", 404
+    comments, next_cursor = thread
+    response = app.make_response(render_template('comment_thread.html', post={'id': post_id},
+                                                 comments=comments, parent_id=parent_id))
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = format_cursor(next_cursor)
+    return response
 
 
 # ------------------ File Serving ------------------
+# Content-addressed uploads and their previews: <sha256>[.w<width>].<ext>
+CONTENT_ADDRESSED_NAME = re.compile(r'^[0-9a-f]{64}(\.w\d+)?\.[A-Za-z0-9]+$')
+
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename: str):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    """
+    Serves an upload with immutable caching headers. Content-addressed files
+    use their hash as a strong ETag and a matching If-None-Match is answered
+    with 304 before the file is touched. Range requests are handled by
+    send_file, unless a front proxy is configured to send the bytes itself.
+    """
+    if filename.startswith('.') or filename.endswith('.part'):
+        # Uploads and previews still being written are hidden .part files.
+        return "File not found", 404
+    etag = None
+    if CONTENT_ADDRESSED_NAME.match(filename):
+        etag = os.path.splitext(filename)[0]
+        if etag in request.if_none_match:
+            response = Response(status=304)
+            response.set_etag(etag)
+            _cache_forever(response)
+            return response
+
+    accel_prefix = app.config['UPLOADS_ACCEL_REDIRECT']
+    if accel_prefix:
+        path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+        if path is None or not os.path.isfile(path):
+            return "File not found", 404
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + filename
+    else:
+        response = send_from_directory(app.config['UPLOAD_FOLDER'], filename,
+                                       etag=etag if etag else True, max_age=UPLOAD_MAX_AGE)
+    if etag:
+        response.set_etag(etag)
+    _cache_forever(response)
+    return response
+
+
+def _cache_forever(response: Response) -> None:
+    response.cache_control.public = True
+    response.cache_control.max_age = UPLOAD_MAX_AGE
+    response.cache_control.immutable = True
+
+
+# ------------------ Static Assets ------------------
+@app.template_global()
+def asset_url(name: str) -> str:
+    """URL of the static file ``name`` under its content-hashed name."""
+    return url_for('static_asset', filename=assets.url_name(name))
+
+
+@app.route('/static/<path:filename>')
+def static_asset(filename: str):
+    """
+    Serves a fingerprinted asset from memory, precompressed with the best
+    coding the client accepts. The name changes with the content, so the
+    response can be cached forever.
+    """
+    asset = assets.get(filename)
+    if asset is None:
+        return "File not found", 404
+    encoding = accepted_encoding(request.accept_encodings, [e for e in ENCODINGS if e in asset.variants])
+    etag = asset.etag if encoding is None else f"{asset.etag}-{encoding}"
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(asset.variants[encoding], mimetype=asset.mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    _cache_forever(response)
+    return response
+
+
+@app.after_request
+def compress_response(response: Response) -> Response:
+    """Compress HTML and JSON bodies of COMPRESS_MIN_SIZE or more for clients that accept it."""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or response.mimetype not in COMPRESSIBLE_TYPES or 'Content-Encoding' in response.headers
+            or request.endpoint == 'static_asset'):
+        return response
+    data = response.get_data()
+    if len(data) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+    response.set_data(compress(data, encoding, fast=True))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # The compressed bytes differ, but mean the same as the original's.
+        response.set_etag(etag, weak=True)
+    return response
 
 
 # ------------------ Comment Submission ------------------
 @app.route('/comment/<int:post_id>', methods=["POST"])
 def comment(post_id: int):
     comment_text = request.form.get("comment", "").strip()
-    post = next((p for p in posts if p['id'] == post_id), None)
-    if post and comment_text:
-        new_comment = {
-            'id': get_next_comment_id(),
-            'text': comment_text,
-            'replies': [],
-            'upvotes': 0,
-            'downvotes': 0
-        }
-        post.setdefault('comments', []).append(new_comment)
+    new_comment = storage.add_comment(post_id, comment_text) if comment_text else None
+    if new_comment is not None:
+        search_index.add_comment(post_id, new_comment)
+        event_hub.publish('comment', {'post_id': post_id, 'id': new_comment['id'], 'parent_id': None})
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return jsonify(success=True)
     return redirect(url_for('post_overlay', post_id=post_id))
@@ -635,18 +1182,10 @@ def comment(post_id: int):
 @app.route('/reply/<int:post_id>/<int:comment_id>', methods=["POST"])
 def reply(post_id: int, comment_id: int):
     reply_text = request.form.get("reply", "").strip()
-    post = next((p for p in posts if p['id'] == post_id), None)
-    if post and reply_text:
-        parent_comment = find_comment(post.get('comments', []), comment_id)
-        if parent_comment is not None:
-            new_reply = {
-                'id': get_next_comment_id(),
-                'text': reply_text,
-                'replies': [],
-                'upvotes': 0,
-                'downvotes': 0
-            }
-            parent_comment.setdefault('replies', []).append(new_reply)
+    new_reply = storage.add_comment(post_id, reply_text, parent_id=comment_id) if reply_text else None
+    if new_reply is not None:
+        search_index.add_comment(post_id, new_reply)
+        event_hub.publish('comment', {'post_id': post_id, 'id': new_reply['id'], 'parent_id': comment_id})
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return jsonify(success=True)
     return redirect(url_for('post_overlay', post_id=post_id))
@@ -655,19 +1194,10 @@ def reply(post_id: int, comment_id: int):
 # ------------------ Toggle Star ------------------
 @app.route('/star/<int:post_id>', methods=["POST"])
 def star_post(post_id: int):
-    if 'saved' not in session:
-        session['saved'] = []
-    saved_posts = session['saved']
-    if post_id in saved_posts:
-        saved_posts.remove(post_id)
-        message = "Post unsaved!"
-        saved_status = False
-    else:
-        saved_posts.append(post_id)
-        message = "Post saved!"
-        saved_status = True
-    session['saved'] = saved_posts
-    session.modified = True
+    saved_status = storage.toggle_saved(current_voter(), post_id)
+    if saved_status is None:
+        return jsonify({"error": "Post not found"}), 404
+    message = "Post saved!" if saved_status else "Post unsaved!"
     return jsonify({"message": message, "saved": saved_status})
 
 
@@ -676,13 +1206,9 @@ def star_post(post_id: int):
 def vote_post_endpoint(post_id: int):
     data = request.get_json(silent=True)
     action = data.get("action") if data else None
-    post = next((p for p in posts if p['id'] == post_id), None)
-    if post:
-        if action == "up":
-            post['upvotes'] += 1
-        elif action == "down":
-            post['downvotes'] += 1
-        score = post['upvotes'] - post['downvotes']
+    score = vote_buffer.vote(current_vote_owner(), 'post', post_id, post_id, action)
+    if score is not None:
+        event_hub.publish('post_score', {'post_id': post_id, 'score': score})
         return jsonify({"score": score})
     return jsonify({"error": "Post not found"}), 404
 
@@ -692,76 +1218,56 @@ def vote_post_endpoint(post_id: int):
 def vote_comment_endpoint(post_id: int, comment_id: int):
     data = request.get_json(silent=True)
     action = data.get("action") if data else None
-    post = next((p for p in posts if p['id'] == post_id), None)
-    if post:
-        comment = find_comment(post.get('comments', []), comment_id)
-        if comment:
-            if action == "up":
-                comment['upvotes'] += 1
-            elif action == "down":
-                comment['downvotes'] += 1
-            score = comment['upvotes'] - comment['downvotes']
-            return jsonify({"score": score})
+    score = vote_buffer.vote(current_vote_owner(), 'comment', post_id, comment_id, action)
+    if score is not None:
+        event_hub.publish('comment_score', {'post_id': post_id, 'comment_id': comment_id, 'score': score})
+        return jsonify({"score": score})
+    if storage.get_posts([post_id]):
         return jsonify({"error": "Comment not found"}), 404
     return jsonify({"error": "Post not found"}), 404
 
 
 # ------------------ Saved Posts Page ------------------
-@app.route('/saved', methods=["GET"])
-def saved_posts():
-    if 'saved' not in session:
-        session['saved'] = []
-    saved_ids = session['saved']
-    saved_posts_list = [p for p in posts if p['id'] in saved_ids]
-    saved_template = '''
+# Saved posts are kept in storage per user (or per anonymous session), not
+# in the session cookie, so the cookie stays small however many are saved.
+app.config['SAVED_PAGE_SIZE'] = 20
+
+template_sources['saved.html'] = '''
     <!DOCTYPE html>
     <html>
     <head>
         <title>Saved Posts - SVU Unofficial Forum</title>
         <meta name="viewport" content="width=device-width, initial-scale=1">
-        <style>
-            body { background-color: #FFFDD0; font-family: Arial, sans-serif; margin: 0; padding: 0; }
-            .header { background-color: #4CAF50; color: white; padding: 30px; text-align: center; font-size: 2em; }
-            .container { width: 95%; max-width: 1200px; margin: 20px auto; padding: 20px; box-sizing: border-box; }
-            .post { position: relative; background: #fff8e1; padding: 20px; margin-bottom: 20px; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); cursor: pointer; }
-            .post h3 { margin: 0 0 5px; }
-            .button { background-color: #4CAF50; color: white; border: none; padding: 10px 15px; border-radius: 5px; cursor: pointer; text-decoration: none; }
-            @media (max-width: 600px) { .header { font-size: 1.5em; padding: 20px; } .container { padding: 10px; } }
-        </style>
+        <link rel="stylesheet" href="{{ asset_url('saved.css') }}">
     </head>
     <body>
         <div class="header">Saved Posts</div>
         <div class="container">
+            {% from 'macros.html' import post_card %}
             {% for post in saved_posts_list %}
-                <div class="post" onclick="showPostOverlay({{ post.id }})">
-                    <h3>{{ post.title }}</h3>
-                    <p>{{ post.text }}</p>
-                    {% if post.filename and post.filetype == 'image' %}
-                        <img src="{{ url_for('uploaded_file', filename=post.filename) }}" alt="Post Image" width="200">
-                    {% elif post.filename and post.filetype in ['video', 'audio'] %}
-                        {% if post.filetype == 'video' %}
-                            <video width="200" controls>
-                                <source src="{{ url_for('uploaded_file', filename=post.filename) }}">
-                                Your browser does not support the video tag.
-                            </video>
-                        {% else %}
-                            <audio controls>
-                                <source src="{{ url_for('uploaded_file', filename=post.filename) }}">
-                                Your browser does not support the audio element.
-                            </audio>
-                        {% endif %}
-                    {% elif post.filename and post.filetype in ['pdf', 'zip', 'other'] %}
-                        <a href="{{ url_for('uploaded_file', filename=post.filename) }}" download class="button">Download File</a>
-                    {% endif %}
-                    <button class="star-button {% if post.id in session.get('saved', []) %}star-saved{% else %}star-unsaved{% endif %}" onclick="event.stopPropagation(); toggleStar({{ post.id }}, this);">★</button>
-                </div>
+                {{ post_card(post, True, show_votes=False, download_link=True) }}
+            {% else %}
+                <p>No saved posts yet.</p>
             {% endfor %}
+            {% if next_cursor is not none %}
+                <a href="{{ url_for('saved_posts', before=next_cursor) }}" class="button">Older saved posts</a>
+            {% endif %}
             <a href="{{ url_for('forum') }}" class="button">Back to Forum</a>
         </div>
     </body>
     </html>
-    '''
-    return render_template_string(saved_template, saved_posts_list=saved_posts_list)
+'''
+
+
+@app.route('/saved', methods=["GET"])
+def saved_posts():
+    """The visitor's saved posts, newest first, a page at a time below the ``before`` post ID."""
+    owner = current_voter(create=False)
+    saved_posts_list, next_cursor = [], None
+    if owner is not None:
+        saved_posts_list, next_cursor = storage.saved_page(owner, before=request.args.get("before", type=int),
+                                                           limit=app.config['SAVED_PAGE_SIZE'])
+    return render_template('saved.html', saved_posts_list=saved_posts_list, next_cursor=next_cursor)
 
 
 # ------------------ Chat Integration ------------------
@@ -772,12 +1278,147 @@ def chat():
         username = data.get("username", "Anonymous")
         message = data.get("message", "").strip()
         if message:
-            new_message = {"username": username, "message": message}
-            chat_messages.append(new_message)
+            new_message = storage.add_chat_message(username, message)
+            search_index.add_chat_message(new_message)
+            event_hub.publish('chat', new_message.to_dict())
             return jsonify(new_message)
         return jsonify({"error": "No message provided"}), 400
     else:
-        return jsonify(chat_messages)
+        # Pollers pass the last ID they have seen and only get newer messages.
+        # Either list only changes when a message is added, so the last ID
+        # is its version and a poll with nothing new gets a bodyless 304.
+        after = request.args.get("after", type=int)
+        etag = version_etag('chat', after, storage.last_chat_id())
+        response = not_modified(etag)
+        if response is not None:
+            return response
+        messages = storage.chat_since(after) if after is not None else storage.recent_chat()
+        return revalidated(jsonify(messages), etag)
+
+
+# ------------------ Search ------------------
+template_sources['search.html'] = '''
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>Search - SVU Unofficial Forum</title>
+        <meta name="viewport" content="width=device-width, initial-scale=1">
+        <link rel="stylesheet" href="{{ asset_url('search.css') }}">
+    </head>
+    <body>
+        <div class="header">Search</div>
+        <div class="container">
+            <form method="GET" action="{{ url_for('search') }}">
+                <input type="text" name="q" value="{{ query }}" placeholder="Search posts, comments and chat" autofocus>
+                <select name="kind">
+                    <option value="">Everything</option>
+                    {% for k in kinds %}
+                    <option value="{{ k }}" {% if k == kind %}selected{% endif %}>{{ k|capitalize }}s</option>
+                    {% endfor %}
+                </select>
+                <button type="submit" class="button">Search</button>
+            </form>
+            {% if query %}
+            <p>{{ total }} result{{ '' if total == 1 else 's' }}</p>
+            {% for result in results %}
+            <div class="result">
+                <div class="kind">{{ result.kind }}</div>
+                {% if result.post_id %}
+                <a href="{{ url_for('forum', _anchor='post-%d' % result.post_id) }}">{{ result.snippet }}</a>
+                {% else %}
+                {{ result.snippet }}
+                {% endif %}
+            </div>
+            {% endfor %}
+            <p>
+                {% if page > 1 %}
+                <a href="{{ url_for('search', q=query, kind=kind, page=page - 1) }}" class="button">Previous</a>
+                {% endif %}
+                {% if page * limit < total %}
+                <a href="{{ url_for('search', q=query, kind=kind, page=page + 1) }}" class="button">Next</a>
+                {% endif %}
+            </p>
+            {% endif %}
+            <a href="{{ url_for('forum') }}" class="button">Back to Forum</a>
+        </div>
+    </body>
+    </html>
+'''
+
+
+@app.route('/search', methods=["GET"])
+def search():
+    """
+    Ranked full-text search over posts, comments and chat messages.
+    ``q`` is the query, ``kind`` optionally restricts it to one kind of
+    document and ``page``/``limit`` select the page of results. Responds with
+    JSON when ``format=json`` is given, otherwise with the search page.
+    """
+    query = request.args.get("q", "").strip()
+    kind = request.args.get("kind") or None
+    if kind is not None and kind not in SEARCH_KINDS:
+        return jsonify({"error": "Unknown kind"}), 400
+    page = max(1, request.args.get("page", 1, type=int))
+    limit = max(1, min(request.args.get("limit", 20, type=int), 100))
+    total, results = 0, []
+    if query:
+        search_index.refresh()
+        total, results = search_index.search(query, kind=kind, offset=(page - 1) * limit, limit=limit)
+    if request.args.get("format") == "json":
+        return jsonify({"total": total, "page": page, "results": results})
+    return render_template('search.html', query=query, kind=kind, kinds=SEARCH_KINDS,
+                           page=page, limit=limit, total=total, results=results)
+
+
+# ------------------ Live Updates (Server-Sent Events) ------------------
+@app.route('/events', methods=["GET"])
+def events():
+    """
+    Streams chat messages, new posts, new comments and score changes as
+    Server-Sent Events. Each open stream holds a worker thread, so once
+    EVENT_MAX_SUBSCRIBERS streams are open, further clients get a 503 and
+    fall back to polling.
+    """
+    subscriber = event_hub.subscribe()
+    if subscriber is None:
+        return Response("Too many live update streams", status=503, headers={'Retry-After': '60'})
+
+    def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    payload = subscriber.get(timeout=15)
+                except queue.Empty:
+                    # Keep-alive comment so proxies don't drop idle streams.
+                    yield ": ping\n\n"
+                    continue
+                if payload is EventHub.EVICTED:
+                    break
+                yield payload
+        finally:
+            event_hub.unsubscribe(subscriber)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+# ------------------ Metrics Endpoint ------------------
+@app.route('/metrics', methods=["GET"])
+def metrics_endpoint():
+    if not app.config['METRICS_ENABLED']:
+        return "Not found", 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+# Compile every registered template up front so no request pays for it.
+for template_name in template_sources:
+    app.jinja_env.get_template(template_name)
+
+# Part of every version ETag: changes when a deploy changes a template or a
+# static file, so pages cached from the previous release stop matching.
+RELEASE_TAG = hashlib.sha256("\0".join([template_sources[name] for name in sorted(template_sources)]
+                                        + sorted(asset.url_name for asset in assets)).encode()).hexdigest()[:12]
 
 
 if __name__ == '__main__':
@@ -0,0 +1,136 @@
+"""
+Fingerprinted static assets and response compression.
+
+Stylesheets and scripts under ``static/`` are served under content-hashed
+names (``forum.3f2a9c1b0d4e.js``), so they can be cached by browsers forever
+and a new deploy changes the URL instead of waiting for caches to expire.
+Each asset is compressed once, at startup, with gzip and, when the optional
+``brotli`` package is installed, brotli; the variant sent is picked from the
+request's Accept-Encoding.
+
+To write the fingerprinted and precompressed files for a front proxy to serve
+itself (e.g. nginx with ``gzip_static``/``brotli_static``):
+
+    python assets.py static/ build/
+"""
+import os
+import sys
+import gzip
+import hashlib
+import argparse
+import mimetypes
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content codings we can produce, in order of preference.
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# Media types worth compressing; images and video are compressed already.
+COMPRESSIBLE_TYPES = frozenset({
+    'text/html', 'text/css', 'text/plain', 'text/javascript',
+    'application/javascript', 'application/json', 'image/svg+xml',
+})
+
+
+def compress(data: bytes, encoding: str, fast: bool = False) -> bytes:
+    """
+    Compress ``data`` with ``encoding`` ("br" or "gzip"): as small as possible
+    for assets compressed once, or at a cheaper level with ``fast`` for
+    responses compressed on every request.
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=5 if fast else 11)
+    return gzip.compress(data, compresslevel=6 if fast else 9, mtime=0)
+
+
+def accepted_encoding(accept_encoding, encodings=ENCODINGS) -> str:
+    """The preferred coding among ``encodings`` that the client accepts, or None."""
+    for encoding in encodings:
+        if accept_encoding[encoding]:
+            return encoding
+    return None
+
+
+def fingerprinted_name(name: str, digest: str) -> str:
+    base, ext = os.path.splitext(name)
+    return f"{base}.{digest}{ext}"
+
+
+class Asset:
+    __slots__ = ('name', 'url_name', 'mimetype', 'etag', 'variants')
+
+    def __init__(self, name: str, data: bytes):
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        self.name = name
+        self.url_name = fingerprinted_name(name, digest)
+        self.mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.etag = digest
+        # Content coding (None for identity) -> bytes
+        self.variants = {None: data}
+        if self.mimetype.split(';')[0] in COMPRESSIBLE_TYPES:
+            for encoding in ENCODINGS:
+                compressed = compress(data, encoding)
+                # Tiny files can come out larger; keep only what helps.
+                if len(compressed) < len(data):
+                    self.variants[encoding] = compressed
+
+
+class AssetManifest:
+    """
+    The files under ``directory``, read once, by logical name (``forum.js``)
+    and by fingerprinted name. Files added or changed later are only picked up
+    on restart, which is also what makes the hashed names safe to cache.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._by_name = {}
+        self._by_url_name = {}
+        for root, _, files in os.walk(directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, directory).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    asset = Asset(name, f.read())
+                self._by_name[name] = asset
+                self._by_url_name[asset.url_name] = asset
+
+    def __len__(self) -> int:
+        return len(self._by_name)
+
+    def __iter__(self):
+        return iter(self._by_name.values())
+
+    def url_name(self, name: str) -> str:
+        """Fingerprinted name of the asset ``name``; KeyError if there is no such file."""
+        return self._by_name[name].url_name
+
+    def get(self, url_name: str) -> Asset:
+        """The asset served under ``url_name``, or None for unknown or outdated names."""
+        return self._by_url_name.get(url_name)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Write fingerprinted and precompressed static assets.")
+    parser.add_argument("source")
+    parser.add_argument("destination")
+    args = parser.parse_args()
+
+    manifest = AssetManifest(args.source)
+    suffixes = {None: '', 'gzip': '.gz', 'br': '.br'}
+    for asset in manifest:
+        path = os.path.join(args.destination, *asset.url_name.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for encoding, data in asset.variants.items():
+            with open(path + suffixes[encoding], 'wb') as f:
+                f.write(data)
+        sizes = ", ".join(f"{encoding or 'identity'} {len(data)}" for encoding, data in asset.variants.items())
+        print(f"{asset.name} -> {asset.url_name} ({sizes} bytes)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
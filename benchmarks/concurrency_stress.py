@@ -0,0 +1,113 @@
+"""
+Hammer a storage backend from several processes and threads at once, then
+check that no post or comment ID was handed out twice and no vote was lost.
+Votes go through a VoteBuffer per process, as in the app, so batches are
+flushed with record_votes() from every process at once.
+
+    python benchmarks/concurrency_stress.py [--processes 4] [--threads 8] [--ops 200]
+
+Exits non-zero if any check fails. Use --backend memory to exercise the
+in-memory backend with threads only (it cannot be shared between processes).
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import MemoryStorage, VoteBuffer, open_storage  # noqa: E402
+
+
+def worker(store, votes: VoteBuffer, name: str, post_id: int, comment_id: int, ops: int) -> tuple:
+    """
+    Create posts and comments and vote as a new voter each time; return the
+    IDs that were created. Every voter first votes the other way, so only
+    the replacing vote may count.
+    """
+    post_ids, comment_ids = [], []
+    for i in range(ops):
+        post_ids.append(store.create_post(f"stress {i}", "")['id'])
+        comment_ids.append(store.add_comment(post_id, f"stress {i}")['id'])
+        voter = f"{name}-{i}"
+        action = 'up' if i % 4 else 'down'
+        votes.vote(voter, 'post', post_id, post_id, 'down' if action == 'up' else 'up')
+        votes.vote(voter, 'post', post_id, post_id, action)
+        votes.vote(voter, 'comment', post_id, comment_id, 'up')
+        votes.vote(voter, 'comment', post_id, comment_id, 'up')
+    return post_ids, comment_ids
+
+
+def run_threads(store, process: int, post_id: int, comment_id: int, threads: int, ops: int) -> tuple:
+    votes = VoteBuffer(store, flush_interval=0.01, max_pending=50)
+    votes.start()
+    try:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(lambda t: worker(store, votes, f"voter-{process}-{t}", post_id, comment_id, ops),
+                                    range(threads)))
+    finally:
+        votes.close()
+    return ([pid for posts, _ in results for pid in posts],
+            [cid for _, comments in results for cid in comments])
+
+
+def run_process(url: str, process: int, post_id: int, comment_id: int, threads: int, ops: int) -> tuple:
+    return run_threads(open_storage(url), process, post_id, comment_id, threads, ops)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backend", choices=["sqlite", "memory"], default="sqlite")
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=200, help="operations per thread")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.backend == "memory":
+        store = MemoryStorage()
+        target = store.create_post("target", "")
+        seed = store.add_comment(target['id'], "target")
+        results = [run_threads(store, 0, target['id'], seed['id'], args.threads, args.ops)]
+        workers = args.threads
+    else:
+        tmp = tempfile.mkdtemp()
+        url = "sqlite:///" + os.path.join(tmp, "stress.db")
+        store = open_storage(url)
+        target = store.create_post("target", "")
+        seed = store.add_comment(target['id'], "target")
+        with multiprocessing.Pool(args.processes) as pool:
+            results = pool.starmap(run_process, [(url, process, target['id'], seed['id'], args.threads, args.ops)
+                                                 for process in range(args.processes)])
+        workers = args.processes * args.threads
+    elapsed = time.perf_counter() - started
+
+    post_ids = [pid for posts, _ in results for pid in posts]
+    comment_ids = [cid for _, comments in results for cid in comments]
+    total = workers * args.ops
+    downs = workers * len(range(0, args.ops, 4))
+    post = store.get_post(target['id'])
+    comment = next(c for c in post['comments'] if c['id'] == seed['id'])
+
+    checks = [
+        ("posts created", len(post_ids), total),
+        ("distinct post IDs", len(set(post_ids)), total),
+        ("distinct comment IDs", len(set(comment_ids + [seed['id']])), total + 1),
+        ("post upvotes", post['upvotes'], total - downs),
+        ("post downvotes", post['downvotes'], downs),
+        ("comment upvotes", comment['upvotes'], total),
+    ]
+    failed = False
+    for name, got, expected in checks:
+        status = "ok" if got == expected else "FAIL"
+        failed |= got != expected
+        print(f"{name:<22} {got:>8} (expected {expected}) {status}")
+    print(f"{workers} workers x {args.ops} ops in {elapsed:.2f}s ({args.backend})")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
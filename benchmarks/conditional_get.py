@@ -0,0 +1,59 @@
+"""
+Compare full responses with 304 Not Modified answers for the pages clients
+revalidate: /forum, a post overlay and the /chat poll.
+
+    python benchmarks/conditional_get.py [--posts 200] [--comments 50] [--runs 200]
+
+Each page is fetched once for its ETag, then timed with and without sending
+the tag back in If-None-Match.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("FORUM_STORAGE", "memory")
+os.chdir(tempfile.mkdtemp())
+
+import app as forum_app  # noqa: E402
+
+
+def seed(posts: int, comments: int) -> int:
+    storage = forum_app.storage
+    for i in range(posts):
+        storage.create_post(f"Post {i}", "Lorem ipsum dolor sit amet " * 4)
+    post_id = storage.page_posts(limit=1)[0][0]['id']
+    for i in range(comments):
+        storage.add_comment(post_id, f"Comment {i}")
+    for i in range(50):
+        storage.add_chat_message("user", f"message {i}")
+    return post_id
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--posts", type=int, default=200)
+    parser.add_argument("--comments", type=int, default=50)
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    post_id = seed(args.posts, args.comments)
+    client = forum_app.app.test_client()
+    headers = {'Accept-Encoding': 'gzip'}
+    for url in ('/forum', f'/post_overlay/{post_id}', f'/chat?after={forum_app.storage.last_chat_id() - 5}'):
+        response = client.get(url, headers=headers)
+        etag = response.headers['ETag']
+        revalidate = dict(headers, **{'If-None-Match': etag})
+        assert client.get(url, headers=revalidate).status_code == 304
+
+        full = min(timeit.repeat(lambda: client.get(url, headers=headers), number=1, repeat=args.runs)) * 1000
+        cached = min(timeit.repeat(lambda: client.get(url, headers=revalidate), number=1, repeat=args.runs)) * 1000
+        print(f"{url:<24} 200: {full:7.3f} ms, {len(response.data):6} bytes   "
+              f"304: {cached:7.3f} ms   {full / cached:5.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Time paging through the hot and top feeds of a storage backend, from the
+first page to the last, against sorting every post for each request.
+
+    python benchmarks/feed_paging.py [--backend memory|sqlite] [--posts 50000] [--old-posts 20000]
+
+A page should cost about the same at any depth; the full sort grows with the
+number of posts. The --old-posts are backdated 60 days and voted higher than
+the recent ones, so the day/week/month feeds have to skip past them: those
+pages should cost no more than all-time ones.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import hot_rank, open_storage  # noqa: E402
+
+
+def walk(store, sort: str, window: str, limit: int) -> list:
+    """Page through a whole feed; return the time each page took, in ms."""
+    timings = []
+    cursor = None
+    while True:
+        started = time.perf_counter()
+        _, cursor = store.page_posts(before=cursor, limit=limit, sort=sort, window=window)
+        timings.append((time.perf_counter() - started) * 1000)
+        if cursor is None:
+            return timings
+
+
+def seed(store, count: int, rng: random.Random, mean_votes: float) -> None:
+    for i in range(count):
+        post = store.create_post(f"post {i}", "")
+        store.record_votes([(f"voter{j}", 'post', post['id'], post['id'], 'up' if rng.random() < 0.8 else 'down')
+                            for j in range(int(rng.expovariate(1 / mean_votes)))])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backend", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--posts", type=int, default=50000)
+    parser.add_argument("--old-posts", type=int, default=20000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    url = "memory" if args.backend == "memory" else "sqlite:///" + os.path.join(tempfile.mkdtemp(), "feed.db")
+    store = open_storage(url)
+    started = time.perf_counter()
+    with mock.patch("time.time", return_value=time.time() - 60 * 24 * 3600):
+        seed(store, args.old_posts, rng, mean_votes=10)
+    seed(store, args.posts, rng, mean_votes=2)
+    print(f"created {args.old_posts} old and {args.posts} recent posts in {time.perf_counter() - started:.1f}s "
+          f"({args.backend})")
+
+    for sort, window in (("hot", "all"), ("top", "all"), ("top", "day"), ("top", "month")):
+        timings = walk(store, sort, window, args.limit)
+        head, tail = timings[:10], timings[-10:]
+        print(f"{sort}/{window}: {len(timings)} pages, first pages median {statistics.median(head):.3f} ms, "
+              f"last pages median {statistics.median(tail):.3f} ms")
+
+    # What each request would cost if the feed were sorted on demand.
+    posts, cursor = [], None
+    while True:
+        page, cursor = store.page_posts(before=cursor, limit=1000)
+        posts += page
+        if cursor is None:
+            break
+    started = time.perf_counter()
+    sorted(posts, key=lambda p: hot_rank(p['upvotes'], p['downvotes'], p['created_at']), reverse=True)
+    print(f"sorting all {len(posts)} posts per request: {(time.perf_counter() - started) * 1000:.1f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
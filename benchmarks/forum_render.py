@@ -0,0 +1,65 @@
+"""
+Compare rendering /forum with 1k posts through a per-request
+render_template_string (the old approach) and the precompiled registry.
+
+    python benchmarks/forum_render.py [--posts 1000] [--runs 50]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("FORUM_STORAGE", "memory")
+# The app creates its upload folder in the working directory.
+os.chdir(tempfile.mkdtemp())
+
+from flask import render_template, render_template_string  # noqa: E402
+
+import app as forum_app  # noqa: E402
+
+
+def seed(count: int) -> None:
+    for i in range(count):
+        post = forum_app.storage.create_post(
+            f"Post {i}",
+            "Lorem ipsum dolor sit amet " * 4,
+            f"{i:032x}_image.png" if i % 3 == 0 else None,
+            'image' if i % 3 == 0 else None
+        )
+        forum_app.storage.record_votes([("voter", 'post', post['id'], post['id'], 'up')])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    seed(args.posts)
+    app = forum_app.app
+    page, next_cursor = forum_app.storage.page_posts(limit=args.posts)
+    context = dict(posts=page, next_cursor=next_cursor, sort='new', window='all',
+                   top_windows=forum_app.TOP_WINDOWS, chat_messages=[], last_chat_id=0)
+    source = forum_app.template_sources['forum.html']
+
+    with app.test_request_context('/forum'):
+        def per_request():
+            return render_template_string(source, **context)
+
+        def precompiled():
+            return render_template('forum.html', **context)
+
+        assert per_request() == precompiled()
+        results = {}
+        for name, fn in (("render_template_string", per_request), ("precompiled", precompiled)):
+            results[name] = min(timeit.repeat(fn, number=1, repeat=args.runs)) * 1000
+
+    for name, ms in results.items():
+        print(f"{name:<24} {ms:8.2f} ms per /forum render ({args.posts} posts)")
+    print(f"{'speedup':<24} {results['render_template_string'] / results['precompiled']:8.2f}x")
+
+
+if __name__ == '__main__':
+    main()
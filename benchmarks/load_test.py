@@ -0,0 +1,345 @@
+"""
+Load test the forum's routes and report throughput and latency percentiles
+per endpoint.
+
+    python benchmarks/load_test.py [--posts 500] [--requests 5000] [--mode client|http]
+                                   [--output results.json] [--compare baseline.json]
+
+The store is seeded with --posts posts, each with --comments top-level
+comments that have --reply-width replies per comment down to --reply-depth
+levels, and --chat chat messages. A fixed, seeded sequence of requests is
+then sent, either through Flask's test client (--mode client) or over HTTP
+to the app served on a local port (--mode http), from --concurrency threads.
+Everything runs offline. With --output the results are written as JSON, and
+--compare prints the change against an earlier results file.
+"""
+import argparse
+import http.client
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("FORUM_STORAGE", "memory")
+# The app keeps uploads (and, for sqlite, the database) in the working directory,
+# so it is imported from a scratch one. --output and --compare paths are
+# relative to where the script was started.
+START_DIR = os.getcwd()
+os.chdir(tempfile.mkdtemp())
+
+import app as forum_app  # noqa: E402
+
+WORDS = ("exam schedule library campus lecture notes parking housing tuition club "
+         "project deadline professor grades semester cafeteria shuttle internship").split()
+
+# Relative weight of each kind of request in the mix.
+DEFAULT_MIX = {
+    'forum': 10,
+    'forum_page': 10,
+    'forum_hot': 5,
+    'post_overlay': 15,
+    'comment_thread': 5,
+    'chat_poll': 20,
+    'search': 5,
+    'vote_post': 10,
+    'vote_comment': 5,
+    'comment': 5,
+    'chat_post': 5,
+    'create_post': 2,
+}
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def seed_store(storage, args, rng: random.Random) -> dict:
+    """Fill the store; return the IDs the request generator needs."""
+    post_ids, comment_ids = [], {}
+    for _ in range(args.posts):
+        post_id = storage.create_post(sentence(rng, 5), sentence(rng, 30))['id']
+        post_ids.append(post_id)
+        comment_ids[post_id] = []
+        level = [None] * args.comments
+        for depth in range(args.reply_depth + 1):
+            below = []
+            for parent in level:
+                comment = storage.add_comment(post_id, sentence(rng, 12), parent_id=parent)
+                comment_ids[post_id].append(comment['id'])
+                below.extend([comment['id']] * args.reply_width)
+            level = below
+    for i in range(args.chat):
+        storage.add_chat_message(f"user{i % 50}", sentence(rng, 8))
+    return {'posts': post_ids, 'comments': comment_ids}
+
+
+def build_requests(ids: dict, mix: dict, count: int, rng: random.Random) -> list:
+    """The request sequence: (name, method, path, form body or None, JSON body or None)."""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    posts = ids['posts']
+    last_chat = forum_app.storage.last_chat_id()
+    requests = []
+    for name in rng.choices(names, weights, k=count):
+        post_id = rng.choice(posts)
+        comments = ids['comments'][post_id]
+        if name == 'forum':
+            req = ('GET', '/forum', None, None)
+        elif name == 'forum_page':
+            req = ('GET', f'/forum/page?before={rng.choice(posts)}', None, None)
+        elif name == 'forum_hot':
+            req = ('GET', '/forum/page?sort=hot', None, None)
+        elif name == 'post_overlay':
+            req = ('GET', f'/post_overlay/{post_id}', None, None)
+        elif name == 'comment_thread':
+            parent = f'?parent={rng.choice(comments)}' if comments else ''
+            req = ('GET', f'/post/{post_id}/comments{parent}', None, None)
+        elif name == 'chat_poll':
+            req = ('GET', f'/chat?after={max(0, last_chat - rng.randint(0, 20))}', None, None)
+        elif name == 'search':
+            req = ('GET', '/search?format=json&q=' + urllib.parse.quote(sentence(rng, rng.randint(1, 2))),
+                   None, None)
+        elif name == 'vote_post':
+            req = ('POST', f'/vote/post/{post_id}', None, {'action': rng.choice(['up', 'down'])})
+        elif name == 'vote_comment' and comments:
+            req = ('POST', f'/vote/comment/{post_id}/{rng.choice(comments)}', None,
+                   {'action': rng.choice(['up', 'down'])})
+        elif name == 'comment':
+            req = ('POST', f'/comment/{post_id}', {'comment': sentence(rng, 12)}, None)
+        elif name == 'chat_post':
+            req = ('POST', '/chat', None, {'username': 'loadtest', 'message': sentence(rng, 8)})
+        elif name == 'create_post':
+            req = ('POST', '/forum', {'title': sentence(rng, 5), 'text': sentence(rng, 30)}, None)
+        else:
+            continue
+        requests.append((name,) + req)
+    return requests
+
+
+class ClientDriver:
+    """Sends requests through Flask's test client, logged in as the admin user."""
+
+    def __init__(self):
+        self.client = forum_app.app.test_client()
+        self.client.post('/login', data={'username': 'admin', 'password': 'adminpass'})
+
+    def send(self, method: str, path: str, form: dict, body: dict) -> int:
+        response = self.client.open(path, method=method, data=form, json=body)
+        response.get_data()
+        response.close()
+        return response.status_code
+
+
+class HTTPDriver:
+    """Sends requests over HTTP to the locally served app, one connection per request."""
+
+    def __init__(self, port: int):
+        self.port = port
+        self.cookie = None
+        self.send('POST', '/login', {'username': 'admin', 'password': 'adminpass'}, None)
+
+    def send(self, method: str, path: str, form: dict, body: dict) -> int:
+        headers = {}
+        payload = None
+        if form is not None:
+            payload = urllib.parse.urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        try:
+            conn.request(method, path, body=payload, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            cookie = response.getheader('Set-Cookie')
+            if cookie:
+                self.cookie = cookie.split(';', 1)[0]
+            return response.status
+        finally:
+            conn.close()
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(pct / 100 * len(sorted_values))
+    return sorted_values[min(len(sorted_values), max(1, rank)) - 1]
+
+
+def run(requests: list, make_driver, concurrency: int) -> tuple:
+    """Send the requests from ``concurrency`` threads; return per-request results and wall time."""
+    results = [None] * len(requests)
+    drivers = [make_driver() for _ in range(concurrency)]
+
+    def worker(n: int):
+        driver = drivers[n]
+        for i in range(n, len(requests), concurrency):
+            name, method, path, form, body = requests[i]
+            started = time.perf_counter()
+            try:
+                status = driver.send(method, path, form, body)
+            except Exception:
+                status = 0
+            results[i] = (name, time.perf_counter() - started, status)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def summarize(results: list, wall: float) -> dict:
+    by_name = {}
+    for name, seconds, status in results:
+        by_name.setdefault(name, []).append((seconds, status))
+    endpoints = {}
+    for name, samples in sorted(by_name.items()):
+        latencies = sorted(seconds * 1000 for seconds, _ in samples)
+        endpoints[name] = {
+            'requests': len(samples),
+            'errors': sum(1 for _, status in samples if not 200 <= status < 400),
+            'throughput': round(len(samples) / wall, 1),
+            'mean_ms': round(sum(latencies) / len(latencies), 3),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'max_ms': round(latencies[-1], 3),
+        }
+    all_latencies = sorted(seconds * 1000 for _, seconds, _ in results)
+    total = {
+        'requests': len(results),
+        'errors': sum(e['errors'] for e in endpoints.values()),
+        'seconds': round(wall, 3),
+        'throughput': round(len(results) / wall, 1),
+        'p50_ms': round(percentile(all_latencies, 50), 3),
+        'p95_ms': round(percentile(all_latencies, 95), 3),
+        'p99_ms': round(percentile(all_latencies, 99), 3),
+    }
+    return {'total': total, 'endpoints': endpoints}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "-C", ROOT, "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report: dict, baseline: dict = None) -> None:
+    def change(new: float, old: float) -> str:
+        return f"{(new - old) / old * 100:+6.1f}%" if old else "    n/a"
+
+    header = f"{'endpoint':<16} {'reqs':>6} {'err':>4} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    if baseline:
+        header += f" {'p50 chg':>8} {'p95 chg':>8}"
+    print(header)
+    rows = list(report['endpoints'].items()) + [('TOTAL', report['total'])]
+    for name, row in rows:
+        line = (f"{name:<16} {row['requests']:>6} {row['errors']:>4} {row['throughput']:>8.1f} "
+                f"{row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f}")
+        if baseline:
+            old = baseline['total'] if name == 'TOTAL' else baseline['endpoints'].get(name)
+            if old:
+                line += f" {change(row['p50_ms'], old['p50_ms']):>8} {change(row['p95_ms'], old['p95_ms']):>8}"
+        print(line)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--posts", type=int, default=500)
+    parser.add_argument("--comments", type=int, default=3, help="top-level comments per post")
+    parser.add_argument("--reply-width", type=int, default=2, help="replies per comment")
+    parser.add_argument("--reply-depth", type=int, default=2, help="levels of replies below each comment")
+    parser.add_argument("--chat", type=int, default=500, help="chat messages")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--warmup", type=int, default=200, help="requests sent before measuring")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--mode", choices=["client", "http"], default="client")
+    parser.add_argument("--only", help="comma-separated request kinds to send, from: " + ", ".join(DEFAULT_MIX))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    mix = dict(DEFAULT_MIX)
+    if args.only:
+        mix = {name: mix[name] for name in args.only.split(",")}
+    rng = random.Random(args.seed)
+
+    started = time.perf_counter()
+    ids = seed_store(forum_app.storage, args, rng)
+    seed_seconds = time.perf_counter() - started
+    stats = forum_app.storage.stats()
+    print(f"seeded {stats['posts']} posts, {stats['comments']} comments, "
+          f"{stats['chat_messages']} chat messages in {seed_seconds:.1f}s")
+
+    server = None
+    if args.mode == "http":
+        from werkzeug.serving import make_server
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        server = make_server('127.0.0.1', 0, forum_app.app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        make_driver = lambda: HTTPDriver(server.server_port)  # noqa: E731
+    else:
+        make_driver = ClientDriver
+
+    try:
+        if args.warmup:
+            run(build_requests(ids, mix, args.warmup, random.Random(args.seed + 1)), make_driver, args.concurrency)
+        requests = build_requests(ids, mix, args.requests, rng)
+        results, wall = run(requests, make_driver, args.concurrency)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'storage': os.environ["FORUM_STORAGE"].split(":", 1)[0],
+            'mode': args.mode,
+            'concurrency': args.concurrency,
+            'seed': args.seed,
+            'mix': mix,
+        },
+        'data': {
+            'posts': stats['posts'],
+            'comments': stats['comments'],
+            'chat_messages': stats['chat_messages'],
+            'seed_seconds': round(seed_seconds, 3),
+        },
+    }
+    report.update(summarize(results, wall))
+    baseline = None
+    if args.compare:
+        with open(os.path.join(START_DIR, args.compare), encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.output:
+        with open(os.path.join(START_DIR, args.output), 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 1 if report['total']['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
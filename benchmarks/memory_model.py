@@ -0,0 +1,75 @@
+"""
+Measure how much memory MemoryStorage needs per post and per comment,
+counting the records themselves and every index kept over them.
+
+    python benchmarks/memory_model.py [--comments 1000000] [--comments-per-post 20]
+
+Allocations are traced with tracemalloc while the store is filled, first with
+posts and then with comments, about 60% of them replies. The size of a single
+record is also compared with the dict layout used before.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from storage import MemoryStorage, new_comment, new_post  # noqa: E402
+
+
+def deep_size(obj) -> int:
+    """Size of a record or dict with its (shallow) field values, strings excluded."""
+    size = sys.getsizeof(obj)
+    values = obj.values() if isinstance(obj, dict) else (getattr(obj, name) for name in obj.__slots__)
+    for value in values:
+        if isinstance(value, (list, tuple, float)) and value != ():
+            size += sys.getsizeof(value)
+    return size
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--comments", type=int, default=1000000)
+    parser.add_argument("--comments-per-post", type=int, default=20)
+    parser.add_argument("--reply-fraction", type=float, default=0.6)
+    args = parser.parse_args()
+
+    posts = max(1, args.comments // args.comments_per_post)
+    rng = random.Random(1)
+    tracemalloc.start()
+    storage = MemoryStorage()
+    base = tracemalloc.get_traced_memory()[0]
+
+    started = time.perf_counter()
+    post_ids = [storage.create_post(f"post {i}", "", "a.png", "image")['id'] for i in range(posts)]
+    after_posts = tracemalloc.get_traced_memory()[0]
+    comment_ids = {post_id: [] for post_id in post_ids}
+    for i in range(args.comments):
+        post_id = post_ids[i % posts]
+        siblings = comment_ids[post_id]
+        parent = rng.choice(siblings) if siblings and rng.random() < args.reply_fraction else None
+        siblings.append(storage.add_comment(post_id, "", parent_id=parent)['id'])
+    # The bookkeeping of this script is not part of the store.
+    del comment_ids, siblings
+    after_comments = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # Titles and texts are excluded above by keeping them empty or short.
+    print(f"{posts} posts, {args.comments} comments in {time.perf_counter() - started:.1f}s")
+    print(f"per post:    {(after_posts - base) / posts:8.0f} bytes")
+    print(f"per comment: {(after_comments - after_posts) / args.comments:8.0f} bytes")
+    print(f"total:       {(after_comments - base) / 2 ** 20:8.1f} MiB")
+
+    post, comment = new_post(1, "", "", None, None), new_comment(1, "")
+    old_post, old_comment = dict(post, comments=[]), dict(comment, replies=[])
+    print(f"single record vs old dict layout: post {deep_size(post)} vs {deep_size(old_post)} bytes, "
+          f"comment {deep_size(comment)} vs {deep_size(old_comment)} bytes")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,70 @@
+"""
+Measure what the request metrics cost: the same mix of requests is timed with
+METRICS_ENABLED off and on, in alternating rounds to even out noise, and the
+metric updates themselves are timed in isolation.
+
+    python benchmarks/metrics_overhead.py [--rounds 10] [--requests 500]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("FORUM_STORAGE", "memory")
+os.chdir(tempfile.mkdtemp())
+
+import app as forum_app  # noqa: E402
+from metrics import Counter, Histogram  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=500, help="requests per round")
+    args = parser.parse_args()
+
+    storage = forum_app.storage
+    post_id = None
+    for i in range(50):
+        post_id = storage.create_post(f"post {i}", "text " * 20)['id']
+        storage.add_comment(post_id, f"comment {i}")
+    for i in range(20):
+        storage.add_chat_message("bench", f"message {i}")
+    urls = ["/forum", f"/post_overlay/{post_id}", "/chat?after=10", "/forum/page?before=30", "/missing"]
+    client = forum_app.app.test_client()
+
+    def run_round() -> float:
+        started = time.perf_counter()
+        for i in range(args.requests):
+            client.get(urls[i % len(urls)]).close()
+        return (time.perf_counter() - started) / args.requests * 1e6
+
+    run_round()  # warm up caches
+    timings = {False: [], True: []}
+    for _ in range(args.rounds):
+        for enabled in (False, True):
+            forum_app.app.config['METRICS_ENABLED'] = enabled
+            timings[enabled].append(run_round())
+    off, on = statistics.median(timings[False]), statistics.median(timings[True])
+    print(f"per request, metrics off: {off:.1f} us, on: {on:.1f} us, "
+          f"overhead {on - off:.1f} us ({(on - off) / off * 100:.1f}%)")
+
+    histogram = Histogram("h", "", ("endpoint", "method"))
+    counter = Counter("c", "", ("endpoint", "method", "status"))
+    n = 200000
+    observe = timeit.timeit(lambda: histogram.observe(0.004, "forum", "GET"), number=n) / n * 1e6
+    inc = timeit.timeit(lambda: counter.inc("forum", "GET", "200"), number=n) / n * 1e6
+    print(f"Histogram.observe: {observe:.2f} us, Counter.inc: {inc:.2f} us")
+    started = time.perf_counter()
+    text = forum_app.metrics.render()
+    print(f"rendering /metrics ({text.count(chr(10))} lines): {(time.perf_counter() - started) * 1000:.2f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Measure the post overlay's response time and size as a post's comment thread
+grows, to check both stay bounded.
+
+    python benchmarks/overlay_threads.py [--sizes 100,1000,10000]
+
+Each thread has a mix of top-level comments and nested replies with random
+votes. The full tree, as get_post() returns it, is reported for comparison.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("FORUM_STORAGE", "memory")
+os.chdir(tempfile.mkdtemp())
+
+import app as forum_app  # noqa: E402
+
+
+def build_thread(storage, size: int, rng: random.Random) -> int:
+    post_id = storage.create_post(f"thread of {size}", "")['id']
+    ids = []
+    for i in range(size):
+        parent = rng.choice(ids) if ids and rng.random() < 0.7 else None
+        comment = storage.add_comment(post_id, f"comment {i} " + "lorem ipsum " * 5, parent_id=parent)
+        ids.append(comment['id'])
+        storage.record_votes([(f"voter{j}", 'comment', post_id, comment['id'], 'up' if rng.random() < 0.75 else 'down')
+                              for j in range(int(rng.expovariate(0.7)))])
+    return post_id
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="100,1000,10000")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    client = forum_app.app.test_client()
+    storage = forum_app.storage
+    print(f"{'comments':>9} {'overlay ms':>11} {'overlay KB':>11} {'full tree KB':>13}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        post_id = build_thread(storage, size, rng)
+        timings = []
+        for _ in range(args.repeat):
+            # Bump the post's version so every request renders the thread.
+            storage.touch_post(post_id)
+            started = time.perf_counter()
+            body = client.get(f"/post_overlay/{post_id}").get_data()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        full_tree = len(json.dumps([c.to_dict() for c in storage.get_post(post_id)['comments']]))
+        print(f"{size:>9} {timings[len(timings) // 2]:>11.2f} {len(body) / 1024:>11.1f} {full_tree / 1024:>13.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
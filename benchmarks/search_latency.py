@@ -0,0 +1,71 @@
+"""
+Measure how long it takes to build the search index and answer queries
+against it, with a synthetic corpus of posts, comments and chat messages.
+
+    python benchmarks/search_latency.py [--docs 300000] [--queries 500]
+
+Words are drawn from a Zipf-like distribution so a few terms are very common
+and most are rare, as in real text.
+"""
+import argparse
+import itertools
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search import SearchIndex  # noqa: E402
+from storage import MemoryStorage  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--docs", type=int, default=300000)
+    parser.add_argument("--words", type=int, default=20, help="words per document")
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocabulary = [f"w{i}" for i in range(args.vocabulary)]
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(args.vocabulary)))
+
+    def sentence(k: int) -> str:
+        return " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=k))
+
+    texts = [sentence(args.words) for _ in range(args.docs)]
+    index = SearchIndex(MemoryStorage())
+    started = time.perf_counter()
+    for i, text in enumerate(texts, 1):
+        if i % 3 == 0:
+            index.add('post', i, text, post_id=i)
+        elif i % 3 == 1:
+            index.add('comment', i, text, post_id=i)
+        else:
+            index.add('chat', i, text)
+    build = time.perf_counter() - started
+    print(f"indexed {len(index)} documents in {build:.2f}s ({len(index) / build:.0f} docs/s)")
+
+    # Queries of one to three words sampled the same way as the documents,
+    # so common terms show up in queries as often as they do in text.
+    for words in (1, 2, 3):
+        timings, hits = [], []
+        for _ in range(args.queries):
+            query = sentence(words)
+            started = time.perf_counter()
+            total, _ = index.search(query, limit=20)
+            timings.append((time.perf_counter() - started) * 1000)
+            hits.append(total)
+        timings.sort()
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        print(f"{words}-word queries: median {statistics.median(timings):.2f} ms, "
+              f"p95 {p95:.2f} ms, max {timings[-1]:.2f} ms, median hits {statistics.median(hits):.0f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""
+Time writing a snapshot of a large in-memory forum and restoring it, as a
+restart with SNAPSHOT_PATH set would.
+
+    python benchmarks/snapshot_restore.py [--comments 1000000] [--comments-per-post 20]
+
+The store is filled through load_state() with synthetic posts, comment
+trees (about 60% replies), votes and chat, so building it stays quick.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from snapshot import load_snapshot, write_snapshot  # noqa: E402
+from storage import MemoryStorage  # noqa: E402
+
+
+def synthetic_state(posts: int, comments: int, rng: random.Random) -> dict:
+    now = time.time()
+    post_rows = [(i, f"post {i}", "lorem ipsum " * 10, None, None, rng.randint(0, 50), rng.randint(0, 10),
+                  0, now - rng.random() * 90 * 86400) for i in range(1, posts + 1)]
+    comment_rows = []
+    per_post = {}
+    for cid in range(1, comments + 1):
+        post_id = rng.randint(1, posts)
+        siblings = per_post.setdefault(post_id, [])
+        parent = rng.choice(siblings) if siblings and rng.random() < 0.6 else None
+        siblings.append(cid)
+        comment_rows.append((cid, post_id, parent, f"comment {cid} lorem ipsum", rng.randint(0, 20), rng.randint(0, 5)))
+    return {
+        'posts': post_rows,
+        'comments': comment_rows,
+        'users': [],
+        'votes': [(f"user:u{i % 1000}", 'comment', rng.randint(1, comments), 'up') for i in range(comments // 10)],
+        'media': [],
+        'saved': [(f"user:u{i % 1000}", rng.randint(1, posts)) for i in range(posts // 10)],
+        'chat': [(i, "user", f"message {i}", now) for i in range(1, 501)],
+        'last_chat_id': 500,
+        'last_post_id': posts,
+        'comment_id_counter': comments + 1,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--comments", type=int, default=1000000)
+    parser.add_argument("--comments-per-post", type=int, default=20)
+    args = parser.parse_args()
+
+    posts = max(1, args.comments // args.comments_per_post)
+    storage = MemoryStorage()
+    started = time.perf_counter()
+    storage.load_state(synthetic_state(posts, args.comments, random.Random(1)))
+    print(f"built {posts} posts, {args.comments} comments in {time.perf_counter() - started:.1f}s")
+
+    path = os.path.join(tempfile.mkdtemp(), "forum.snap")
+    started = time.perf_counter()
+    size = write_snapshot(storage, path)
+    print(f"write:   {time.perf_counter() - started:6.2f}s, {size / 2 ** 20:.1f} MiB")
+
+    restored = MemoryStorage()
+    started = time.perf_counter()
+    load_snapshot(restored, path)
+    print(f"restore: {time.perf_counter() - started:6.2f}s")
+    assert restored.stats() == storage.stats()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""
+Report the bytes each kind of /uploads request transfers: full downloads,
+revalidations and Range requests.
+
+    python benchmarks/uploads_http.py [--size-mb 8]
+
+Runs against a throwaway upload folder through Flask's test client. The
+status codes and headers are checked by tests/test_uploads.py.
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("FORUM_STORAGE", "memory")
+# The app puts its upload folder in the working directory.
+os.chdir(tempfile.mkdtemp())
+
+import app as forum_app  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=8)
+    args = parser.parse_args()
+
+    data = os.urandom(args.size_mb * 1024 * 1024)
+    digest = hashlib.sha256(data).hexdigest()
+    filename = f"{digest}.mp4"
+    with open(os.path.join(forum_app.app.config['UPLOAD_FOLDER'], filename), 'wb') as f:
+        f.write(data)
+    url = f"/uploads/{filename}"
+    client = forum_app.app.test_client()
+    size = len(data)
+    mid = size // 2
+
+    cases = [
+        ("full download", {}),
+        ("revalidate (If-None-Match)", {'If-None-Match': f'"{digest}"'}),
+        ("first 64 KiB (Range)", {'Range': 'bytes=0-65535'}),
+        ("seek to middle (Range)", {'Range': f'bytes={mid}-{mid + 1023}'}),
+        ("last 1 KiB (suffix Range)", {'Range': 'bytes=-1024'}),
+        ("If-Range with current ETag", {'Range': 'bytes=0-9', 'If-Range': f'"{digest}"'}),
+        ("If-Range with stale ETag", {'Range': 'bytes=0-9', 'If-Range': '"stale"'}),
+        ("unsatisfiable Range", {'Range': f'bytes={size}-'}),
+    ]
+
+    print(f"{'request':<30} {'status':>6} {'bytes':>10}  share of file")
+    for name, headers in cases:
+        response = client.get(url, headers=headers)
+        served = len(response.get_data())
+        print(f"{name:<30} {response.status_code:>6} {served:>10}  {served / size:8.2%}")
+        response.close()
+    print(f"file size {size} bytes")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Opt-in cProfile sampling of live requests.
+
+A request is profiled when it is picked by the sample rate, when its endpoint
+is listed, or when it carries the ``X-Profile`` header with the configured
+token. Profiles are aggregated per endpoint and written to
+``<directory>/<endpoint>.<pid>.prof`` in pstats format, every
+``flush_every`` profiled requests and at exit.
+
+To inspect them, merged across worker processes:
+
+    python profiling.py profiles/ [endpoint] [--sort cumulative] [--limit 30]
+"""
+import os
+import sys
+import glob
+import pstats
+import random
+import logging
+import argparse
+import cProfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Profile"
+
+
+class RequestProfiler:
+    """
+    Decides which requests to profile and keeps their aggregated stats.
+    Only one request per process is profiled at a time; requests that arrive
+    while another is being profiled are skipped rather than queued.
+    """
+
+    def __init__(self, directory: str, sample_rate: float = 0.0, endpoints=(), token: str = None,
+                 flush_every: int = 20):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.endpoints = frozenset(endpoints)
+        self.token = token
+        self.flush_every = flush_every
+        self._active = threading.Lock()
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._unflushed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or bool(self.endpoints) or bool(self.token)
+
+    def wanted(self, endpoint: str, headers) -> bool:
+        if endpoint in self.endpoints:
+            return True
+        if self.token and headers.get(PROFILE_HEADER) == self.token:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self) -> cProfile.Profile:
+        """Start profiling the current request; None if another request holds the profiler."""
+        if not self._active.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def stop(self, profile: cProfile.Profile, endpoint: str) -> None:
+        profile.disable()
+        self._active.release()
+        flush = False
+        with self._lock:
+            stats = self._stats.get(endpoint)
+            if stats is None:
+                self._stats[endpoint] = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+            self._unflushed += 1
+            if self._unflushed >= self.flush_every:
+                flush = True
+        if flush:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the aggregated stats of every endpoint profiled so far."""
+        with self._lock:
+            self._unflushed = 0
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                for endpoint, stats in self._stats.items():
+                    path = os.path.join(self.directory, f"{endpoint}.{os.getpid()}.prof")
+                    stats.dump_stats(path + ".tmp")
+                    os.replace(path + ".tmp", path)
+            except OSError as e:
+                logger.error("Error writing profiles: %s", e)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Print profiles saved by RequestProfiler.")
+    parser.add_argument("directory")
+    parser.add_argument("endpoint", nargs="?", default="*")
+    parser.add_argument("--sort", default="cumulative")
+    parser.add_argument("--limit", type=int, default=30)
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.directory, f"{args.endpoint}.*.prof")))
+    if not paths:
+        print("No profiles found", file=sys.stderr)
+        return 1
+    stats = pstats.Stats(*paths)
+    stats.sort_stats(args.sort).print_stats(args.limit)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+Full-text search over posts, comments and chat messages.
+
+``SearchIndex`` is an in-memory inverted index kept up to date as content is
+written. Results are ranked with BM25 and every query term has to match.
+"""
+import re
+import math
+import heapq
+import threading
+from array import array
+from bisect import bisect_left
+
+# Document kinds, stored as small integers in the index.
+KINDS = ('post', 'comment', 'chat')
+KIND_CODES = {kind: code for code, kind in enumerate(KINDS)}
+
+# Common words that would match most documents and add nothing to the ranking.
+STOP_WORDS = frozenset("""
+a an and are as at be but by for from has have i if in into is it its me my
+no not of on or our so that the their them then there these they this to
+was we were what when which who will with you your
+""".split())
+
+TOKEN_PATTERN = re.compile(r"\w+")
+MAX_TOKEN_LENGTH = 40
+SNIPPET_LENGTH = 160
+
+# BM25 parameters.
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text: str) -> list:
+    """Split text into lower-cased index terms, leaving out stop words."""
+    return [t for t in TOKEN_PATTERN.findall(text.lower())
+            if t not in STOP_WORDS and len(t) <= MAX_TOKEN_LENGTH]
+
+
+class Postings:
+    """Document numbers containing a term, in ascending order, with the term's frequency in each."""
+    __slots__ = ('docs', 'freqs')
+
+    def __init__(self):
+        self.docs = array('l')
+        self.freqs = array('l')
+
+
+class SearchIndex:
+    """
+    Inverted index over the forum's text. Documents are numbered in the order
+    they are added, so every postings list stays sorted by only ever being
+    appended to, and an AND query walks the rarest term's list and looks the
+    other terms up by binary search.
+
+    A term found in most documents would make every query containing it
+    score most of the index, so only the newest ``max_candidates`` entries of
+    the rarest term's postings are considered: on a forum, recent matches are
+    the ones worth ranking, and latency stays flat as the index grows.
+
+    Write paths call ``add`` for what they create. ``refresh`` pulls anything
+    the index hasn't seen from ``storage`` (everything on first use, and
+    writes made by other worker processes afterwards), so it is called before
+    each search.
+    """
+
+    def __init__(self, storage, max_candidates: int = 5000, batch_size: int = 1000):
+        self.storage = storage
+        self.max_candidates = max_candidates
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._postings = {}
+        # Per document number: kind code, ID, post ID, length in terms, snippet.
+        self._kinds = array('b')
+        self._ids = array('l')
+        self._post_ids = array('l')
+        self._lengths = array('l')
+        self._snippets = []
+        self._indexed = set()
+        self._total_length = 0
+        # Highest ID of each kind pulled from storage by refresh().
+        self._synced = {kind: 0 for kind in KINDS}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, kind: str, doc_id: int, text: str, post_id: int = None, snippet: str = None) -> bool:
+        """Index a document; False if it was already indexed."""
+        terms = tokenize(text)
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        with self._lock:
+            key = (KIND_CODES[kind], doc_id)
+            if key in self._indexed:
+                return False
+            self._indexed.add(key)
+            doc = len(self._ids)
+            self._kinds.append(key[0])
+            self._ids.append(doc_id)
+            self._post_ids.append(post_id if post_id is not None else 0)
+            self._lengths.append(len(terms))
+            self._snippets.append((snippet if snippet is not None else text)[:SNIPPET_LENGTH])
+            self._total_length += len(terms)
+            for term, count in counts.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = Postings()
+                postings.docs.append(doc)
+                postings.freqs.append(count)
+        return True
+
+    def add_post(self, post: dict) -> bool:
+        return self.add('post', post['id'], post['title'] + "\n" + post['text'],
+                        post_id=post['id'], snippet=post['title'] or post['text'])
+
+    def add_comment(self, post_id: int, comment: dict) -> bool:
+        return self.add('comment', comment['id'], comment['text'], post_id=post_id)
+
+    def add_chat_message(self, message: dict) -> bool:
+        return self.add('chat', message['id'], message['message'],
+                        snippet=f"{message['username']}: {message['message']}")
+
+    def refresh(self) -> int:
+        """Index whatever storage holds beyond what was last pulled; returns the number added."""
+        added = 0
+        for kind in KINDS:
+            while True:
+                batch = self.storage.search_documents(kind, self._synced[kind], self.batch_size)
+                for doc in batch:
+                    if kind == 'post':
+                        added += self.add_post(doc)
+                    elif kind == 'comment':
+                        added += self.add_comment(doc['post_id'], doc)
+                    else:
+                        added += self.add_chat_message(doc)
+                if batch:
+                    self._synced[kind] = max(self._synced[kind], batch[-1]['id'])
+                if len(batch) < self.batch_size:
+                    break
+        return added
+
+    def search(self, query: str, kind: str = None, offset: int = 0, limit: int = 20) -> tuple:
+        """
+        Return (total, results) for the documents containing every term of
+        ``query``, best match first. ``total`` counts the matches among the
+        candidates that were scored. Each result is { kind, id, post_id,
+        snippet, score }, with ``post_id`` None for chat messages.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return 0, []
+        kind_code = KIND_CODES[kind] if kind else None
+        with self._lock:
+            lists = [self._postings.get(term) for term in terms]
+            if any(p is None for p in lists):
+                return 0, []
+            n = len(self._ids)
+            avg_length = self._total_length / n
+            lists.sort(key=lambda p: len(p.docs))
+            idfs = [math.log(1 + (n - len(p.docs) + 0.5) / (len(p.docs) + 0.5)) for p in lists]
+            rarest, others = lists[0], lists[1:]
+            lengths, kinds = self._lengths, self._kinds
+            start = max(0, len(rarest.docs) - self.max_candidates)
+            docs, freqs = rarest.docs[start:], rarest.freqs[start:]
+            # BM25 length normalisation is norm_base + norm_scale * length.
+            norm_base, norm_scale = K1 * (1 - B), K1 * B / avg_length
+            idf = idfs[0]
+
+            if not others:
+                scored = [(idf * f * (K1 + 1) / (f + norm_base + norm_scale * lengths[doc]), doc)
+                          for doc, f in zip(docs, freqs)
+                          if kind_code is None or kinds[doc] == kind_code]
+            else:
+                scored = []
+                # Candidates come in ascending order, so each binary search
+                # can start where the previous one ended.
+                positions = [0] * len(others)
+                for doc, f in zip(docs, freqs):
+                    if kind_code is not None and kinds[doc] != kind_code:
+                        continue
+                    norm = norm_base + norm_scale * lengths[doc]
+                    score = idf * f * (K1 + 1) / (f + norm)
+                    for i, postings in enumerate(others):
+                        j = bisect_left(postings.docs, doc, positions[i])
+                        positions[i] = j
+                        if j == len(postings.docs) or postings.docs[j] != doc:
+                            break
+                        other = postings.freqs[j]
+                        score += idfs[i + 1] * other * (K1 + 1) / (other + norm)
+                    else:
+                        scored.append((score, doc))
+            top = heapq.nlargest(offset + limit, scored)[offset:]
+            results = [{
+                'kind': KINDS[kinds[doc]],
+                'id': self._ids[doc],
+                'post_id': self._post_ids[doc] if kinds[doc] != KIND_CODES['chat'] else None,
+                'snippet': self._snippets[doc],
+                'score': round(score, 4)
+            } for score, doc in top]
+        return len(scored), results
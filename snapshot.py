@@ -0,0 +1,221 @@
+"""
+Snapshots of MemoryStorage, so an in-memory forum survives restarts.
+
+A snapshot is one binary file: a fixed header, a table of sections and the
+sections themselves, each a marshal dump of flat tuples (posts, comments,
+users, votes, ...). Writing goes to a temporary file that is renamed over
+the old snapshot, so a crash never leaves a half-written one behind.
+Loading maps the file into memory and decodes the sections in place, then
+the store rebuilds its indexes in bulk.
+
+marshal is Python's fastest serialiser but its format may change between
+Python versions, so the marshal version is recorded and a snapshot written
+by another version is refused.
+
+    python snapshot.py info forum.snap [--load]
+    python snapshot.py take <server pid> forum.snap
+"""
+import os
+import sys
+import mmap
+import time
+import signal
+import struct
+import marshal
+import logging
+import argparse
+import threading
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"FORUMSNP"
+FORMAT_VERSION = 2
+# magic, format version, marshal version, created at, number of sections
+HEADER = struct.Struct("<8sHHdI")
+# section name, offset, length
+SECTION = struct.Struct("<16sQQ")
+# Sections holding the lists of MemoryStorage.export_state(); its scalars and
+# the item counts shown by ``info`` go in the "meta" section.
+LIST_SECTIONS = ('posts', 'comments', 'users', 'votes', 'media', 'saved', 'chat')
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def write_snapshot(storage, path: str) -> int:
+    """Write the storage's state to ``path`` atomically; returns the file size."""
+    state = storage.export_state()
+    meta = {name: value for name, value in state.items() if name not in LIST_SECTIONS}
+    meta['counts'] = {name: len(state[name]) for name in LIST_SECTIONS}
+    payloads = [('meta', marshal.dumps(meta))] + [(name, marshal.dumps(state[name])) for name in LIST_SECTIONS]
+
+    offset = HEADER.size + SECTION.size * len(payloads)
+    table = []
+    for name, payload in payloads:
+        table.append(SECTION.pack(name.encode(), offset, len(payload)))
+        offset += len(payload)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, marshal.version, time.time(), len(payloads)))
+        f.writelines(table)
+        f.writelines(payload for _, payload in payloads)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return offset
+
+
+def _read_table(data) -> tuple:
+    if len(data) < HEADER.size:
+        raise SnapshotError("Truncated snapshot")
+    magic, version, marshal_version, created_at, count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise SnapshotError("Not a forum snapshot")
+    if version != FORMAT_VERSION:
+        raise SnapshotError(f"Unsupported snapshot format {version}")
+    if marshal_version != marshal.version:
+        raise SnapshotError(f"Snapshot written with marshal version {marshal_version}, "
+                            f"this Python uses {marshal.version}")
+    sections = {}
+    for i in range(count):
+        name, offset, length = SECTION.unpack_from(data, HEADER.size + i * SECTION.size)
+        if offset + length > len(data):
+            raise SnapshotError("Truncated snapshot")
+        sections[name.rstrip(b"\0").decode()] = (offset, length)
+    return created_at, sections
+
+
+def read_snapshot(path: str, sections=None) -> tuple:
+    """
+    Return (created_at, {section: (offset, length)}, {section: value}),
+    decoding only the named ``sections`` (all of them when None).
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise SnapshotError("Empty snapshot")
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    with data:
+        created_at, table = _read_table(data)
+        values = {}
+        with memoryview(data) as view:
+            for name, (offset, length) in table.items():
+                if sections is None or name in sections:
+                    values[name] = marshal.loads(view[offset:offset + length])
+    return created_at, table, values
+
+
+def load_snapshot(storage, path: str) -> dict:
+    """Replace the storage's contents with the snapshot at ``path``; returns its meta section."""
+    _, table, values = read_snapshot(path)
+    missing = {'meta', *LIST_SECTIONS} - table.keys()
+    if missing:
+        raise SnapshotError(f"Snapshot is missing sections: {', '.join(sorted(missing))}")
+    meta = values.pop('meta')
+    state = dict(values)
+    state.update((name, value) for name, value in meta.items() if name != 'counts')
+    storage.load_state(state)
+    return meta
+
+
+class Snapshotter:
+    """
+    Snapshots the storage every ``interval`` seconds from a background
+    thread, when request() is called (the app wires it to SIGUSR1) and on
+    close(). ``before`` is called first, e.g. to flush buffered votes.
+    """
+
+    def __init__(self, storage, path: str, interval: float = 300.0, before=None):
+        self.storage = storage
+        self.path = path
+        self.interval = interval
+        self.before = before
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="snapshotter", daemon=True)
+            self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.take()
+
+    def request(self) -> None:
+        """Take a snapshot soon, from the background thread. Safe to call from a signal handler."""
+        self._wake.set()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.interval)
+            if self._stop.is_set():
+                break
+            self._wake.clear()
+            self.take()
+
+    def take(self) -> None:
+        with self._lock:
+            try:
+                if self.before is not None:
+                    self.before()
+                started = time.perf_counter()
+                size = write_snapshot(self.storage, self.path)
+                logger.info("Wrote snapshot %s (%d bytes) in %.2fs", self.path, size, time.perf_counter() - started)
+            except Exception as e:
+                logger.error("Error writing snapshot %s: %s", self.path, e)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Inspect forum snapshots, or ask a running server for one.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    info = commands.add_parser("info", help="print what a snapshot holds")
+    info.add_argument("path")
+    info.add_argument("--load", action="store_true", help="also time loading it into a MemoryStorage")
+    take = commands.add_parser("take", help="signal a server (SIGUSR1) to write its snapshot now, and wait")
+    take.add_argument("pid", type=int)
+    take.add_argument("path", help="the server's SNAPSHOT_PATH")
+    take.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    if args.command == "take":
+        before = os.stat(args.path).st_mtime_ns if os.path.exists(args.path) else None
+        os.kill(args.pid, signal.SIGUSR1)
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline:
+            if os.path.exists(args.path) and os.stat(args.path).st_mtime_ns != before:
+                print(f"Snapshot written to {args.path}")
+                return 0
+            time.sleep(0.1)
+        print("Timed out waiting for the snapshot", file=sys.stderr)
+        return 1
+
+    try:
+        created_at, table, values = read_snapshot(args.path, sections={'meta'})
+    except (OSError, SnapshotError) as e:
+        print(f"Cannot read {args.path}: {e}", file=sys.stderr)
+        return 1
+    meta = values['meta']
+    print(f"{args.path}: format {FORMAT_VERSION}, written {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created_at))}")
+    for name, (offset, length) in table.items():
+        count = meta['counts'].get(name)
+        print(f"  {name:<10} {length:>12} bytes" + (f" {count:>10} items" if count is not None else ""))
+    print(f"  next IDs: post {meta['last_post_id'] + 1}, comment {meta['comment_id_counter']}, "
+          f"chat {meta['last_chat_id'] + 1}")
+    if args.load:
+        from storage import MemoryStorage
+        started = time.perf_counter()
+        load_snapshot(MemoryStorage(), args.path)
+        print(f"loaded in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,239 @@
+// Behaviour of the forum page. The page defines feedSort, feedWindow and
+// lastChatId before loading this script.
+function appendChatMessage(msg) {
+    if (msg.id <= lastChatId) {
+        return;
+    }
+    let newMsg = document.createElement('div');
+    newMsg.className = 'chat-message';
+    newMsg.innerHTML = '<strong>' + msg.username + ':</strong> ' + msg.message;
+    document.getElementById('chat-messages').appendChild(newMsg);
+    lastChatId = msg.id;
+}
+function refreshChat() {
+    fetch('/chat?after=' + lastChatId)
+    .then(response => response.json())
+    .then(data => { data.forEach(appendChatMessage); })
+    .catch(err => console.error(err));
+}
+// Polling runs fast while the event stream is down. It keeps running slowly
+// while the stream is up, because with several workers the stream only
+// carries messages posted to the worker that serves it.
+const CHAT_POLL_FAST = 5000;
+const CHAT_POLL_SLOW = 30000;
+let chatPoll = null;
+let chatPollInterval = null;
+function startChatPolling(interval) {
+    if (chatPoll && chatPollInterval === interval) {
+        return;
+    }
+    clearInterval(chatPoll);
+    chatPoll = setInterval(refreshChat, interval);
+    chatPollInterval = interval;
+}
+function setScore(id, score) {
+    const elem = document.getElementById(id);
+    if (elem) {
+        elem.textContent = score;
+    }
+}
+// Live updates pushed by the server.
+let openPostId = null;
+if (window.EventSource) {
+    const events = new EventSource('/events');
+    events.onopen = function() {
+        startChatPolling(CHAT_POLL_SLOW);
+        refreshChat();
+    };
+    events.onerror = () => startChatPolling(CHAT_POLL_FAST);
+    events.addEventListener('chat', e => appendChatMessage(JSON.parse(e.data)));
+    events.addEventListener('post_score', e => {
+        const data = JSON.parse(e.data);
+        setScore('post-score-' + data.post_id, data.score);
+    });
+    events.addEventListener('comment_score', e => {
+        const data = JSON.parse(e.data);
+        setScore('comment-score-' + data.comment_id, data.score);
+    });
+    events.addEventListener('post', e => {
+        const data = JSON.parse(e.data);
+        // Only the "new" feed shows fresh posts at the top.
+        if (feedSort !== 'new' || document.getElementById('post-score-' + data.id)) {
+            return;
+        }
+        fetch('/forum/page?limit=1&before=' + (data.id + 1))
+        .then(response => response.text())
+        .then(html => {
+            document.getElementById('post-list').insertAdjacentHTML('afterbegin', html);
+        })
+        .catch(err => console.error(err));
+    });
+    events.addEventListener('comment', e => {
+        const data = JSON.parse(e.data);
+        // Reload an open overlay unless the user is typing in it.
+        const overlay = document.getElementById('overlay-content');
+        if (openPostId === data.post_id && !overlay.contains(document.activeElement)) {
+            showPostOverlay(data.post_id);
+        }
+    });
+} else {
+    startChatPolling(CHAT_POLL_FAST);
+}
+function sendChatMessage(event) {
+    event.preventDefault();
+    const username = document.getElementById('chat-username').value;
+    const message = document.getElementById('chat-input').value;
+    fetch('/chat', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({username: username, message: message})
+    })
+    .then(response => response.json())
+    .then(data => {
+        refreshChat();
+        document.getElementById('chat-input').value = '';
+    })
+    .catch(err => console.error(err));
+}
+// Load the next page of posts below the current ones.
+function loadMorePosts(btn) {
+    const params = new URLSearchParams({sort: feedSort, window: feedWindow, before: btn.dataset.cursor});
+    fetch('/forum/page?' + params)
+    .then(response => {
+        const next = response.headers.get('X-Next-Cursor');
+        return response.text().then(html => {
+            document.getElementById('post-list').insertAdjacentHTML('beforeend', html);
+            if (next) {
+                btn.dataset.cursor = next;
+            } else {
+                btn.remove();
+            }
+        });
+    })
+    .catch(err => console.error(err));
+}
+// Toggle star (save post)
+function toggleStar(postId, elem) {
+    fetch('/star/' + postId, { method: 'POST' })
+    .then(response => response.json())
+    .then(data => {
+        if (data.saved) {
+            elem.classList.remove('star-unsaved');
+            elem.classList.add('star-saved');
+        } else {
+            elem.classList.remove('star-saved');
+            elem.classList.add('star-unsaved');
+        }
+        alert(data.message || data.error);
+    })
+    .catch(err => console.error(err));
+}
+// Vote on a post.
+function votePost(postId, action, event) {
+    event.stopPropagation();
+    fetch('/vote/post/' + postId, {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({action: action})
+    })
+    .then(response => response.json())
+    .then(data => {
+        document.getElementById('post-score-' + postId).textContent = data.score;
+    })
+    .catch(err => console.error(err));
+}
+// Vote on a comment (or reply).
+function voteComment(postId, commentId, action, btn) {
+    fetch('/vote/comment/' + postId + '/' + commentId, {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({action: action})
+    })
+    .then(response => response.json())
+    .then(data => {
+        document.getElementById('comment-score-' + commentId).textContent = data.score;
+    })
+    .catch(err => console.error(err));
+}
+// Toggle reply form visibility.
+function toggleReplyForm(commentId) {
+    var form = document.getElementById('reply-form-' + commentId);
+    form.style.display = (form.style.display === 'none' || form.style.display === '') ? 'block' : 'none';
+}
+// Show post overlay by fetching its details.
+function showPostOverlay(postId) {
+    fetch('/post_overlay/' + postId)
+    .then(response => response.text())
+    .then(html => {
+        document.getElementById('overlay-content').innerHTML = html;
+        document.getElementById('post-overlay').style.display = 'block';
+        openPostId = postId;
+    })
+    .catch(err => console.error(err));
+}
+// Close the overlay.
+function closeOverlay() {
+    document.getElementById('post-overlay').style.display = 'none';
+    openPostId = null;
+    if (location.hash) {
+        history.replaceState(null, '', location.pathname + location.search);
+    }
+}
+// Open the post named by a #post-<id> fragment, as linked from search results.
+function openLinkedPost() {
+    const match = /^#post-(\d+)$/.exec(location.hash);
+    if (match) {
+        showPostOverlay(Number(match[1]));
+    }
+}
+window.addEventListener('hashchange', openLinkedPost);
+// Append the next page of comments or replies before the button.
+function loadMoreComments(btn) {
+    const params = new URLSearchParams({before: btn.dataset.cursor});
+    if (btn.dataset.parent) {
+        params.set('parent', btn.dataset.parent);
+    }
+    fetch('/post/' + btn.dataset.post + '/comments?' + params)
+    .then(response => {
+        const next = response.headers.get('X-Next-Cursor');
+        return response.text().then(html => {
+            btn.insertAdjacentHTML('beforebegin', html);
+            if (next) {
+                btn.dataset.cursor = next;
+                btn.textContent = btn.dataset.parent ? 'Load more replies' : 'Load more comments';
+            } else {
+                btn.remove();
+            }
+        });
+    })
+    .catch(err => console.error(err));
+}
+// Submit comment via AJAX.
+function submitComment(event, postId) {
+    event.preventDefault();
+    const form = event.target;
+    const formData = new FormData(form);
+    fetch('/comment/' + postId, {
+        method: 'POST',
+        headers: { 'X-Requested-With': 'XMLHttpRequest' },
+        body: formData
+    })
+    .then(response => response.json())
+    .then(data => { showPostOverlay(postId); })
+    .catch(err => console.error(err));
+}
+// Submit reply via AJAX.
+function submitReply(event, postId, commentId) {
+    event.preventDefault();
+    const form = event.target;
+    const formData = new FormData(form);
+    fetch('/reply/' + postId + '/' + commentId, {
+        method: 'POST',
+        headers: { 'X-Requested-With': 'XMLHttpRequest' },
+        body: formData
+    })
+    .then(response => response.json())
+    .then(data => { showPostOverlay(postId); })
+    .catch(err => console.error(err));
+}
+openLinkedPost();
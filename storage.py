@@ -0,0 +1,1654 @@
+"""
+Storage backends for the forum: posts with their comment trees, votes,
+users and chat.
+
+``MemoryStorage`` keeps everything in process and is what tests use;
+``SQLiteStorage`` persists to a database file in WAL mode so state survives
+restarts and can be shared between processes. Pick one with ``open_storage``.
+"""
+import gc
+import os
+import sys
+import json
+import math
+import time
+import logging
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from bisect import bisect_left, bisect_right, insort
+from heapq import heapify, heappop, heappush
+from collections import deque
+from itertools import islice
+from werkzeug.security import check_password_hash, generate_password_hash
+
+logger = logging.getLogger(__name__)
+
+# Dummy accounts created in an empty store.
+DEFAULT_USERS = {
+    "admin": "adminpass",
+    "user": "userpass"
+}
+
+
+# Feed orderings accepted by page_posts(), and the windows "top" can be limited to.
+FEED_SORTS = ('new', 'hot', 'top')
+TOP_WINDOWS = {'day': 24 * 3600, 'week': 7 * 24 * 3600, 'month': 30 * 24 * 3600, 'all': None}
+# The windows of TOP_WINDOWS that drop posts as they age.
+TIMED_WINDOWS = {window: seconds for window, seconds in TOP_WINDOWS.items() if seconds is not None}
+# Age that costs a post as much "hot" rank as a tenfold drop in score.
+HOT_DECAY_SECONDS = 45000
+
+
+def hot_rank(upvotes: int, downvotes: int, created_at: float) -> float:
+    """
+    Sort key of the "hot" feed: the order of magnitude of the score plus the
+    creation time, so newer posts need fewer votes to rank as high. Decay is
+    relative between posts, so the key only changes when the post is voted on.
+    """
+    score = upvotes - downvotes
+    sign = (score > 0) - (score < 0)
+    return sign * math.log10(max(abs(score), 1)) + created_at / HOT_DECAY_SECONDS
+
+
+class Record:
+    """
+    Base of the stored records. Their fields live in ``__slots__`` rather
+    than a per-instance dict, which makes a comment less than half the size
+    of the dict it replaced. They can still be read and updated like those
+    dicts (``post['id']``, ``comment.get('replies')``, ``dict(post)``), by
+    attribute in templates, and jsonify() serialises them as dataclasses.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: str, value) -> None:
+        setattr(self, key, value)
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default)
+
+    def keys(self) -> tuple:
+        return self.__slots__
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+# Shared by every post without comments and every comment without replies;
+# replaced by a list when the first one is added.
+NO_CHILDREN = ()
+
+
+@dataclass(slots=True)
+class Comment(Record):
+    id: int
+    text: str
+    replies: list = NO_CHILDREN
+    upvotes: int = 0
+    downvotes: int = 0
+
+    def add_reply(self, reply: 'Comment') -> None:
+        if self.replies:
+            self.replies.append(reply)
+        else:
+            self.replies = [reply]
+
+
+@dataclass(slots=True)
+class Post(Record):
+    id: int
+    title: str
+    text: str
+    filename: str = None
+    filetype: str = None
+    comments: list = NO_CHILDREN
+    upvotes: int = 0
+    downvotes: int = 0
+    version: int = 0
+    created_at: float = 0.0
+
+    def add_comment(self, comment: Comment) -> None:
+        if self.comments:
+            self.comments.append(comment)
+        else:
+            self.comments = [comment]
+
+
+@dataclass(slots=True)
+class ChatMessage(Record):
+    id: int
+    username: str
+    message: str
+    timestamp: float
+
+
+def new_post(post_id: int, title: str, text: str, filename: str, filetype: str) -> Post:
+    # File types come from a handful of names; share one string object each.
+    return Post(post_id, title, text, filename, sys.intern(filetype) if filetype else None,
+                created_at=time.time())
+
+
+def new_comment(comment_id: int, text: str) -> Comment:
+    return Comment(comment_id, text)
+
+
+def attach_replies(comments: list, children, replies: int, depth: int) -> None:
+    """
+    Give each comment its ``replies`` best replies, ``depth`` levels down,
+    where ``children(comment_id, limit)`` returns (replies, next cursor).
+    ``more_replies`` is set to the cursor after the last reply shown, or None
+    when no more were fetched.
+    """
+    level = comments
+    for _ in range(depth):
+        below = []
+        for comment in level:
+            if comment['reply_count']:
+                comment['replies'], comment['more_replies'] = children(comment['id'], replies)
+                below.extend(comment['replies'])
+        level = below
+
+
+def vote_delta(action: str) -> tuple:
+    """Return the (upvotes, downvotes) increment for a vote action."""
+    if action == "up":
+        return 1, 0
+    if action == "down":
+        return 0, 1
+    return 0, 0
+
+
+def vote_change(old: str, new: str) -> tuple:
+    """Return the (upvotes, downvotes) change when a voter's vote goes from ``old`` to ``new``."""
+    old_up, old_down = vote_delta(old)
+    new_up, new_down = vote_delta(new)
+    return new_up - old_up, new_down - old_down
+
+
+class Storage:
+    """
+    Interface shared by the storage backends.
+
+    Posts are Post records { id, title, text, filename, filetype, comments,
+    upvotes, downvotes, version, created_at }, where ``version`` is bumped
+    whenever anything rendered from the post changes. Comments and replies
+    are Comment records { id, text, replies, upvotes, downvotes }. Chat
+    messages are ChatMessage records { id, username, message, timestamp }.
+    Records read like dicts, see Record.
+
+    comment_page() returns comments as { id, text, replies, upvotes,
+    downvotes, reply_count, more_replies }, where ``replies`` only holds the
+    replies that were fetched and ``reply_count`` counts all direct replies.
+    """
+
+    # Identifies what change_version() counts from. Stores whose versions can
+    # start over with different contents (a new database, a restarted
+    # process) set their own, so the same number never names two states.
+    epoch = ""
+
+    def check_user(self, username: str, password: str) -> bool:
+        raise NotImplementedError
+
+    def create_user(self, username: str, password: str) -> bool:
+        """Create an account; False if the username is already taken."""
+        raise NotImplementedError
+
+    def create_post(self, title: str, text: str, filename: str = None, filetype: str = None,
+                    sha256: str = None, size: int = None) -> Post:
+        """
+        Create a post. When it carries an upload, ``sha256`` and ``size``
+        describe the stored file and the post's reference to it is recorded
+        along with the post.
+        """
+        raise NotImplementedError
+
+    def get_post(self, post_id: int) -> Post:
+        """Return the post with its full comment tree, or None."""
+        raise NotImplementedError
+
+    def get_posts(self, post_ids) -> list:
+        """Return the existing posts among ``post_ids`` in ID order, without comments."""
+        raise NotImplementedError
+
+    def page_posts(self, before=None, limit: int = 20, sort: str = "new", window: str = "all") -> tuple:
+        """
+        Return up to ``limit`` posts of the feed ordered by ``sort``, starting
+        after the ``before`` cursor, together with the cursor for the
+        following page (or None).
+
+        "new" is newest first and its cursor is a post ID. "hot" orders by
+        hot_rank() and "top" by score, only counting posts created within
+        ``window`` (a TOP_WINDOWS name); their cursors are (sort key, post ID)
+        pairs.
+        """
+        raise NotImplementedError
+
+    def touch_post(self, post_id: int) -> None:
+        """Bump the post's version so markup rendered from it is refreshed."""
+        raise NotImplementedError
+
+    def add_comment(self, post_id: int, text: str, parent_id: int = None) -> Comment:
+        """
+        Add a comment to a post, or a reply to the comment ``parent_id`` of
+        that post. Returns None if the post or parent comment doesn't exist.
+        """
+        raise NotImplementedError
+
+    def comment_page(self, post_id: int, parent_id: int = None, before: tuple = None, limit: int = 20,
+                     replies: int = 3, depth: int = 2) -> tuple:
+        """
+        Return a bounded slice of a post's comment thread: up to ``limit`` of
+        the top-level comments (or of the replies to ``parent_id``) ranked
+        after the ``before`` cursor, best score first, each with its
+        ``replies`` best replies nested ``depth`` levels down. Returns
+        (comments, next cursor), or None if the post or parent doesn't exist.
+        Cursors are (score, comment ID) pairs.
+        """
+        raise NotImplementedError
+
+    def score(self, kind: str, post_id: int, target_id: int) -> int:
+        """Return the score of a post (kind "post") or comment (kind "comment"), or None."""
+        raise NotImplementedError
+
+    def get_vote(self, voter: str, kind: str, target_id: int) -> str:
+        """Return the voter's current "up"/"down" vote on a target, or None."""
+        raise NotImplementedError
+
+    def record_votes(self, votes: list) -> None:
+        """
+        Apply a batch of (voter, kind, post_id, target_id, action) votes.
+        A voter has at most one vote per target: a new vote replaces the old
+        one and repeating the same vote changes nothing.
+        """
+        raise NotImplementedError
+
+    def media_refs(self, filename: str) -> int:
+        """
+        Return how many posts use the uploaded file ``filename``. Uploads are
+        content-addressed, so reposting the same bytes shares one stored file.
+        """
+        raise NotImplementedError
+
+    def toggle_saved(self, owner: str, post_id: int) -> bool:
+        """
+        Save the post for ``owner``, or unsave it if it already was. Owners
+        are identified like voters ("user:<name>" or "session:<id>").
+        Returns whether the post is now saved, or None if it doesn't exist.
+        """
+        raise NotImplementedError
+
+    def add_saved(self, owner: str, post_ids) -> None:
+        """Save every existing post among ``post_ids`` for ``owner``."""
+        raise NotImplementedError
+
+    def transfer_owner(self, old: str, new: str) -> None:
+        """
+        Hand ``old``'s saved posts and votes over to ``new``, as when a
+        visitor logs in. Where both voted on the same target, ``new``'s vote
+        stands and ``old``'s is taken off the score.
+        """
+        raise NotImplementedError
+
+    def saved_among(self, owner: str, post_ids) -> set:
+        """Return which of ``post_ids`` the owner has saved."""
+        raise NotImplementedError
+
+    def saved_page(self, owner: str, before: int = None, limit: int = 20) -> tuple:
+        """
+        Return up to ``limit`` of the owner's saved posts with an ID below
+        ``before``, newest first, and the cursor for the next page (or None).
+        """
+        raise NotImplementedError
+
+    def add_chat_message(self, username: str, message: str) -> ChatMessage:
+        raise NotImplementedError
+
+    def recent_chat(self) -> list:
+        """Return the most recent chat messages, oldest first."""
+        raise NotImplementedError
+
+    def chat_since(self, after: int) -> list:
+        """Return the recent chat messages with an ID greater than ``after``."""
+        raise NotImplementedError
+
+    def last_chat_id(self) -> int:
+        raise NotImplementedError
+
+    def change_version(self) -> int:
+        """
+        Return a number that changes with every write to posts, comments,
+        votes, saved posts or chat, so a page built from them can be tagged
+        with it and a client revalidating an unchanged page answered cheaply.
+        """
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        """Return the number of posts, comments and chat messages stored."""
+        raise NotImplementedError
+
+    def search_documents(self, kind: str, after: int, limit: int) -> list:
+        """
+        Return up to ``limit`` items of ``kind`` ("post", "comment" or "chat")
+        with an ID greater than ``after``, in ID order, for the search index.
+        Posts come without comments and comments as { id, post_id, text }.
+        """
+        raise NotImplementedError
+
+
+# ------------------ In-Memory Backend ------------------
+class RankIndex:
+    """
+    IDs ordered by a sort key, highest first (newest first among equal
+    keys), kept sorted as keys change so a page of a ranked listing costs a
+    binary search plus the page itself. Used for the ranked feeds and for the
+    replies of each comment.
+    With ``window`` set, only items created within the last ``window``
+    seconds are included; older ones are dropped when the index is paged.
+    """
+
+    # There is one index per comment with replies, so keep instances small.
+    __slots__ = ('window', '_entries', '_keys', '_created')
+
+    def __init__(self, window: float = None):
+        self.window = window
+        # (-key, -ID) in ascending order, i.e. best first.
+        self._entries = []
+        self._keys = {}
+        # (created_at, ID) heap of the items in a windowed index.
+        self._created = [] if window is not None else None
+
+    def __contains__(self, item_id: int) -> bool:
+        return item_id in self._keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, item_id: int, key, created_at: float = None) -> None:
+        if self.window is not None:
+            if created_at < time.time() - self.window:
+                return
+            heappush(self._created, (created_at, item_id))
+        self._set(item_id, key)
+
+    def update(self, item_id: int, key) -> None:
+        """Change the key of an item already in the index."""
+        if item_id in self._keys:
+            self._set(item_id, key)
+
+    def _set(self, item_id: int, key) -> None:
+        old = self._keys.get(item_id)
+        if old is not None:
+            if old == key:
+                return
+            del self._entries[bisect_left(self._entries, (-old, -item_id))]
+        self._keys[item_id] = key
+        insort(self._entries, (-key, -item_id))
+
+    def _expire(self) -> None:
+        cutoff = time.time() - self.window
+        while self._created and self._created[0][0] < cutoff:
+            item_id = heappop(self._created)[1]
+            key = self._keys.pop(item_id, None)
+            if key is not None:
+                del self._entries[bisect_left(self._entries, (-key, -item_id))]
+
+    def load(self, keys: dict, created: dict = None) -> None:
+        """
+        Fill an empty index from {ID: key} with one sort, instead of an
+        insertion per item. A windowed index also needs {ID: created_at}.
+        """
+        if self.window is not None:
+            cutoff = time.time() - self.window
+            keys = {item_id: key for item_id, key in keys.items() if created[item_id] >= cutoff}
+            self._created = [(created[item_id], item_id) for item_id in keys]
+            heapify(self._created)
+        self._keys = keys
+        self._entries = sorted([(-key, -item_id) for item_id, key in keys.items()])
+
+    def page(self, before: tuple = None, limit: int = 20) -> tuple:
+        """Return up to ``limit`` (key, ID) pairs ranked after ``before``, and the next cursor."""
+        if self.window is not None:
+            self._expire()
+        start = 0 if before is None else bisect_right(self._entries, (-before[0], -before[1]))
+        chunk = self._entries[start:start + limit + 1]
+        page = [(-key, -item_id) for key, item_id in chunk[:limit]]
+        next_cursor = page[-1] if len(chunk) > limit else None
+        return page, next_cursor
+
+
+def rank_keys(post: Post) -> dict:
+    """Sort keys of a post for each ranked feed."""
+    return {
+        'hot': hot_rank(post['upvotes'], post['downvotes'], post['created_at']),
+        'top': post['upvotes'] - post['downvotes']
+    }
+
+
+class PostStore:
+    """In-memory posts keyed by ID, iterated in insertion order.
+
+    Comments and replies at any depth are also indexed by their global ID so
+    lookups never have to walk the comment tree.
+    """
+
+    def __init__(self):
+        self._posts = {}
+        self._last_id = 0
+        # Post IDs in ascending order, for cursor-based paging.
+        self._ids = []
+        # comment ID -> (post ID, comment, parent comment or None)
+        self._comments = {}
+        self._last_comment_id = 0
+        # (post ID, parent comment ID or None) -> RankIndex of the replies by
+        # score, built by _thread() the first time the thread is paged
+        self._threads = {}
+        # Ranked feeds: "hot", and "top" for each window.
+        self._rankings = {('hot', None): RankIndex()}
+        for window, seconds in TOP_WINDOWS.items():
+            self._rankings[('top', window)] = RankIndex(window=seconds)
+
+    def __iter__(self):
+        return iter(self._posts.values())
+
+    def __len__(self) -> int:
+        return len(self._posts)
+
+    @property
+    def comment_count(self) -> int:
+        return len(self._comments)
+
+    @property
+    def last_id(self) -> int:
+        return self._last_id
+
+    def next_id(self) -> int:
+        self._last_id += 1
+        return self._last_id
+
+    def add(self, post: Post) -> Post:
+        if post['id'] not in self._posts:
+            if not self._ids or post['id'] > self._ids[-1]:
+                self._ids.append(post['id'])
+            else:
+                insort(self._ids, post['id'])
+            keys = rank_keys(post)
+            for (sort, _), ranking in self._rankings.items():
+                ranking.add(post['id'], keys[sort], post['created_at'])
+        self._posts[post['id']] = post
+        self._last_id = max(self._last_id, post['id'])
+        # Index any comments the post already carries, without recursion.
+        stack = [(c, None) for c in post.get('comments', [])]
+        while stack:
+            comment, parent = stack.pop()
+            self._index_comment(post['id'], comment, parent)
+            stack.extend((r, comment) for r in comment.get('replies', []))
+        return post
+
+    def get(self, post_id: int) -> Post:
+        return self._posts.get(post_id)
+
+    def page(self, before: int = None, limit: int = 20) -> tuple:
+        end = len(self._ids) if before is None else bisect_left(self._ids, before)
+        start = max(0, end - limit)
+        page = [self._posts[pid] for pid in reversed(self._ids[start:end])]
+        next_cursor = self._ids[start] if start > 0 else None
+        return page, next_cursor
+
+    def ranked_page(self, sort: str, window: str = None, before: tuple = None, limit: int = 20) -> tuple:
+        ranking = self._rankings[(sort, window if sort == 'top' else None)]
+        entries, next_cursor = ranking.page(before, limit)
+        return [self._posts[pid] for _, pid in entries], next_cursor
+
+    def rerank(self, post: Post) -> None:
+        """Update the post's place in the ranked feeds after its votes changed."""
+        keys = rank_keys(post)
+        for (sort, _), ranking in self._rankings.items():
+            ranking.update(post['id'], keys[sort])
+
+    def add_comment(self, post: Post, comment: Comment, parent: Comment = None) -> Comment:
+        """Attach a comment to a post, or as a reply to ``parent``."""
+        if parent is None:
+            post.add_comment(comment)
+        else:
+            parent.add_reply(comment)
+        self._index_comment(post['id'], comment, parent)
+        return comment
+
+    def _index_comment(self, post_id: int, comment: Comment, parent: Comment = None) -> None:
+        self._comments[comment['id']] = (post_id, comment, parent)
+        self._last_comment_id = max(self._last_comment_id, comment['id'])
+        thread = self._threads.get((post_id, parent['id'] if parent else None))
+        if thread is not None:
+            thread.add(comment['id'], comment['upvotes'] - comment['downvotes'])
+
+    def rerank_comment(self, post_id: int, comment: Comment) -> None:
+        """Update the comment's place among its siblings after its votes changed."""
+        parent = self.comment_parent(comment['id'])
+        thread = self._threads.get((post_id, parent['id'] if parent else None))
+        if thread is not None:
+            thread.update(comment['id'], comment['upvotes'] - comment['downvotes'])
+
+    def children(self, post_id: int, parent_id: int = None, before: tuple = None, limit: int = 20) -> tuple:
+        """
+        Return up to ``limit`` top-level comments or replies to ``parent_id``,
+        best first, as copies without their replies, and the next cursor.
+        """
+        thread = self._thread(post_id, parent_id)
+        if thread is None:
+            return [], None
+        entries, next_cursor = thread.page(before, limit)
+        page = []
+        for _, cid in entries:
+            comment = self._comments[cid][1]
+            page.append({
+                'id': comment['id'],
+                'text': comment['text'],
+                'replies': [],
+                'upvotes': comment['upvotes'],
+                'downvotes': comment['downvotes'],
+                'reply_count': len(comment.get('replies', [])),
+                'more_replies': None
+            })
+        return page, next_cursor
+
+    def since(self, after: int, limit: int) -> list:
+        """Return up to ``limit`` posts with an ID greater than ``after``, oldest first."""
+        start = bisect_left(self._ids, after + 1)
+        return [self._posts[pid] for pid in self._ids[start:start + limit]]
+
+    def comments_since(self, after: int, limit: int) -> list:
+        """Return up to ``limit`` (post ID, comment) pairs with a comment ID greater than ``after``."""
+        found = []
+        cid = after
+        while len(found) < limit and cid < self._last_comment_id:
+            cid += 1
+            entry = self._comments.get(cid)
+            if entry is not None:
+                found.append(entry[:2])
+        return found
+
+    def find_comment(self, post_id: int, comment_id: int) -> Comment:
+        """Return the comment with the given ID if it belongs to the post."""
+        entry = self._comments.get(comment_id)
+        if entry is None or entry[0] != post_id:
+            return None
+        return entry[1]
+
+    def comment_parent(self, comment_id: int) -> Comment:
+        entry = self._comments.get(comment_id)
+        return entry[2] if entry else None
+
+    def comment_post_id(self, comment_id: int) -> int:
+        entry = self._comments.get(comment_id)
+        return entry[0] if entry else None
+
+    def export(self) -> tuple:
+        """
+        Return the posts and comments as flat rows: (id, title, text,
+        filename, filetype, upvotes, downvotes, version, created_at) and
+        (id, post ID, parent ID or None, text, upvotes, downvotes), in ID order.
+        """
+        posts = [(p.id, p.title, p.text, p.filename, p.filetype, p.upvotes, p.downvotes, p.version, p.created_at)
+                 for p in (self._posts[pid] for pid in self._ids)]
+        comments = [(c.id, post_id, parent.id if parent is not None else None, c.text, c.upvotes, c.downvotes)
+                    for post_id, c, parent in (self._comments[cid] for cid in sorted(self._comments))]
+        return posts, comments
+
+    def load(self, posts, comments, last_id: int = 0) -> None:
+        """
+        Fill an empty store from the rows returned by export(), building
+        the feed rankings in bulk; comment threads are ranked when first
+        paged. New posts get IDs after ``last_id``.
+        """
+        for pid, title, text, filename, filetype, upvotes, downvotes, version, created_at in posts:
+            self._posts[pid] = Post(pid, title, text, filename, sys.intern(filetype) if filetype else None,
+                                    upvotes=upvotes, downvotes=downvotes, version=version, created_at=created_at)
+        self._ids = sorted(self._posts)
+        self._last_id = max(last_id, self._ids[-1] if self._ids else 0)
+        keys = {p.id: rank_keys(p) for p in self._posts.values()}
+        created = {p.id: p.created_at for p in self._posts.values()}
+        for (sort, _), ranking in self._rankings.items():
+            ranking.load({post_id: key[sort] for post_id, key in keys.items()}, created)
+
+        # Rows come in ID order, so parents are restored before their replies.
+        posts, index = self._posts, self._comments
+        for cid, post_id, parent_id, text, upvotes, downvotes in comments:
+            comment = Comment(cid, text, NO_CHILDREN, upvotes, downvotes)
+            if parent_id is None:
+                parent = None
+                posts[post_id].add_comment(comment)
+            else:
+                parent = index[parent_id][1]
+                parent.add_reply(comment)
+            index[cid] = (post_id, comment, parent)
+        if comments:
+            self._last_comment_id = max(self._last_comment_id, comments[-1][0])
+
+    def _thread(self, post_id: int, parent_id: int = None) -> RankIndex:
+        """
+        Return the ranking of the post's top-level comments or of the replies
+        to ``parent_id``, or None if there are none. Most threads are never
+        paged, so each is only indexed the first time it is.
+        """
+        thread = self._threads.get((post_id, parent_id))
+        if thread is not None:
+            return thread
+        if parent_id is None:
+            post = self._posts.get(post_id)
+            siblings = post.comments if post is not None else None
+        else:
+            entry = self._comments.get(parent_id)
+            siblings = entry[1].replies if entry is not None and entry[0] == post_id else None
+        if not siblings:
+            return None
+        self._threads[(post_id, parent_id)] = thread = RankIndex()
+        thread.load({c.id: c.upvotes - c.downvotes for c in siblings})
+        return thread
+
+
+class ChatLog:
+    """
+    Fixed-capacity ring buffer of chat messages with monotonic IDs.
+    Messages pushed out of the buffer are appended to ``archive_path`` as
+    JSON lines when one is configured, and dropped otherwise.
+    """
+
+    def __init__(self, capacity: int = 500, archive_path: str = None):
+        self._messages = deque(maxlen=capacity)
+        self._last_id = 0
+        self._lock = threading.Lock()
+        self.archive_path = archive_path
+
+    def __iter__(self):
+        return iter(list(self._messages))
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    @property
+    def last_id(self) -> int:
+        return self._last_id
+
+    def append(self, username: str, message: str) -> ChatMessage:
+        with self._lock:
+            self._last_id += 1
+            new_message = ChatMessage(self._last_id, username, message, time.time())
+            if len(self._messages) == self._messages.maxlen:
+                self._spill(self._messages[0])
+            self._messages.append(new_message)
+        return new_message
+
+    def load(self, messages, last_id: int) -> None:
+        """Replace the buffered messages, oldest first, and continue IDs after ``last_id``."""
+        with self._lock:
+            self._messages.clear()
+            self._messages.extend(ChatMessage(*message) for message in messages)
+            self._last_id = last_id
+
+    def since(self, after: int) -> list:
+        """Return the buffered messages with an ID greater than ``after``."""
+        with self._lock:
+            count = min(max(self._last_id - after, 0), len(self._messages))
+            return list(islice(reversed(self._messages), count))[::-1]
+
+    def _spill(self, message: ChatMessage) -> None:
+        if not self.archive_path:
+            return
+        try:
+            with open(self.archive_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(message.to_dict()) + '\n')
+        except OSError as e:
+            logger.error("Error archiving chat message: %s", e)
+
+
+class MemoryStorage(Storage):
+    """
+    Process-local storage. Everything is lost when the process exits unless
+    it is saved with snapshot.write_snapshot() and restored at startup.
+    Writes are serialised by a lock, so it is safe under threads but cannot be
+    shared between worker processes; use SQLiteStorage for that.
+    """
+
+    def __init__(self, chat_capacity: int = 500, chat_archive_path: str = None):
+        self._lock = threading.RLock()
+        self.posts = PostStore()
+        self.chat = ChatLog(capacity=chat_capacity, archive_path=chat_archive_path)
+        self.users = {}
+        # voter -> {(kind, target ID): "up" or "down"}
+        self.votes = {}
+        # upload file name -> {sha256, size, posts: IDs of the posts using it}
+        self.media = {}
+        # owner -> set of saved post IDs, and the same IDs sorted for paging
+        self.saved = {}
+        self._saved_order = {}
+        self.comment_id_counter = 1
+        # Bumped under the lock by every write, see change_version(). It
+        # starts over in a new process, hence the epoch.
+        self._changes = 0
+        self.epoch = format(time.time_ns(), 'x')
+        for username, password in DEFAULT_USERS.items():
+            self.create_user(username, password)
+
+    def check_user(self, username: str, password: str) -> bool:
+        password_hash = self.users.get(username)
+        return password_hash is not None and check_password_hash(password_hash, password)
+
+    def create_user(self, username: str, password: str) -> bool:
+        password_hash = generate_password_hash(password)
+        with self._lock:
+            if username in self.users:
+                return False
+            self.users[username] = password_hash
+            return True
+
+    def next_comment_id(self) -> int:
+        with self._lock:
+            cid = self.comment_id_counter
+            self.comment_id_counter += 1
+            return cid
+
+    def create_post(self, title: str, text: str, filename: str = None, filetype: str = None,
+                    sha256: str = None, size: int = None) -> Post:
+        with self._lock:
+            self._changes += 1
+            post = self.posts.add(new_post(self.posts.next_id(), title, text, filename, filetype))
+            if sha256 is not None:
+                entry = self.media.setdefault(filename, {'sha256': sha256, 'size': size, 'posts': set()})
+                entry['posts'].add(post['id'])
+            return post
+
+    def get_post(self, post_id: int) -> Post:
+        return self.posts.get(post_id)
+
+    def get_posts(self, post_ids) -> list:
+        found = (self.posts.get(pid) for pid in sorted(set(post_ids)))
+        return [post for post in found if post is not None]
+
+    def page_posts(self, before=None, limit: int = 20, sort: str = "new", window: str = "all") -> tuple:
+        if sort == "new":
+            return self.posts.page(before=before, limit=limit)
+        with self._lock:
+            return self.posts.ranked_page(sort, window, before=before, limit=limit)
+
+    def touch_post(self, post_id: int) -> None:
+        with self._lock:
+            post = self.posts.get(post_id)
+            if post is not None:
+                post['version'] += 1
+                self._changes += 1
+
+    def add_comment(self, post_id: int, text: str, parent_id: int = None) -> Comment:
+        with self._lock:
+            post = self.posts.get(post_id)
+            if post is None:
+                return None
+            parent = None
+            if parent_id is not None:
+                parent = self.posts.find_comment(post_id, parent_id)
+                if parent is None:
+                    return None
+            comment = self.posts.add_comment(post, new_comment(self.next_comment_id(), text), parent)
+            post['version'] += 1
+            self._changes += 1
+            return comment
+
+    def comment_page(self, post_id: int, parent_id: int = None, before: tuple = None, limit: int = 20,
+                     replies: int = 3, depth: int = 2) -> tuple:
+        with self._lock:
+            if self.posts.get(post_id) is None:
+                return None
+            if parent_id is not None and self.posts.find_comment(post_id, parent_id) is None:
+                return None
+            page, next_cursor = self.posts.children(post_id, parent_id, before, limit)
+            attach_replies(page, lambda cid, n: self.posts.children(post_id, cid, None, n), replies, depth)
+            return page, next_cursor
+
+    def _vote_target(self, kind: str, post_id: int, target_id: int) -> Record:
+        if kind == "post":
+            return self.posts.get(post_id)
+        return self.posts.find_comment(post_id, target_id)
+
+    def score(self, kind: str, post_id: int, target_id: int) -> int:
+        target = self._vote_target(kind, post_id, target_id)
+        return None if target is None else target['upvotes'] - target['downvotes']
+
+    def get_vote(self, voter: str, kind: str, target_id: int) -> str:
+        cast = self.votes.get(voter)
+        return cast.get((kind, target_id)) if cast else None
+
+    def record_votes(self, votes: list) -> None:
+        with self._lock:
+            for voter, kind, post_id, target_id, action in votes:
+                cast = self.votes.setdefault(voter, {})
+                old = cast.get((kind, target_id))
+                target = self._vote_target(kind, post_id, target_id)
+                if old == action or target is None:
+                    continue
+                self._change_score(kind, post_id, target, *vote_change(old, action))
+                cast[(kind, target_id)] = action
+
+    def _change_score(self, kind: str, post_id: int, target: Record, up: int, down: int) -> None:
+        target['upvotes'] += up
+        target['downvotes'] += down
+        post = self.posts.get(post_id)
+        post['version'] += 1
+        self._changes += 1
+        if kind == "post":
+            self.posts.rerank(post)
+        else:
+            self.posts.rerank_comment(post_id, target)
+
+    def transfer_owner(self, old: str, new: str) -> None:
+        with self._lock:
+            self.add_saved(new, self._saved_order.pop(old, []))
+            self.saved.pop(old, None)
+            cast = self.votes.setdefault(new, {})
+            for (kind, target_id), action in self.votes.pop(old, {}).items():
+                if (kind, target_id) not in cast:
+                    cast[(kind, target_id)] = action
+                    continue
+                post_id = target_id if kind == "post" else self.posts.comment_post_id(target_id)
+                self._change_score(kind, post_id, self._vote_target(kind, post_id, target_id),
+                                   *vote_change(action, None))
+
+    def media_refs(self, filename: str) -> int:
+        with self._lock:
+            entry = self.media.get(filename)
+            return len(entry['posts']) if entry else 0
+
+    def add_chat_message(self, username: str, message: str) -> ChatMessage:
+        with self._lock:
+            self._changes += 1
+            return self.chat.append(username, message)
+
+    def toggle_saved(self, owner: str, post_id: int) -> bool:
+        with self._lock:
+            if self.posts.get(post_id) is None:
+                return None
+            saved = self.saved.setdefault(owner, set())
+            order = self._saved_order.setdefault(owner, [])
+            self._changes += 1
+            if post_id in saved:
+                saved.discard(post_id)
+                del order[bisect_left(order, post_id)]
+                return False
+            saved.add(post_id)
+            insort(order, post_id)
+            return True
+
+    def add_saved(self, owner: str, post_ids) -> None:
+        with self._lock:
+            saved = self.saved.setdefault(owner, set())
+            order = self._saved_order.setdefault(owner, [])
+            for post_id in set(post_ids) - saved:
+                if self.posts.get(post_id) is not None:
+                    saved.add(post_id)
+                    insort(order, post_id)
+                    self._changes += 1
+
+    def saved_among(self, owner: str, post_ids) -> set:
+        saved = self.saved.get(owner)
+        if not saved:
+            return set()
+        return {post_id for post_id in post_ids if post_id in saved}
+
+    def saved_page(self, owner: str, before: int = None, limit: int = 20) -> tuple:
+        with self._lock:
+            order = self._saved_order.get(owner, [])
+            end = len(order) if before is None else bisect_left(order, before)
+            start = max(end - limit, 0)
+            page_ids = order[start:end][::-1]
+        page = [self.posts.get(post_id) for post_id in page_ids]
+        return page, (page_ids[-1] if start > 0 else None)
+
+    def recent_chat(self) -> list:
+        return list(self.chat)
+
+    def chat_since(self, after: int) -> list:
+        return self.chat.since(after)
+
+    def last_chat_id(self) -> int:
+        return self.chat.last_id
+
+    def change_version(self) -> int:
+        return self._changes
+
+    def stats(self) -> dict:
+        return {
+            'posts': len(self.posts),
+            'comments': self.posts.comment_count,
+            'chat_messages': len(self.chat)
+        }
+
+    def export_state(self) -> dict:
+        """
+        Return everything stored as plain tuples, lists and scalars, for
+        snapshot.write_snapshot(). Writers wait while it is taken.
+        """
+        with self._lock:
+            posts, comments = self.posts.export()
+            return {
+                'posts': posts,
+                'comments': comments,
+                'users': list(self.users.items()),
+                'votes': [(voter, kind, target_id, action) for voter, cast in self.votes.items()
+                          for (kind, target_id), action in cast.items()],
+                'media': [(name, m['sha256'], m['size'], tuple(sorted(m['posts']))) for name, m in self.media.items()],
+                'saved': [(owner, post_id) for owner, ids in self.saved.items() for post_id in ids],
+                'chat': [(m.id, m.username, m.message, m.timestamp) for m in self.chat],
+                'last_chat_id': self.chat.last_id,
+                'last_post_id': self.posts.last_id,
+                'comment_id_counter': self.comment_id_counter,
+            }
+
+    def load_state(self, state: dict) -> None:
+        """Replace the contents of a freshly opened store with an export_state() result."""
+        # Millions of records are allocated below; without pausing the cyclic
+        # GC, each collection would rescan everything allocated so far.
+        # Freezing afterwards keeps later collections from rescanning them.
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self._load_state(state)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        gc.freeze()
+
+    def _load_state(self, state: dict) -> None:
+        with self._lock:
+            self.posts = PostStore()
+            self.posts.load(state['posts'], state['comments'], state['last_post_id'])
+            self.users = dict(state['users'])
+            self.votes = {}
+            for voter, kind, target_id, action in state['votes']:
+                self.votes.setdefault(voter, {})[(kind, target_id)] = action
+            self.media = {name: {'sha256': sha256, 'size': size, 'posts': set(post_ids)}
+                          for name, sha256, size, post_ids in state['media']}
+            self.saved, self._saved_order = {}, {}
+            for owner, post_id in state['saved']:
+                self.saved.setdefault(owner, set()).add(post_id)
+            for owner, ids in self.saved.items():
+                self._saved_order[owner] = sorted(ids)
+            self.chat.load(state['chat'], state['last_chat_id'])
+            self.comment_id_counter = state['comment_id_counter']
+            self._changes += 1
+
+    def search_documents(self, kind: str, after: int, limit: int) -> list:
+        with self._lock:
+            if kind == "post":
+                return self.posts.since(after, limit)
+            if kind == "comment":
+                return [{'id': c['id'], 'post_id': pid, 'text': c['text']}
+                        for pid, c in self.posts.comments_since(after, limit)]
+            return self.chat.since(after)[:limit]
+
+
+# ------------------ SQLite Backend ------------------
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL,
+    text TEXT NOT NULL,
+    filename TEXT,
+    filetype TEXT,
+    upvotes INTEGER NOT NULL DEFAULT 0,
+    downvotes INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    hot REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS comments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    post_id INTEGER NOT NULL REFERENCES posts(id),
+    parent_id INTEGER REFERENCES comments(id),
+    text TEXT NOT NULL,
+    upvotes INTEGER NOT NULL DEFAULT 0,
+    downvotes INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    reply_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS comments_by_post ON comments(post_id, id);
+CREATE INDEX IF NOT EXISTS comments_by_parent ON comments(parent_id);
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password_hash TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS votes (
+    voter TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    target_id INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    PRIMARY KEY (voter, kind, target_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS votes_by_target ON votes(kind, target_id);
+CREATE TABLE IF NOT EXISTS media (
+    filename TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    size INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS media_refs (
+    filename TEXT NOT NULL REFERENCES media(filename),
+    post_id INTEGER NOT NULL REFERENCES posts(id),
+    PRIMARY KEY (filename, post_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS saved_posts (
+    owner TEXT NOT NULL,
+    post_id INTEGER NOT NULL REFERENCES posts(id),
+    PRIMARY KEY (owner, post_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS chat_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    message TEXT NOT NULL,
+    timestamp REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS windowed_top (
+    span TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    post_id INTEGER NOT NULL REFERENCES posts(id),
+    posted_at REAL NOT NULL,
+    PRIMARY KEY (span, score, post_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS windowed_top_by_age ON windowed_top(span, posted_at);
+CREATE INDEX IF NOT EXISTS windowed_top_by_post ON windowed_top(post_id);
+CREATE TABLE IF NOT EXISTS changes (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    version INTEGER NOT NULL,
+    epoch TEXT NOT NULL
+);
+INSERT OR IGNORE INTO changes (id, version, epoch) VALUES (0, 0, lower(hex(randomblob(8))));
+"""
+
+# Columns added since the first release of the schema, with their definitions
+# and the statement that fills them in for existing rows.
+SCHEMA_ADDITIONS = [
+    ("posts", "hot", "REAL NOT NULL DEFAULT 0", "UPDATE posts SET hot = hot_rank(upvotes, downvotes, created_at)"),
+    ("comments", "reply_count", "INTEGER NOT NULL DEFAULT 0",
+     "UPDATE comments SET reply_count = (SELECT COUNT(*) FROM comments AS r WHERE r.parent_id = comments.id)"),
+]
+
+# Indexes over the added columns, created once they exist. The ranked feeds
+# walk these in order, so a page costs an index seek plus the page itself.
+SCHEMA_INDEXES = """
+CREATE INDEX IF NOT EXISTS posts_by_hot ON posts(hot, id);
+CREATE INDEX IF NOT EXISTS posts_by_score ON posts(upvotes - downvotes, id);
+CREATE INDEX IF NOT EXISTS posts_by_created ON posts(created_at);
+CREATE INDEX IF NOT EXISTS comments_by_thread ON comments(post_id, parent_id, upvotes - downvotes, id);
+"""
+
+# Statements are constant strings so sqlite3's per-connection statement
+# cache prepares each of them only once.
+POST_COLUMNS = "id, title, text, filename, filetype, upvotes, downvotes, version, created_at"
+SQL_SELECT_POST = f"SELECT {POST_COLUMNS} FROM posts WHERE id = ?"
+SQL_PAGE_POSTS = f"SELECT {POST_COLUMNS} FROM posts WHERE id < ? ORDER BY id DESC LIMIT ?"
+SQL_PAGE_HOT = (f"SELECT {POST_COLUMNS}, hot FROM posts WHERE (hot, id) < (?, ?) "
+                "ORDER BY hot DESC, id DESC LIMIT ?")
+# Top pages are read in two index seeks, the rest of the cursor's score and
+# then lower scores, so long runs of equal scores are never scanned.
+SQL_PAGE_TOP_TIES = (f"SELECT {POST_COLUMNS}, upvotes - downvotes FROM posts "
+                     "WHERE upvotes - downvotes = ? AND id < ? ORDER BY id DESC LIMIT ?")
+SQL_PAGE_TOP = (f"SELECT {POST_COLUMNS}, upvotes - downvotes FROM posts "
+                "WHERE upvotes - downvotes < ? ORDER BY upvotes - downvotes DESC, id DESC LIMIT ?")
+# The day/week/month top feeds read a rank table per window instead of the
+# all-time score index, which would walk every older high-scoring post before
+# reaching a recent one. Rows are added with the post, follow its score, and
+# are pruned once the post is older than the window.
+SQL_PAGE_TOP_WINDOW = (f"SELECT {POST_COLUMNS}, score FROM windowed_top JOIN posts ON posts.id = post_id "
+                       "WHERE span = ? AND posted_at >= ? AND (score, post_id) < (?, ?) "
+                       "ORDER BY score DESC, post_id DESC LIMIT ?")
+SQL_INSERT_WINDOWED = "INSERT OR IGNORE INTO windowed_top (span, score, post_id, posted_at) VALUES (?, ?, ?, ?)"
+SQL_FILL_WINDOWED = ("INSERT OR IGNORE INTO windowed_top (span, score, post_id, posted_at) "
+                     "SELECT ?, upvotes - downvotes, id, created_at FROM posts WHERE created_at >= ?")
+SQL_VOTE_WINDOWED = "UPDATE windowed_top SET score = score + ? WHERE post_id = ?"
+SQL_PRUNE_WINDOWED = "DELETE FROM windowed_top WHERE span = ? AND posted_at < ?"
+SQL_INSERT_POST = "INSERT INTO posts (title, text, filename, filetype, created_at, hot) VALUES (?, ?, ?, ?, ?, ?)"
+SQL_VOTE_POST = ("UPDATE posts SET upvotes = upvotes + ?1, downvotes = downvotes + ?2, version = version + 1, "
+                 "hot = hot_rank(upvotes + ?1, downvotes + ?2, created_at) WHERE id = ?3")
+SQL_POST_SCORE = "SELECT upvotes - downvotes FROM posts WHERE id = ?"
+SQL_BUMP_POST = "UPDATE posts SET version = version + 1 WHERE id = ?"
+SQL_SELECT_COMMENTS = "SELECT id, parent_id, text, upvotes, downvotes FROM comments WHERE post_id = ? ORDER BY id"
+SQL_COMMENT_POST = "SELECT post_id FROM comments WHERE id = ?"
+SQL_INSERT_COMMENT = "INSERT INTO comments (post_id, parent_id, text, created_at) VALUES (?, ?, ?, ?)"
+SQL_COUNT_REPLY = "UPDATE comments SET reply_count = reply_count + 1 WHERE id = ?"
+# One level of a thread (parent_id IS NULL for top-level comments), read in
+# two index seeks like the top feed.
+COMMENT_COLUMNS = "id, text, upvotes, downvotes, reply_count"
+SQL_THREAD_TIES = (f"SELECT {COMMENT_COLUMNS} FROM comments WHERE post_id = ? AND parent_id IS ? "
+                   "AND upvotes - downvotes = ? AND id < ? ORDER BY id DESC LIMIT ?")
+SQL_THREAD = (f"SELECT {COMMENT_COLUMNS} FROM comments WHERE post_id = ? AND parent_id IS ? "
+              "AND upvotes - downvotes < ? ORDER BY upvotes - downvotes DESC, id DESC LIMIT ?")
+SQL_VOTE_COMMENT = "UPDATE comments SET upvotes = upvotes + ?, downvotes = downvotes + ? WHERE id = ? AND post_id = ?"
+SQL_COMMENT_SCORE = "SELECT upvotes - downvotes FROM comments WHERE id = ? AND post_id = ?"
+SQL_SELECT_VOTE = "SELECT action FROM votes WHERE voter = ? AND kind = ? AND target_id = ?"
+SQL_UPSERT_VOTE = "INSERT OR REPLACE INTO votes (voter, kind, target_id, action) VALUES (?, ?, ?, ?)"
+SQL_VOTER_VOTES = "SELECT kind, target_id, action FROM votes WHERE voter = ?"
+SQL_DELETE_VOTER_VOTES = "DELETE FROM votes WHERE voter = ?"
+SQL_INSERT_MEDIA = "INSERT OR IGNORE INTO media (filename, sha256, size) VALUES (?, ?, ?)"
+SQL_INSERT_MEDIA_REF = "INSERT INTO media_refs (filename, post_id) VALUES (?, ?)"
+SQL_MEDIA_REFS = "SELECT COUNT(*) FROM media_refs WHERE filename = ?"
+SQL_INSERT_SAVED = "INSERT OR IGNORE INTO saved_posts (owner, post_id) VALUES (?, ?)"
+SQL_DELETE_SAVED = "DELETE FROM saved_posts WHERE owner = ? AND post_id = ?"
+SQL_TRANSFER_SAVED = "INSERT OR IGNORE INTO saved_posts (owner, post_id) SELECT ?, post_id FROM saved_posts WHERE owner = ?"
+SQL_DELETE_OWNER_SAVED = "DELETE FROM saved_posts WHERE owner = ?"
+SQL_SAVED_PAGE = "SELECT post_id FROM saved_posts WHERE owner = ? AND post_id < ? ORDER BY post_id DESC LIMIT ?"
+SQL_SELECT_USER = "SELECT password_hash FROM users WHERE username = ?"
+SQL_INSERT_USER = "INSERT OR IGNORE INTO users (username, password_hash) VALUES (?, ?)"
+SQL_INSERT_CHAT = "INSERT INTO chat_messages (username, message, timestamp) VALUES (?, ?, ?)"
+SQL_RECENT_CHAT = ("SELECT id, username, message, timestamp FROM "
+                   "(SELECT * FROM chat_messages ORDER BY id DESC LIMIT ?) ORDER BY id")
+SQL_CHAT_SINCE = ("SELECT id, username, message, timestamp FROM chat_messages "
+                  "WHERE id > ? ORDER BY id LIMIT ?")
+SQL_LAST_CHAT_ID = "SELECT COALESCE(MAX(id), 0) FROM chat_messages"
+SQL_BUMP_CHANGES = "UPDATE changes SET version = version + 1"
+SQL_CHANGE_VERSION = "SELECT version, epoch FROM changes"
+SQL_POSTS_SINCE = "SELECT id, title, text FROM posts WHERE id > ? ORDER BY id LIMIT ?"
+SQL_COMMENTS_SINCE = "SELECT id, post_id, text FROM comments WHERE id > ? ORDER BY id LIMIT ?"
+
+
+def post_from_row(row: tuple) -> Post:
+    return Post(row[0], row[1], row[2], row[3], row[4], upvotes=row[5], downvotes=row[6],
+                version=row[7], created_at=row[8])
+
+
+def chat_from_row(row: tuple) -> ChatMessage:
+    return ChatMessage(row[0], row[1], row[2], row[3])
+
+
+class SQLiteStorage(Storage):
+    """
+    Storage in a SQLite database using WAL journaling, so readers never block
+    the writer and several worker processes can share one file.
+    Connections are kept in a small pool and lent to one thread at a time,
+    so each keeps its PRAGMAs and prepared statements across requests even
+    when the server starts a thread per request. IDs come from AUTOINCREMENT and
+    counters are updated in place inside BEGIN IMMEDIATE transactions, so
+    concurrent threads and processes never see duplicate IDs or lose votes.
+    """
+
+    def __init__(self, path: str, chat_capacity: int = 500, pool_size: int = 16):
+        self.path = path
+        self.chat_capacity = chat_capacity
+        # Idle connections; the most recently used is lent first.
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        with self._read() as conn:
+            conn.executescript(SCHEMA)
+            self._add_missing_columns(conn)
+            conn.executescript(SCHEMA_INDEXES)
+            self.epoch = conn.execute(SQL_CHANGE_VERSION).fetchone()[1]
+            missing_users = [username for username in DEFAULT_USERS
+                             if conn.execute(SQL_SELECT_USER, (username,)).fetchone() is None]
+        with self._write() as conn:
+            self._prune_windows(conn, time.time())
+            # Also ranks the recent posts of a database from before the table existed.
+            for window, seconds in TIMED_WINDOWS.items():
+                conn.execute(SQL_FILL_WINDOWED, (window, time.time() - seconds))
+        for username in missing_users:
+            self.create_user(username, DEFAULT_USERS[username])
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit mode: transactions are opened explicitly by _write().
+        # Pooled connections move between threads, one user at a time.
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.create_function("hot_rank", 3, hot_rank, deterministic=True)
+        return conn
+
+    @contextmanager
+    def _read(self):
+        """Borrow a connection from the pool, opening one if none is idle."""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def _add_missing_columns(self, conn: sqlite3.Connection) -> None:
+        """Bring a database created by an older version up to the current schema."""
+        for table, column, definition, backfill in SCHEMA_ADDITIONS:
+            columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                conn.execute(backfill)
+                conn.execute("COMMIT")
+
+    @staticmethod
+    def _prune_windows(conn: sqlite3.Connection, now: float) -> None:
+        """Drop the windowed top ranks of posts that have aged out of their window."""
+        for window, seconds in TIMED_WINDOWS.items():
+            conn.execute(SQL_PRUNE_WINDOWED, (window, now - seconds))
+
+    @contextmanager
+    def _write(self):
+        """
+        Run a write transaction. BEGIN IMMEDIATE takes the write lock up front
+        so a read-then-write transaction can't fail with "database is locked"
+        when another process writes in between. Every transaction that
+        changes a row bumps the change version, which all processes sharing
+        the file see; one that finds nothing to change (a missing post, say)
+        leaves it alone.
+        """
+        with self._read() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            changes = conn.total_changes
+            try:
+                yield conn
+                if conn.total_changes != changes:
+                    conn.execute(SQL_BUMP_CHANGES)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def check_user(self, username: str, password: str) -> bool:
+        with self._read() as conn:
+            row = conn.execute(SQL_SELECT_USER, (username,)).fetchone()
+        return row is not None and check_password_hash(row[0], password)
+
+    def create_user(self, username: str, password: str) -> bool:
+        with self._write() as conn:
+            cur = conn.execute(SQL_INSERT_USER, (username, generate_password_hash(password)))
+        return cur.rowcount == 1
+
+    def create_post(self, title: str, text: str, filename: str = None, filetype: str = None,
+                    sha256: str = None, size: int = None) -> Post:
+        created_at = time.time()
+        with self._write() as conn:
+            cur = conn.execute(SQL_INSERT_POST, (title, text, filename, filetype, created_at,
+                                                 hot_rank(0, 0, created_at)))
+            conn.executemany(SQL_INSERT_WINDOWED, [(window, 0, cur.lastrowid, created_at) for window in TIMED_WINDOWS])
+            self._prune_windows(conn, created_at)
+            if sha256 is not None:
+                conn.execute(SQL_INSERT_MEDIA, (filename, sha256, size))
+                conn.execute(SQL_INSERT_MEDIA_REF, (filename, cur.lastrowid))
+        post = new_post(cur.lastrowid, title, text, filename, filetype)
+        post['created_at'] = created_at
+        return post
+
+    def get_post(self, post_id: int) -> Post:
+        with self._read() as conn:
+            row = conn.execute(SQL_SELECT_POST, (post_id,)).fetchone()
+            if row is None:
+                return None
+            rows = conn.execute(SQL_SELECT_COMMENTS, (post_id,)).fetchall()
+        post = post_from_row(row)
+        # Parents always have smaller IDs than their replies, so one ordered
+        # pass is enough to rebuild the tree.
+        nodes = {}
+        for cid, parent_id, text, upvotes, downvotes in rows:
+            node = Comment(cid, text, upvotes=upvotes, downvotes=downvotes)
+            nodes[cid] = node
+            if parent_id is None:
+                post.add_comment(node)
+            else:
+                nodes[parent_id].add_reply(node)
+        return post
+
+    def get_posts(self, post_ids) -> list:
+        post_ids = sorted(set(post_ids))
+        if not post_ids:
+            return []
+        placeholders = ", ".join("?" * len(post_ids))
+        sql = f"SELECT {POST_COLUMNS} FROM posts WHERE id IN ({placeholders}) ORDER BY id"
+        with self._read() as conn:
+            return [post_from_row(row) for row in conn.execute(sql, post_ids)]
+
+    def page_posts(self, before=None, limit: int = 20, sort: str = "new", window: str = "all") -> tuple:
+        with self._read() as conn:
+            return self._page_posts(conn, before, limit, sort, window)
+
+    @staticmethod
+    def _page_posts(conn: sqlite3.Connection, before, limit: int, sort: str, window: str) -> tuple:
+        if sort == "new":
+            if before is None:
+                before = 2 ** 63 - 1
+            rows = conn.execute(SQL_PAGE_POSTS, (before, limit + 1)).fetchall()
+            page = [post_from_row(row) for row in rows[:limit]]
+            next_cursor = page[-1]['id'] if len(rows) > limit else None
+            return page, next_cursor
+        if sort == "hot":
+            key, before_id = before if before is not None else (math.inf, 2 ** 63 - 1)
+            rows = conn.execute(SQL_PAGE_HOT, (key, before_id, limit + 1)).fetchall()
+        elif TOP_WINDOWS[window] is not None:
+            key, before_id = before if before is not None else (2 ** 62, 2 ** 63 - 1)
+            since = time.time() - TOP_WINDOWS[window]
+            rows = conn.execute(SQL_PAGE_TOP_WINDOW, (window, since, key, before_id, limit + 1)).fetchall()
+        else:
+            rows = []
+            key = 2 ** 62
+            if before is not None:
+                key, before_id = before
+                rows = conn.execute(SQL_PAGE_TOP_TIES, (key, before_id, limit + 1)).fetchall()
+            if len(rows) <= limit:
+                rows += conn.execute(SQL_PAGE_TOP, (key, limit + 1 - len(rows))).fetchall()
+        # The sort key is selected after the post columns.
+        page = [post_from_row(row) for row in rows[:limit]]
+        next_cursor = (rows[limit - 1][-1], rows[limit - 1][0]) if len(rows) > limit else None
+        return page, next_cursor
+
+    def touch_post(self, post_id: int) -> None:
+        with self._write() as conn:
+            conn.execute(SQL_BUMP_POST, (post_id,))
+
+    def add_comment(self, post_id: int, text: str, parent_id: int = None) -> Comment:
+        with self._write() as conn:
+            if parent_id is not None:
+                row = conn.execute(SQL_COMMENT_POST, (parent_id,)).fetchone()
+                if row is None or row[0] != post_id:
+                    return None
+            elif conn.execute(SQL_POST_SCORE, (post_id,)).fetchone() is None:
+                return None
+            cur = conn.execute(SQL_INSERT_COMMENT, (post_id, parent_id, text, time.time()))
+            if parent_id is not None:
+                conn.execute(SQL_COUNT_REPLY, (parent_id,))
+            conn.execute(SQL_BUMP_POST, (post_id,))
+        return new_comment(cur.lastrowid, text)
+
+    def comment_page(self, post_id: int, parent_id: int = None, before: tuple = None, limit: int = 20,
+                     replies: int = 3, depth: int = 2) -> tuple:
+        with self._read() as conn:
+            if parent_id is not None:
+                row = conn.execute(SQL_COMMENT_POST, (parent_id,)).fetchone()
+                if row is None or row[0] != post_id:
+                    return None
+            elif conn.execute(SQL_POST_SCORE, (post_id,)).fetchone() is None:
+                return None
+            page, next_cursor = self._thread_level(conn, post_id, parent_id, before, limit)
+            attach_replies(page, lambda cid, n: self._thread_level(conn, post_id, cid, None, n), replies, depth)
+        return page, next_cursor
+
+    @staticmethod
+    def _thread_level(conn: sqlite3.Connection, post_id: int, parent_id: int, before: tuple, limit: int) -> tuple:
+        rows = []
+        score = 2 ** 62
+        if before is not None:
+            score, before_id = before
+            rows = conn.execute(SQL_THREAD_TIES, (post_id, parent_id, score, before_id, limit + 1)).fetchall()
+        if len(rows) <= limit:
+            rows += conn.execute(SQL_THREAD, (post_id, parent_id, score, limit + 1 - len(rows))).fetchall()
+        page = [{'id': r[0], 'text': r[1], 'replies': [], 'upvotes': r[2], 'downvotes': r[3],
+                 'reply_count': r[4], 'more_replies': None} for r in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = page[-1]
+            next_cursor = (last['upvotes'] - last['downvotes'], last['id'])
+        return page, next_cursor
+
+    def score(self, kind: str, post_id: int, target_id: int) -> int:
+        with self._read() as conn:
+            if kind == "post":
+                row = conn.execute(SQL_POST_SCORE, (post_id,)).fetchone()
+            else:
+                row = conn.execute(SQL_COMMENT_SCORE, (target_id, post_id)).fetchone()
+        return row[0] if row else None
+
+    def get_vote(self, voter: str, kind: str, target_id: int) -> str:
+        with self._read() as conn:
+            row = conn.execute(SQL_SELECT_VOTE, (voter, kind, target_id)).fetchone()
+        return row[0] if row else None
+
+    def record_votes(self, votes: list) -> None:
+        # Counters are adjusted against the stored vote inside the same
+        # transaction, so they always agree with the votes table even when
+        # several processes flush votes from the same voter.
+        with self._write() as conn:
+            for voter, kind, post_id, target_id, action in votes:
+                row = conn.execute(SQL_SELECT_VOTE, (voter, kind, target_id)).fetchone()
+                old = row[0] if row else None
+                if old == action:
+                    continue
+                if self._change_score(conn, kind, post_id, target_id, *vote_change(old, action)):
+                    conn.execute(SQL_UPSERT_VOTE, (voter, kind, target_id, action))
+
+    @staticmethod
+    def _change_score(conn: sqlite3.Connection, kind: str, post_id: int, target_id: int, up: int, down: int) -> int:
+        """Adjust the target's counters; returns 0 if it doesn't exist."""
+        if kind == "post":
+            updated = conn.execute(SQL_VOTE_POST, (up, down, post_id)).rowcount
+            conn.execute(SQL_VOTE_WINDOWED, (up - down, post_id))
+        else:
+            updated = conn.execute(SQL_VOTE_COMMENT, (up, down, target_id, post_id)).rowcount
+            if updated:
+                conn.execute(SQL_BUMP_POST, (post_id,))
+        return updated
+
+    def transfer_owner(self, old: str, new: str) -> None:
+        with self._write() as conn:
+            conn.execute(SQL_TRANSFER_SAVED, (new, old))
+            conn.execute(SQL_DELETE_OWNER_SAVED, (old,))
+            for kind, target_id, action in conn.execute(SQL_VOTER_VOTES, (old,)).fetchall():
+                if conn.execute(SQL_SELECT_VOTE, (new, kind, target_id)).fetchone() is None:
+                    conn.execute(SQL_UPSERT_VOTE, (new, kind, target_id, action))
+                    continue
+                if kind == "post":
+                    post_id = target_id
+                else:
+                    post_id = conn.execute(SQL_COMMENT_POST, (target_id,)).fetchone()[0]
+                self._change_score(conn, kind, post_id, target_id, *vote_change(action, None))
+            conn.execute(SQL_DELETE_VOTER_VOTES, (old,))
+
+    def media_refs(self, filename: str) -> int:
+        with self._read() as conn:
+            return conn.execute(SQL_MEDIA_REFS, (filename,)).fetchone()[0]
+
+    def add_chat_message(self, username: str, message: str) -> ChatMessage:
+        timestamp = time.time()
+        with self._write() as conn:
+            cur = conn.execute(SQL_INSERT_CHAT, (username, message, timestamp))
+        return ChatMessage(cur.lastrowid, username, message, timestamp)
+
+    def toggle_saved(self, owner: str, post_id: int) -> bool:
+        with self._write() as conn:
+            if conn.execute(SQL_POST_SCORE, (post_id,)).fetchone() is None:
+                return None
+            if conn.execute(SQL_DELETE_SAVED, (owner, post_id)).rowcount:
+                return False
+            conn.execute(SQL_INSERT_SAVED, (owner, post_id))
+            return True
+
+    def add_saved(self, owner: str, post_ids) -> None:
+        post_ids = [post['id'] for post in self.get_posts(post_ids)]
+        with self._write() as conn:
+            conn.executemany(SQL_INSERT_SAVED, [(owner, post_id) for post_id in post_ids])
+
+    def saved_among(self, owner: str, post_ids) -> set:
+        post_ids = set(post_ids)
+        if not post_ids:
+            return set()
+        # One primary key lookup per ID asked about, however many are saved.
+        placeholders = ", ".join("?" * len(post_ids))
+        sql = f"SELECT post_id FROM saved_posts WHERE owner = ? AND post_id IN ({placeholders})"
+        with self._read() as conn:
+            return {row[0] for row in conn.execute(sql, (owner, *post_ids))}
+
+    def saved_page(self, owner: str, before: int = None, limit: int = 20) -> tuple:
+        if before is None:
+            before = 2 ** 63 - 1
+        with self._read() as conn:
+            rows = conn.execute(SQL_SAVED_PAGE, (owner, before, limit + 1)).fetchall()
+        page = self.get_posts(row[0] for row in rows[:limit])[::-1]
+        return page, (rows[limit - 1][0] if len(rows) > limit else None)
+
+    def recent_chat(self) -> list:
+        with self._read() as conn:
+            return [chat_from_row(r) for r in conn.execute(SQL_RECENT_CHAT, (self.chat_capacity,))]
+
+    def chat_since(self, after: int) -> list:
+        # Like the in-memory ring buffer, never return more than the window.
+        with self._read() as conn:
+            last_id = conn.execute(SQL_LAST_CHAT_ID).fetchone()[0]
+            after = max(after, last_id - self.chat_capacity)
+            return [chat_from_row(r) for r in conn.execute(SQL_CHAT_SINCE, (after, self.chat_capacity))]
+
+    def last_chat_id(self) -> int:
+        with self._read() as conn:
+            return conn.execute(SQL_LAST_CHAT_ID).fetchone()[0]
+
+    def change_version(self) -> int:
+        with self._read() as conn:
+            return conn.execute(SQL_CHANGE_VERSION).fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._read() as conn:
+            return {
+                'posts': conn.execute("SELECT COUNT(*) FROM posts").fetchone()[0],
+                'comments': conn.execute("SELECT COUNT(*) FROM comments").fetchone()[0],
+                'chat_messages': conn.execute("SELECT COUNT(*) FROM chat_messages").fetchone()[0]
+            }
+
+    def search_documents(self, kind: str, after: int, limit: int) -> list:
+        with self._read() as conn:
+            if kind == "post":
+                rows = conn.execute(SQL_POSTS_SINCE, (after, limit))
+                return [{'id': r[0], 'title': r[1], 'text': r[2]} for r in rows]
+            if kind == "comment":
+                rows = conn.execute(SQL_COMMENTS_SINCE, (after, limit))
+                return [{'id': r[0], 'post_id': r[1], 'text': r[2]} for r in rows]
+            return [chat_from_row(r) for r in conn.execute(SQL_CHAT_SINCE, (after, limit))]
+
+
+# ------------------ Write-Behind Vote Aggregation ------------------
+class VoteBuffer:
+    """
+    Buffers votes in memory and writes them to storage in batches, either
+    every ``flush_interval`` seconds or once ``max_pending`` votes are
+    waiting. Scores returned by ``vote`` are provisional: the stored score
+    plus the net effect of the votes not yet flushed.
+
+    Each voter keeps a single vote per target, so repeating a vote is a no-op
+    and never reaches storage. Call ``close`` (registered with atexit by the
+    app) to flush what is left on shutdown.
+    """
+
+    def __init__(self, storage: Storage, flush_interval: float = 1.0, max_pending: int = 500):
+        self.storage = storage
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # Notified under _lock when a batch has been written.
+        self._flushed = threading.Condition(self._lock)
+        # Bumped when a flush starts and again when it ends, so it is odd
+        # while a batch is being written.
+        self._generation = 0
+        # (voter, kind, target ID) -> (post ID, action), latest vote wins
+        self._pending = {}
+        # (kind, target ID) -> net score change of the pending votes
+        self._pending_delta = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="vote-flusher", daemon=True)
+            self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Error flushing votes: %s", e)
+
+    def vote(self, voter: str, kind: str, post_id: int, target_id: int, action: str) -> int:
+        """Record a vote and return the provisional score, or None if the target doesn't exist."""
+        key = (voter, kind, target_id)
+        target = (kind, target_id)
+        while True:
+            with self._lock:
+                while self._generation % 2:
+                    self._flushed.wait()
+                generation = self._generation
+            # Storage is read without holding a lock. If a flush started or
+            # ended meanwhile, the reads may or may not include its batch, so
+            # they are retried; otherwise every vote is counted either in the
+            # stored score or in the pending deltas, never both.
+            base = self.storage.score(kind, post_id, target_id)
+            if base is None:
+                return None
+            stored = self.storage.get_vote(voter, kind, target_id)
+            with self._lock:
+                if self._generation != generation:
+                    continue
+                old = self._pending[key][1] if key in self._pending else stored
+                if action in ("up", "down") and action != old:
+                    up, down = vote_change(old, action)
+                    self._pending[key] = (post_id, action)
+                    self._pending_delta[target] = self._pending_delta.get(target, 0) + up - down
+                score = base + self._pending_delta.get(target, 0)
+                full = len(self._pending) >= self.max_pending
+                break
+        if full:
+            self.flush()
+        return score
+
+    def flush(self) -> int:
+        """Write the pending votes to storage; returns how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                flushing, self._pending = self._pending, {}
+                flushing_delta, self._pending_delta = self._pending_delta, {}
+                self._generation += 1
+            batch = [(voter, kind, post_id, target_id, action)
+                     for (voter, kind, target_id), (post_id, action) in flushing.items()]
+            try:
+                self.storage.record_votes(batch)
+            except Exception:
+                # Put the batch back so it is retried with the next flush.
+                with self._lock:
+                    for key, value in flushing.items():
+                        self._pending.setdefault(key, value)
+                    for target, delta in flushing_delta.items():
+                        self._pending_delta[target] = self._pending_delta.get(target, 0) + delta
+                raise
+            finally:
+                with self._lock:
+                    self._generation += 1
+                    self._flushed.notify_all()
+            return len(batch)
+
+
+def open_storage(url: str, **options) -> Storage:
+    """
+    Open the backend named by ``url``: "memory" or "sqlite:///path/to/forum.db".
+    """
+    if url == "memory":
+        return MemoryStorage(chat_capacity=options.get('chat_capacity', 500),
+                             chat_archive_path=options.get('chat_archive_path'))
+    if url.startswith("sqlite:///"):
+        path = url[len("sqlite:///"):]
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        return SQLiteStorage(path, chat_capacity=options.get('chat_capacity', 500))
+    raise ValueError(f"Unknown storage backend: {url}")
@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("FORUM_STORAGE", "memory")
+
+
+@pytest.fixture(scope="session")
+def forum_app(tmp_path_factory):
+    # The app creates its upload folder in the working directory.
+    os.chdir(tmp_path_factory.mktemp("app"))
+    import app
+    return app
@@ -0,0 +1,115 @@
+"""
+A smaller run of benchmarks/concurrency_stress.py: several threads (and, for
+SQLite, processes) create posts and comments and vote through a VoteBuffer
+at once; no ID may be handed out twice and no vote may be lost.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from storage import MemoryStorage, VoteBuffer, open_storage
+
+THREADS = 4
+OPS = 25
+
+
+def worker(store, votes: VoteBuffer, name: str, post_id: int, comment_id: int) -> tuple:
+    # Every voter first votes the other way, so only the replacing vote may count.
+    post_ids, comment_ids = [], []
+    for i in range(OPS):
+        post_ids.append(store.create_post(f"stress {i}", "")['id'])
+        comment_ids.append(store.add_comment(post_id, f"stress {i}")['id'])
+        voter = f"{name}-{i}"
+        action = 'up' if i % 4 else 'down'
+        votes.vote(voter, 'post', post_id, post_id, 'down' if action == 'up' else 'up')
+        votes.vote(voter, 'post', post_id, post_id, action)
+        votes.vote(voter, 'comment', post_id, comment_id, 'up')
+        votes.vote(voter, 'comment', post_id, comment_id, 'up')
+    return post_ids, comment_ids
+
+
+def run_threads(store, process: int, post_id: int, comment_id: int) -> tuple:
+    votes = VoteBuffer(store, flush_interval=0.01, max_pending=10)
+    votes.start()
+    try:
+        with ThreadPoolExecutor(max_workers=THREADS) as pool:
+            results = list(pool.map(lambda t: worker(store, votes, f"voter-{process}-{t}", post_id, comment_id),
+                                    range(THREADS)))
+    finally:
+        votes.close()
+    return ([pid for posts, _ in results for pid in posts],
+            [cid for _, comments in results for cid in comments])
+
+
+def run_process(url: str, process: int, post_id: int, comment_id: int) -> tuple:
+    return run_threads(open_storage(url), process, post_id, comment_id)
+
+
+def check(store, results: list, target: dict, seed: dict, workers: int):
+    post_ids = [pid for posts, _ in results for pid in posts]
+    comment_ids = [cid for _, comments in results for cid in comments]
+    total = workers * OPS
+    downs = workers * len(range(0, OPS, 4))
+    post = store.get_post(target['id'])
+    comment = next(c for c in post['comments'] if c['id'] == seed['id'])
+
+    assert len(set(post_ids)) == len(post_ids) == total
+    assert len(set(comment_ids + [seed['id']])) == total + 1
+    assert (post['upvotes'], post['downvotes']) == (total - downs, downs)
+    assert comment['upvotes'] == total
+
+
+def test_memory_threads():
+    store = MemoryStorage()
+    target = store.create_post("target", "")
+    seed = store.add_comment(target['id'], "target")
+    results = [run_threads(store, 0, target['id'], seed['id'])]
+    check(store, results, target, seed, THREADS)
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_sqlite_processes(tmp_path, processes):
+    url = "sqlite:///" + str(tmp_path / "stress.db")
+    store = open_storage(url)
+    target = store.create_post("target", "")
+    seed = store.add_comment(target['id'], "target")
+    if processes == 1:
+        results = [run_threads(store, 0, target['id'], seed['id'])]
+    else:
+        with multiprocessing.get_context("fork").Pool(processes) as pool:
+            results = pool.starmap(run_process, [(url, process, target['id'], seed['id'])
+                                                 for process in range(processes)])
+    check(store, results, target, seed, processes * THREADS)
+
+
+def test_provisional_scores_during_flushes():
+    # A vote read while a batch is being written must not count it twice.
+    store = MemoryStorage()
+    post_id = store.create_post("target", "")['id']
+    votes = VoteBuffer(store, max_pending=10 ** 9)
+    cast, too_high = [0], []
+    lock = threading.Lock()
+
+    def voter(t):
+        for i in range(200):
+            score = votes.vote(f"voter-{t}-{i}", 'post', post_id, post_id, 'up')
+            with lock:
+                cast[0] += 1
+                if score > cast[0]:
+                    too_high.append(score)
+
+    def flusher():
+        for _ in range(200):
+            votes.flush()
+
+    threads = [threading.Thread(target=voter, args=(t,)) for t in range(THREADS)]
+    threads.append(threading.Thread(target=flusher))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    votes.flush()
+    assert not too_high
+    assert store.score('post', post_id, post_id) == THREADS * 200
@@ -0,0 +1,18 @@
+import pytest
+
+from storage import open_storage
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    return open_storage("memory" if request.param == "memory" else "sqlite:///" + str(tmp_path / "forum.db"))
+
+
+def test_media_refs_are_per_post(store):
+    name = "ab" * 32 + ".png"
+    assert store.media_refs(name) == 0
+    first = store.create_post("first", "", name, "image", sha256="ab" * 32, size=9)
+    store.create_post("second", "", name, "image", sha256="ab" * 32, size=9)
+    store.create_post("no upload", "")
+    assert store.media_refs(name) == 2
+    assert store.get_post(first['id'])['filename'] == name
@@ -0,0 +1,49 @@
+import pytest
+
+from storage import open_storage
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    return open_storage("memory" if request.param == "memory" else "sqlite:///" + str(tmp_path / "forum.db"))
+
+
+def test_saved_among(store):
+    post_ids = [store.create_post(f"post {i}", "")['id'] for i in range(10)]
+    store.add_saved('user:a', post_ids[::3])
+    assert store.saved_among('user:a', post_ids[:5]) == {post_ids[0], post_ids[3]}
+    assert store.saved_among('user:b', post_ids) == set()
+
+
+def test_transfer_owner(store):
+    first, second = (store.create_post(f"post {i}", "")['id'] for i in range(2))
+    comment = store.add_comment(first, "comment")['id']
+    store.add_saved('session:x', [first])
+    store.add_saved('user:a', [second])
+    store.record_votes([('session:x', 'post', first, first, 'up'),
+                        ('session:x', 'post', second, second, 'up'),
+                        ('session:x', 'comment', first, comment, 'down'),
+                        ('user:a', 'post', second, second, 'down')])
+
+    store.transfer_owner('session:x', 'user:a')
+
+    assert store.saved_page('user:a')[0] == store.get_posts([second, first])[::-1]
+    assert store.saved_among('session:x', [first, second]) == set()
+    assert store.get_vote('user:a', 'post', first) == 'up'
+    assert store.get_vote('user:a', 'comment', comment) == 'down'
+    assert store.get_vote('session:x', 'post', first) is None
+    # Both had voted on the second post: the account's vote stands alone.
+    assert store.get_vote('user:a', 'post', second) == 'down'
+    assert store.score('post', second, second) == -1
+    assert store.score('post', first, first) == 1
+
+
+def test_login_keeps_anonymous_saves(forum_app):
+    forum_app.storage.create_user('saver', 'pw')
+    post_id = forum_app.storage.create_post("saved", "")['id']
+    client = forum_app.app.test_client()
+    client.post(f'/star/{post_id}')
+    client.post(f'/vote/post/{post_id}', json={'action': 'up'})
+    client.post('/login', data={'username': 'saver', 'password': 'pw'})
+    assert forum_app.storage.saved_among('user:saver', [post_id]) == {post_id}
+    assert forum_app.storage.get_vote('user:saver', 'post', post_id) == 'up'
@@ -0,0 +1,38 @@
+import pytest
+
+from storage import MemoryStorage, open_storage
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    return open_storage("memory" if request.param == "memory" else "sqlite:///" + str(tmp_path / "forum.db"))
+
+
+def page_ids(page):
+    return [(comment['id'], [reply['id'] for reply in comment['replies']]) for comment in page[0]]
+
+
+def test_comments_are_ranked_by_score(store):
+    post_id = store.create_post("thread", "")['id']
+    first, second, third = (store.add_comment(post_id, f"comment {i}")['id'] for i in range(3))
+    reply = store.add_comment(post_id, "reply", parent_id=first)['id']
+    store.record_votes([('a', 'comment', post_id, third, 'up'), ('b', 'comment', post_id, third, 'up'),
+                        ('a', 'comment', post_id, second, 'up')])
+    assert page_ids(store.comment_page(post_id)) == [(third, []), (second, []), (first, [reply])]
+    # Votes and comments after a thread was first paged keep it in order.
+    store.record_votes([('c', 'comment', post_id, first, 'up'), ('d', 'comment', post_id, first, 'up'),
+                        ('e', 'comment', post_id, first, 'up')])
+    fourth = store.add_comment(post_id, "comment 3")['id']
+    assert [cid for cid, _ in page_ids(store.comment_page(post_id))] == [first, third, second, fourth]
+
+
+def test_restored_threads_are_ranked():
+    store = MemoryStorage()
+    post_id = store.create_post("thread", "")['id']
+    first, second = (store.add_comment(post_id, f"comment {i}")['id'] for i in range(2))
+    reply = store.add_comment(post_id, "reply", parent_id=second)['id']
+    store.record_votes([('a', 'comment', post_id, second, 'up')])
+    restored = MemoryStorage()
+    restored.load_state(store.export_state())
+    assert page_ids(restored.comment_page(post_id)) == [(second, [reply]), (first, [])]
+    assert restored.comment_page(post_id, parent_id=first) == ([], None)
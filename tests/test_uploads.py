@@ -0,0 +1,52 @@
+import hashlib
+import os
+
+import pytest
+
+DATA = os.urandom(256 * 1024)
+DIGEST = hashlib.sha256(DATA).hexdigest()
+SIZE = len(DATA)
+MID = SIZE // 2
+
+
+@pytest.fixture(scope="module")
+def client(forum_app):
+    with open(os.path.join(forum_app.app.config['UPLOAD_FOLDER'], f"{DIGEST}.mp4"), 'wb') as f:
+        f.write(DATA)
+    return forum_app.app.test_client()
+
+
+@pytest.mark.parametrize("headers, status, body", [
+    ({}, 200, DATA),
+    ({'If-None-Match': f'"{DIGEST}"'}, 304, b""),
+    ({'Range': 'bytes=0-65535'}, 206, DATA[:65536]),
+    ({'Range': f'bytes={MID}-{MID + 1023}'}, 206, DATA[MID:MID + 1024]),
+    ({'Range': 'bytes=-1024'}, 206, DATA[-1024:]),
+    ({'Range': 'bytes=0-9', 'If-Range': f'"{DIGEST}"'}, 206, DATA[:10]),
+    ({'Range': 'bytes=0-9', 'If-Range': '"stale"'}, 200, DATA),
+], ids=["full", "revalidate", "first-64k", "middle", "suffix", "if-range-current", "if-range-stale"])
+def test_cached_and_ranged_responses(client, headers, status, body):
+    response = client.get(f"/uploads/{DIGEST}.mp4", headers=headers)
+    assert response.status_code == status
+    assert response.get_data() == body
+    assert response.headers['ETag'] == f'"{DIGEST}"'
+    assert 'immutable' in response.headers['Cache-Control']
+    if status == 206:
+        assert response.headers['Content-Range'].startswith('bytes ')
+    response.close()
+
+
+def test_unsatisfiable_range(client):
+    response = client.get(f"/uploads/{DIGEST}.mp4", headers={'Range': f'bytes={SIZE}-'})
+    assert response.status_code == 416
+    response.close()
+
+
+@pytest.mark.parametrize("partial", [f".{DIGEST}.part", f".{DIGEST}.w200.jpg.part", f"{DIGEST}.w200.jpg.part"])
+def test_in_progress_files_are_not_served(forum_app, client, partial):
+    # Uploads and previews being written sit in the same folder until renamed.
+    with open(os.path.join(forum_app.app.config['UPLOAD_FOLDER'], partial), 'wb') as f:
+        f.write(DATA[:1024])
+    response = client.get(f"/uploads/{partial}")
+    assert response.status_code == 404
+    response.close()
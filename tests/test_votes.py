@@ -0,0 +1,17 @@
+def test_cookieless_votes_count_once(forum_app):
+    post_id = forum_app.storage.create_post("votes", "")['id']
+    client = forum_app.app.test_client(use_cookies=False)
+    scores = [client.post(f'/vote/post/{post_id}', json={'action': 'up'}).get_json()['score']
+              for _ in range(5)]
+    assert scores == [1] * 5
+
+
+def test_logged_in_votes_are_separate(forum_app):
+    post_id = forum_app.storage.create_post("votes", "")['id']
+    anonymous = forum_app.app.test_client(use_cookies=False)
+    assert anonymous.post(f'/vote/post/{post_id}', json={'action': 'up'}).get_json() == {'score': 1}
+    user = forum_app.app.test_client()
+    with user.session_transaction() as session:
+        session['user'] = 'voter'
+    assert user.post(f'/vote/post/{post_id}', json={'action': 'up'}).get_json() == {'score': 2}
+    assert user.post(f'/vote/post/{post_id}', json={'action': 'down'}).get_json() == {'score': 0}
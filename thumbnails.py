@@ -0,0 +1,99 @@
+"""
+Background generation of downscaled previews for uploaded images and videos,
+so listings can show a small thumbnail instead of the original file.
+
+Image thumbnails need Pillow and video poster frames need the ``ffmpeg``
+binary. Both are optional: without them no previews are made and the
+listings fall back to what they showed before.
+"""
+import os
+import shutil
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Preview widths in pixels: the listing size and its 2x variant.
+THUMBNAIL_WIDTHS = (200, 400)
+
+
+def thumbnail_name(filename: str, width: int) -> str:
+    """Name of the ``width`` pixel preview of an uploaded file."""
+    return f"{os.path.splitext(filename)[0]}.w{width}.jpg"
+
+
+class ThumbnailWorker:
+    """
+    Thread pool that writes previews next to the uploads they belong to.
+    Uploads are content-addressed, so a preview that already exists is never
+    made twice. ``on_done(post_id)`` is called once new previews are written,
+    so cached markup that still points at the original can be refreshed.
+    """
+
+    def __init__(self, folder: str, on_done=None, max_workers: int = 2):
+        self.folder = folder
+        self.on_done = on_done
+        self.ffmpeg = shutil.which("ffmpeg")
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thumbnails")
+
+    def can_preview(self, filetype: str) -> bool:
+        return (filetype == 'image' and Image is not None) or (filetype == 'video' and self.ffmpeg is not None)
+
+    def path(self, filename: str, width: int) -> str:
+        return os.path.join(self.folder, thumbnail_name(filename, width))
+
+    def has_preview(self, filename: str, width: int) -> bool:
+        return os.path.exists(self.path(filename, width))
+
+    def submit(self, post_id: int, filename: str, filetype: str):
+        """Queue preview generation; returns the future, or None if there is nothing to do."""
+        if not filename or not self.can_preview(filetype):
+            return None
+        if all(self.has_preview(filename, w) for w in THUMBNAIL_WIDTHS):
+            return None
+        return self._pool.submit(self._generate, post_id, filename, filetype)
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=True)
+
+    def _generate(self, post_id: int, filename: str, filetype: str) -> None:
+        source = os.path.join(self.folder, filename)
+        try:
+            for width in THUMBNAIL_WIDTHS:
+                target = self.path(filename, width)
+                if os.path.exists(target):
+                    continue
+                # Write under a hidden temporary name, like uploads in progress,
+                # so a half-written preview is never served.
+                partial = os.path.join(self.folder, "." + os.path.basename(target) + ".part")
+                if filetype == 'image':
+                    self._image_thumbnail(source, partial, width)
+                else:
+                    self._video_poster(source, partial, width)
+                os.replace(partial, target)
+        except Exception as e:
+            logger.error("Error generating preview for %s: %s", filename, e)
+            return
+        if self.on_done is not None:
+            self.on_done(post_id)
+
+    @staticmethod
+    def _image_thumbnail(source: str, target: str, width: int) -> None:
+        with Image.open(source) as img:
+            img.thumbnail((width, width * 4))
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            img.save(target, 'JPEG', quality=80, optimize=True)
+
+    def _video_poster(self, source: str, target: str, width: int) -> None:
+        subprocess.run(
+            [self.ffmpeg, "-loglevel", "error", "-y", "-ss", "1", "-i", source,
+             "-frames:v", "1", "-vf", f"scale={width}:-2", "-c:v", "mjpeg", "-f", "image2", target],
+            check=True, timeout=60
+        )